@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Benchmarks the model file hashing strategies on synthetic files.
+
+Writes random files of each size to a temporary directory and hashes them with each strategy,
+reporting the best throughput of the runs. Unless `--warm` is passed, each file is dropped from the
+page cache before each run (where the platform supports it) to approximate hashing a model that
+isn't cached, which is the common case for a library of models.
+
+Like: python3 __benchmark_hash__.py --sizes 16 256 2048 --runs 3
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from py.log import COLORS
+from py.server.utils_hash import HASH_STRATEGIES, hash_file
+
+
+def hash_file_chunked(file_path: str) -> str:
+  """The original strategy, reading 128KB at a time, as a baseline."""
+  sha256_hash = hashlib.sha256()
+  with open(file_path, "rb") as f:
+    for byte_block in iter(lambda: f.read(1024 * 128), b""):
+      sha256_hash.update(byte_block)
+  return sha256_hash.hexdigest()
+
+
+def drop_from_cache(file_path: str):
+  """Drops the file from the page cache, where supported."""
+  if hasattr(os, 'posix_fadvise'):
+    with open(file_path, 'rb') as file:
+      os.fsync(file.fileno())
+      os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def write_file(file_path: str, size_mb: int):
+  """Writes a file of random data."""
+  with open(file_path, 'wb') as file:
+    for _ in range(size_mb):
+      file.write(os.urandom(1024 * 1024))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks the model file hashing strategies.')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[16, 256, 1024], help='Sizes, in MB.')
+  parser.add_argument('--runs', type=int, default=3, help='The runs of each strategy and size.')
+  parser.add_argument('--dir', default=None, help='The directory to write the files to.')
+  parser.add_argument('--warm', action='store_true', help="Don't drop files from the cache.")
+  args = parser.parse_args()
+
+  strategies = {
+    'chunked': hash_file_chunked,
+    **HASH_STRATEGIES,
+    'auto': hash_file,
+  }
+  tmp_dir = tempfile.mkdtemp(prefix='rgthree_hash_', dir=args.dir)
+  try:
+    print(f'{"size":>8}  {"strategy":<12} {"best":>10} {"MB/s":>8}')
+    for size_mb in args.sizes:
+      file_path = os.path.join(tmp_dir, f'{size_mb}mb.bin')
+      write_file(file_path, size_mb)
+      expected = None
+      for name, fn in strategies.items():
+        best = None
+        for _ in range(args.runs):
+          if not args.warm:
+            drop_from_cache(file_path)
+          start = time.perf_counter()
+          file_hash = fn(file_path)
+          elapsed = time.perf_counter() - start
+          best = elapsed if best is None else min(best, elapsed)
+          expected = expected or file_hash
+          if file_hash != expected:
+            raise AssertionError(f'{name} hashed {size_mb}MB differently.')
+        color = COLORS['BRIGHT_GREEN'] if name == 'auto' else COLORS['RESET']
+        print(
+          f'{color}{size_mb:>6}MB  {name:<12} {best * 1000:>8.1f}ms {size_mb / best:>8.0f}'
+          f'{COLORS["RESET"]}'
+        )
+      os.remove(file_path)
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main()
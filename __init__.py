@@ -42,7 +42,7 @@ from .py.power_lora_loader import RgthreePowerLoraLoader
 from .py.power_primitive import RgthreePowerPrimitive
 from .py.image_or_latent_size import RgthreeImageOrLatentSize
 from .py.image_resize import RgthreeImageResize
-from .py.power_puter import RgthreePowerPuter
+from .py.power_puter import RgthreePowerPuter, RgthreePowerPuterMap
 
 NODE_CLASS_MAPPINGS = {
   RgthreeBigContext.NAME: RgthreeBigContext,
@@ -69,6 +69,7 @@ NODE_CLASS_MAPPINGS = {
   RgthreeImageOrLatentSize.NAME: RgthreeImageOrLatentSize,
   RgthreeImageResize.NAME: RgthreeImageResize,
   RgthreePowerPuter.NAME: RgthreePowerPuter,
+  RgthreePowerPuterMap.NAME: RgthreePowerPuterMap,
 }
 
 if get_config_value('unreleased.dynamic_context.enabled') is True:
@@ -17,18 +17,21 @@ import operator as op
 import datetime
 import numpy as np
 import hashlib
+import sys
+import threading
 
+from collections import OrderedDict
 from typing import Any, Callable, Iterable, Optional, Union
-from types import MappingProxyType
+from types import MappingProxyType, SimpleNamespace
 
 from .constants import get_category, get_name
+from .config import get_config_value
 from .utils import ByPassTypeTuple, FlexibleOptionalInputType, any_type, get_dict_value
 from .log import log_node_error, log_node_warn, log_node_info
-
-from .power_lora_loader import RgthreePowerLoraLoader
-
-from nodes import ImageBatch
-from comfy_extras.nodes_latent import LatentBatch
+from .power_puter_sandbox_utils import SandboxUnavailable, get_sandbox_pool
+from .utils_rng import rng
+from .seed import new_random_seeds
+from . import power_puter_tensor_utils as tensor_utils
 
 
 class LoopBreak(Exception):
@@ -45,6 +48,10 @@ class LoopContinue(Exception):
     super().__init__('Cannot use "continue" outside of a loop.')
 
 
+class BudgetExceeded(Exception):
+  """Raised when the code exceeds one of its execution budgets, stopping the execution."""
+
+
 @dataclasses.dataclass(frozen=True)  # Note, kw_only=True is only python 3.10+
 class Function():
   """Function data.
@@ -75,24 +82,71 @@ def purge_vram(purge_models=True):
 
 
 def batch(*args):
-  """Batches multiple image or latents together."""
+  """Batches multiple image or latents together, including those in list or tuple args.
+
+  The result matches folding the items through the ImageBatch or LatentBatch nodes (items resized
+  to the first, and images padded to the most channels) but the shapes are checked once, only the
+  mismatched items are resized, and all are concatenated at once into a preallocated output rather
+  than copying the growing batch for every item.
+  """
+  import torch  # pylint: disable = import-outside-toplevel
+  import comfy.utils  # pylint: disable = import-outside-toplevel
 
   def check_is_latent(item) -> bool:
     return isinstance(item, dict) and 'samples' in item
 
-  args = list(args)
-  result = args.pop(0)
-  is_latent = check_is_latent(result)
-  node = LatentBatch() if is_latent else ImageBatch()
-
+  items = []
   for arg in args:
-    if is_latent != check_is_latent(arg):
+    if isinstance(arg, (list, tuple)):
+      items.extend(arg)
+    else:
+      items.append(arg)
+  if not items:
+    raise ValueError('batch() error: Expecting at least one "IMAGE" or "LATENT".')
+
+  is_latent = check_is_latent(items[0])
+  for item in items:
+    if is_latent != check_is_latent(item):
       raise ValueError(
         f'batch() error: Expecting "{"LATENT" if is_latent else "IMAGE"}"'
         f' but got "{"IMAGE" if is_latent else "LATENT"}".'
       )
-    result = node.batch(result, arg)[0]
-  return result
+
+  if is_latent:
+    tensors = [item['samples'] for item in items]
+    size = tensors[0].shape[1:]
+    tensors = [
+      t if t.shape[1:] == size else
+      comfy.utils.common_upscale(t, size[-1], size[-2], "bilinear", "center") for t in tensors
+    ]
+  else:
+    # Like ImageBatch, an image with fewer channels (RGB vs RGBA) is padded with an opaque alpha.
+    channels = max(t.shape[-1] for t in items)
+    tensors = [
+      t if t.shape[-1] == channels else
+      torch.nn.functional.pad(t, (0, channels - t.shape[-1]), mode='constant', value=1.0)
+      for t in items
+    ]
+    size = tensors[0].shape[1:]
+    tensors = [
+      t if t.shape[1:] == size else comfy.utils.common_upscale(
+        t.movedim(-1, 1), size[1], size[0], "bilinear", "center"
+      ).movedim(1, -1) for t in tensors
+    ]
+
+  device = tensors[0].device
+  dtype = tensors[0].dtype
+  for t in tensors[1:]:
+    dtype = torch.promote_types(dtype, t.dtype)
+  out = torch.empty((sum(t.shape[0] for t in tensors), *size), dtype=dtype, device=device)
+  torch.cat([t.to(device) for t in tensors], dim=0, out=out)
+
+  if not is_latent:
+    return out
+  batch_index = []
+  for item in items:
+    batch_index += item.get('batch_index', list(range(item['samples'].shape[0])))
+  return {**items[0], 'samples': out, 'batch_index': batch_index}
 
 
 _BUILTIN_FN_PREFIX = '__rgthreefn.'
@@ -110,6 +164,11 @@ def _get_built_in_fn_by_key(fn_key: str):
   return _BUILT_INS_BY_NAME_AND_KEY[fn_key]
 
 
+def _get_built_in_display_name(fn: Function) -> str:
+  """Returns the name of the built-in function as it's called in the code, like `random.int`."""
+  return fn.name[1:].replace('_', '.', 1) if fn.name.startswith('.') else fn.name
+
+
 def sha264(message: str):
   if isinstance(message, str):
     return hashlib.sha256(message.encode()).hexdigest()
@@ -121,11 +180,32 @@ _BUILT_IN_FNS_LIST = [
   Function(name="ceil", call=math.ceil, args=(1, 1)),
   Function(name="floor", call=math.floor, args=(1, 1)),
   Function(name="sqrt", call=math.sqrt, args=(1, 1)),
-  Function(name="min", call=min, args=(2, None)),
-  Function(name="max", call=max, args=(2, None)),
-  Function(name=".random_int", call=random.randint, args=(2, 2)),
-  Function(name=".random_choice", call=random.choice, args=(1, 1)),
-  Function(name=".random_seed", call=random.seed, args=(1, 1)),
+  Function(name="min", call=min, args=(1, None)),
+  Function(name="max", call=max, args=(1, None)),
+  Function(name="sum", call=sum, args=(1, 2)),
+  Function(name="any", call=any, args=(1, 1)),
+  Function(name="all", call=all, args=(1, 1)),
+  Function(name="next", call=next, args=(1, 2)),
+  Function(name=".random_int", call='_random_int', args=(2, 2)),
+  Function(name=".random_choice", call='_random_choice', args=(1, 1)),
+  Function(name=".random_seed", call='_random_seed', args=(1, 1)),
+  Function(name=".random_seeds", call='_random_seeds', args=(1, 1)),
+  # Tensors (vectorized, see power_puter_tensor_utils.py)
+  Function(name=".tensor_mean", call=tensor_utils.mean, args=(1, 3)),
+  Function(name=".tensor_std", call=tensor_utils.std, args=(1, 3)),
+  Function(name=".tensor_sum", call=tensor_utils.sum_, args=(1, 3)),
+  Function(name=".tensor_min", call=tensor_utils.min_, args=(1, 3)),
+  Function(name=".tensor_max", call=tensor_utils.max_, args=(1, 3)),
+  Function(name=".tensor_norm", call=tensor_utils.norm, args=(1, 4)),
+  Function(name=".tensor_quantile", call=tensor_utils.quantile, args=(2, 4)),
+  Function(name=".tensor_histogram", call=tensor_utils.histogram, args=(1, 4)),
+  Function(name=".tensor_clamp", call=tensor_utils.clamp, args=(1, 3)),
+  Function(name=".tensor_where", call=tensor_utils.where, args=(3, 3)),
+  Function(name=".tensor_gt", call=tensor_utils.gt, args=(2, 2)),
+  Function(name=".tensor_ge", call=tensor_utils.ge, args=(2, 2)),
+  Function(name=".tensor_lt", call=tensor_utils.lt, args=(2, 2)),
+  Function(name=".tensor_le", call=tensor_utils.le, args=(2, 2)),
+  Function(name=".tensor_eq", call=tensor_utils.eq, args=(2, 2)),
   Function(name="re", call=re.compile, args=(1, 1)),
   Function(name="len", call=len, args=(1, 1)),
   Function(name="enumerate", call=enumerate, args=(1, 1)),
@@ -140,6 +220,7 @@ _BUILT_IN_FNS_LIST = [
   Function(name="bool", call=bool, args=(1, 1)),
   Function(name="list", call=list, args=(1, 1)),
   Function(name="tuple", call=tuple, args=(1, 1)),
+  Function(name="set", call=set, args=(1, 1)),
   # Special
   Function(name="dir", call=dir, args=(1, 1)),
   Function(name="type", call=type, args=(1, 1)),
@@ -149,8 +230,9 @@ _BUILT_IN_FNS_LIST = [
   Function(name="node", call='_get_node', args=(0, 1)),
   Function(name="nodes", call='_get_nodes', args=(0, 1)),
   Function(name="input_node", call='_get_input_node', args=(0, 1)),
+  Function(name="output_nodes", call='_get_output_nodes', args=(0, 1)),
   Function(name="purge_vram", call=purge_vram, args=(0, 1)),
-  Function(name="batch", call=batch, args=(2, None)),
+  Function(name="batch", call=batch, args=(1, None)),
 ]
 
 _BUILT_INS_BY_NAME_AND_KEY = {
@@ -166,6 +248,13 @@ _BUILT_INS = MappingProxyType(
         'int': _get_built_in_fn_key(_BUILT_INS_BY_NAME_AND_KEY['.random_int']),
         'choice': _get_built_in_fn_key(_BUILT_INS_BY_NAME_AND_KEY['.random_choice']),
         'seed': _get_built_in_fn_key(_BUILT_INS_BY_NAME_AND_KEY['.random_seed']),
+        'seeds': _get_built_in_fn_key(_BUILT_INS_BY_NAME_AND_KEY['.random_seeds']),
+      }),
+    'tensor':
+      MappingProxyType({
+        fn.name[len('.tensor_'):]: _get_built_in_fn_key(fn)
+        for fn in _BUILT_IN_FNS_LIST
+        if fn.name.startswith('.tensor_')
       }),
     # Access all of datetime import.
     'datetime': datetime,
@@ -181,21 +270,53 @@ _BUILT_INS = MappingProxyType(
 # an attempt to call `tofile` or `dump` etc. would need to be blocked.
 _BLOCKED_METHODS_OR_ATTRS = MappingProxyType({np.ndarray: ['tofile', 'dump']})
 
+# Same as above, for torch.Tensor instances (from inputs or the `tensor` built-ins). These are
+# checked separately so torch isn't imported until a tensor could exist. Additionally, any in-place
+# method (like `mul_`) is blocked as the tensor is likely shared with the rest of the workflow.
+_BLOCKED_TENSOR_METHODS_OR_ATTRS = frozenset([
+  'storage', 'untyped_storage', 'data_ptr', 'share_memory_', 'register_hook', 'backward'
+])
+
+
+def _is_blocked_tensor_attr(item: Any, attr: Any) -> bool:
+  """Checks if the attr is blocked for item, if item is a torch.Tensor."""
+  torch = sys.modules.get('torch')
+  if torch is None or not isinstance(attr, str) or not isinstance(item, torch.Tensor):
+    return False
+  return attr in _BLOCKED_TENSOR_METHODS_OR_ATTRS or (attr[-1:] == '_' and attr[:2] != '__')
+
+
+def _get_power_lora_loader():
+  """Imports the Power Lora Loader when it's needed, as it needs ComfyUI (unlike the sandbox)."""
+  from .power_lora_loader import RgthreePowerLoraLoader  # pylint: disable = import-outside-toplevel
+  return RgthreePowerLoraLoader
+
+
 # Special functions by class type (called from the Attrs.)
 _SPECIAL_FUNCTIONS = {
-  RgthreePowerLoraLoader.NAME: {
+  get_name('Power Lora Loader'): {
     # Get a list of the enabled loras from a power lora loader.
-    "loras": RgthreePowerLoraLoader.get_enabled_loras_from_prompt_node,
-    "triggers": RgthreePowerLoraLoader.get_enabled_triggers_from_prompt_node,
+    "loras": lambda *args: _get_power_lora_loader().get_enabled_loras_from_prompt_node(*args),
+    "triggers": lambda *args: _get_power_lora_loader().get_enabled_triggers_from_prompt_node(*args),
   }
 }
 
+# Built-in functions, and special functions, that need ComfyUI itself so can't run in the sandbox.
+_SANDBOX_UNSUPPORTED = frozenset(['batch', 'purge_vram', 'loras', 'triggers'])
+
+# Built-in functions that look up nodes in the prompt (including `input_node`, which looks up the
+# prompt data of a linked node rather than its output). Using these is fine, but the output can
+# only be cached if we know the data looked up from the prompt is the same as the last execution.
+# See `_get_prompt_references` and `_get_prompt_fingerprint`.
+_PROMPT_LOOKUP_FUNCTIONS = ('node', 'nodes', 'output_nodes', 'input_node')
+
 # Series of regex checks for usage of a non-deterministic function. Using these is fine, but means
-# the output can't be cached because it's either random, or is associated with another node that is
-# not connected to ours (like looking up a node in the prompt). Using these means downstream nodes
-# would always be run; that is fine for something like a final JSON output, but less so for a prompt
-# text.
-_NON_DETERMINISTIC_FUNCTION_CHECKS = [r'(?<!input_)(nodes?)\(',]
+# the output can't be cached because it's associated with data outside of the prompt (like the
+# trigger words saved in a lora's info file). Using these means downstream nodes would always be
+# run; that is fine for something like a final JSON output, but less so for a prompt text.
+# Note, `random.seeds` draws new seeds from the node's stream, like the Seed node, so `random.seed`
+# doesn't make it deterministic.
+_NON_DETERMINISTIC_FUNCTION_CHECKS = [r'\.(triggers)\b', r'(?<!\.)\b(random\.seeds)\(']
 
 _OPERATORS = {
   # operator
@@ -233,10 +354,36 @@ _OPERATORS = {
 }
 
 _NODE_NAME = get_name("Power Puter")
+_MAP_NODE_NAME = get_name("Power Puter Map")
+# The most outputs the node has, as limited by the UI.
+_MAX_OUTPUTS = 10
+
+# The variables available to the code, set from the node's inputs of the same name.
+_INPUT_VARIABLES = tuple('abcdefghijklmnopqrstuvwxyz')
+
+# The execution budgets. A budget of 0 is unlimited, which is the default so existing code is
+# unaffected unless budgets are set in the config, or by the node.
+_BUDGETS = ('max_statements', 'max_loop_iterations', 'max_seconds', 'max_container_size')
+# The budgets that the lazy input analyzer evaluates `if` tests with, ahead of the execution. These
+# are fixed, and small, since a test that exceeds them is just decided when executed instead.
+_LAZY_TEST_BUDGETS = {
+  'max_statements': 10_000,
+  'max_loop_iterations': 10_000,
+  'max_seconds': 1,
+  'max_container_size': 1_000_000,
+}
+# The types whose length is checked against the `max_container_size` budget, and the operators
+# that could create a large one.
+_SIZED_TYPES = (str, bytes, list, tuple, dict, set)
+_SIZING_OPERATORS = (ast.Add, ast.Mult, ast.Pow, ast.LShift)
 
 
-def _update_code(code: str, unique_id: str, log=False):
-  """Updates the code to either newer syntax or general cleaning."""
+def _update_code(code: str) -> tuple[str, list[str]]:
+  """Updates the code to either newer syntax or general cleaning.
+
+  Returns the updated code and a list of deprecation warnings that should be logged when executed.
+  """
+  warnings = []
 
   # Change usage of `input_node` so the passed variable is a string, if it isn't. So, instead of
   # `input_node(a)` it needs to be `input_node('a')`
@@ -245,23 +392,577 @@ def _update_code(code: str, unique_id: str, log=False):
   # Update use of `random_int` to `random.int`
   srch = re.compile(r'random_int\(')
   if re.search(srch, code):
-    if log:
-      log_node_warn(
-        _NODE_NAME, f"Power Puter node #{unique_id} should update to use the `random.int`"
-        " built-in instead of `random_int`."
-      )
+    warnings.append('should update to use the `random.int` built-in instead of `random_int`.')
     code = re.sub(srch, 'random.int(', code)
 
   # Update use of `random_choice` to `random.choice`
   srch = re.compile(r'random_choice\(')
   if re.search(srch, code):
-    if log:
-      log_node_warn(
-        _NODE_NAME, f"Power Puter node #{unique_id} should update to use the `random.choice`"
-        " built-in instead of `random_choice`."
-      )
+    warnings.append('should update to use the `random.choice` built-in instead of `random_choice`.')
     code = re.sub(srch, 'random.choice(', code)
-  return code
+  return code, warnings
+
+
+def _get_code_settings(code: str) -> dict[str, Any]:
+  """Returns the node settings from `# puter: key=value` comments in the code.
+
+  This allows settings per node, like `# puter: max_seconds=5, max_loop_iterations=1000`.
+  """
+  settings = {}
+  for match in re.finditer(r'^[ \t]*#[ \t]*puter:(.*)$', code, re.MULTILINE):
+    for setting in re.split(r'[,\s]+', match.group(1).strip()):
+      key, sep, value = setting.partition('=')
+      if not key or not sep:
+        continue
+      try:
+        settings[key] = json.loads(value)
+      except ValueError:
+        settings[key] = value
+  return settings
+
+
+class _ParsedCode:
+  """Preprocessed code, with its lazily parsed module, shared across IS_CHANGED and main calls.
+
+  Attributes:
+    key: The sha256 hash of the original, unprocessed code.
+    code: The code after being updated by `_update_code`.
+    warnings: Any deprecation warnings found when updating the code.
+    settings: The node settings from `# puter:` comments in the code.
+  """
+
+  def __init__(self, key: str, code: str):
+    self.key = key
+    self.code, self.warnings = _update_code(code)
+    self.settings = _get_code_settings(self.code)
+    self._stripped_code = None
+    self._module = None
+    self._optimized_module = None
+    self._program = None
+    self._profiled_program = None
+    self._prompt_references = None
+    self._names = None
+
+  def get_stripped_code(self) -> str:
+    """Returns the code with string literals and comments stripped, for regex inspection."""
+    if self._stripped_code is None:
+      code = re.sub(r"'[^']+?'", "''", self.code)
+      code = re.sub(r'"[^"]+?"', '""', code)
+      self._stripped_code = re.sub(r'#.*\n', '\n', code)
+    return self._stripped_code
+
+  def get_module(self) -> ast.Module:
+    """Returns the parsed ast module, parsing only the first time it's asked for."""
+    if self._module is None:
+      self._module = ast.parse(self.code)
+    return self._module
+
+  def get_optimized_module(self) -> ast.Module:
+    """Returns the module after the `_Optimizer` pass, used to execute and analyze the code.
+
+    The original module is kept as-is for inspections that should see everything in the code.
+    """
+    if self._optimized_module is None:
+      self._optimized_module = _Optimizer().optimize(ast.parse(self.code))
+    return self._optimized_module
+
+  def get_names(self) -> frozenset[str]:
+    """Returns all of the names, and attribute names, referenced in the code."""
+    if self._names is None:
+      names = set()
+      for node in ast.walk(self.get_module()):
+        if isinstance(node, ast.Name):
+          names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+          names.add(node.attr)
+      self._names = frozenset(names)
+    return self._names
+
+  def get_prompt_references(self) -> list[tuple]:
+    """Returns the prompt node lookups the code makes, statically determined once."""
+    if self._prompt_references is None:
+      self._prompt_references = _get_prompt_references(self.get_module())
+    return self._prompt_references
+
+  def get_program(self, profiled: bool = False) -> '_Evaluator':
+    """Returns the module compiled into an evaluator, compiling only the first time asked.
+
+    A profiled program is compiled separately, so the unprofiled program has no overhead from it.
+    """
+    if profiled:
+      if self._profiled_program is None:
+        compiler = _Compiler(budgeted=True, profiled=True)
+        self._profiled_program = compiler.compile_module(self.get_optimized_module())
+      return self._profiled_program
+    if self._program is None:
+      self._program = _Compiler(budgeted=True).compile_module(self.get_optimized_module())
+    return self._program
+
+
+class _CodeCache:
+  """A bounded LRU cache of `_ParsedCode` keyed by the hash of the code.
+
+  Power Puter code rarely changes between prompts, so we only need to preprocess and parse it once
+  no matter how many Power Puter nodes, or how many queued prompts, evaluate it.
+  """
+
+  def __init__(self, max_size: int):
+    self.max_size = max(1, max_size)
+    self.hits = 0
+    self.misses = 0
+    self._entries: OrderedDict[str, _ParsedCode] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, code: str) -> _ParsedCode:
+    """Returns the `_ParsedCode` for the code, creating it if it's not already cached."""
+    key = hashlib.sha256(code.encode()).hexdigest()
+    with self._lock:
+      parsed = self._entries.get(key)
+      if parsed is not None:
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return parsed
+      self.misses += 1
+    parsed = _ParsedCode(key, code)
+    with self._lock:
+      self._entries[key] = parsed
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+    return parsed
+
+  def clear(self):
+    """Clears the cache and resets the counters."""
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self) -> dict[str, int]:
+    """Returns the size and hit/miss counts of the cache."""
+    return {
+      'size': len(self._entries),
+      'max_size': self.max_size,
+      'hits': self.hits,
+      'misses': self.misses,
+    }
+
+
+_CODE_CACHE = _CodeCache(get_config_value('nodes.power_puter.code_cache_size', 128))
+
+# Names that, if referenced in the code, mean its value may differ for the same inputs, or it has
+# side effects, so it shouldn't be memoized.
+_MEMO_UNSAFE_NAMES = frozenset(['random', 'now', 'strftime', 'print', 'purge_vram', 'triggers'])
+
+# The number of elements sampled from a tensor, or array, when fingerprinting it.
+_TENSOR_FINGERPRINT_SAMPLES = 4096
+
+
+def _fingerprint(value: Any, hasher) -> bool:
+  """Updates the hasher with a fingerprint of the value, returning False if it can't be.
+
+  Primitives and containers are fingerprinted by value. Tensors and arrays are fingerprinted by
+  their shape, dtype and a sample of their elements, rather than hashing them entirely.
+  """
+  if value is None or isinstance(value, (bool, int, float, complex)):
+    hasher.update(f'{type(value).__name__}:{value!r};'.encode())
+  elif isinstance(value, (str, bytes)):
+    data = value.encode() if isinstance(value, str) else value
+    hasher.update(f'{type(value).__name__}:{len(data)}:'.encode())
+    hasher.update(data)
+  elif isinstance(value, (list, tuple)):
+    hasher.update(f'{type(value).__name__}:{len(value)}:'.encode())
+    return all(_fingerprint(item, hasher) for item in value)
+  elif isinstance(value, dict):
+    hasher.update(f'dict:{len(value)}:'.encode())
+    return all(_fingerprint(k, hasher) and _fingerprint(v, hasher) for k, v in value.items())
+  elif isinstance(value, (set, frozenset)):
+    # Sets have no stable order, so fingerprint each item separately and sort them.
+    items = []
+    for item in value:
+      item_hasher = hashlib.sha256()
+      if not _fingerprint(item, item_hasher):
+        return False
+      items.append(item_hasher.digest())
+    hasher.update(f'{type(value).__name__}:{len(value)}:'.encode())
+    for item in sorted(items):
+      hasher.update(item)
+  elif isinstance(value, np.ndarray):
+    flat = value.reshape(-1)
+    if flat.size > _TENSOR_FINGERPRINT_SAMPLES:
+      flat = flat[::flat.size // _TENSOR_FINGERPRINT_SAMPLES][:_TENSOR_FINGERPRINT_SAMPLES]
+    hasher.update(f'ndarray:{value.shape}:{value.dtype};'.encode())
+    hasher.update(np.ascontiguousarray(flat).view(np.uint8).tobytes())
+  elif 'torch' in sys.modules and isinstance(value, sys.modules['torch'].Tensor):
+    torch = sys.modules['torch']
+    flat = value.detach().reshape(-1)
+    if flat.numel() > _TENSOR_FINGERPRINT_SAMPLES:
+      flat = flat[::flat.numel() // _TENSOR_FINGERPRINT_SAMPLES][:_TENSOR_FINGERPRINT_SAMPLES]
+    hasher.update(f'tensor:{tuple(value.shape)}:{value.dtype};'.encode())
+    hasher.update(flat.to('cpu').contiguous().view(torch.uint8).numpy().tobytes())
+  else:
+    return False
+  return True
+
+
+def _get_size(value: Any) -> int:
+  """Estimates the bytes held by the value, including the data of tensors and arrays."""
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if 'torch' in sys.modules and isinstance(value, sys.modules['torch'].Tensor):
+    return value.element_size() * value.numel()
+  size = sys.getsizeof(value)
+  if isinstance(value, dict):
+    size += sum(_get_size(k) + _get_size(v) for k, v in value.items())
+  elif isinstance(value, (list, tuple, set, frozenset)):
+    size += sum(_get_size(item) for item in value)
+  return size
+
+
+class _MemoCache:
+  """A bounded LRU cache of the values of executed code, keyed by the code and its inputs.
+
+  ComfyUI only caches the last output of a node, so alternating between a few input combinations
+  recomputes identical values. This is opt-in, since the values (tensors and all) are held in
+  memory, and only used for code that's deterministic given its inputs and the prompt nodes it
+  looks up.
+  """
+
+  def __init__(self, max_entries: int, max_bytes: int):
+    self.max_entries = max(1, max_entries)
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key: str) -> tuple[bool, Any]:
+    """Returns if the key was cached, and its value."""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return False, None
+      self.hits += 1
+      self._entries.move_to_end(key)
+      return True, entry[0]
+
+  def put(self, key: str, value: Any):
+    """Caches the value, evicting the least recently used values to stay within budget."""
+    size = _get_size(value)
+    if self.max_bytes and size > self.max_bytes:
+      return
+    with self._lock:
+      previous = self._entries.pop(key, None)
+      if previous is not None:
+        self.bytes -= previous[1]
+      self._entries[key] = (value, size)
+      self.bytes += size
+      while len(self._entries) > self.max_entries or self.bytes > (self.max_bytes or math.inf):
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self.bytes -= evicted_size
+        self.evictions += 1
+
+  def clear(self):
+    """Clears the cache and resets the counters."""
+    with self._lock:
+      self._entries.clear()
+      self.bytes = 0
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+
+  def stats(self) -> dict[str, int]:
+    """Returns the size, byte and hit/miss counts of the cache."""
+    return {
+      'size': len(self._entries),
+      'max_size': self.max_entries,
+      'bytes': self.bytes,
+      'max_bytes': self.max_bytes,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+    }
+
+
+_MEMO_CACHE = _MemoCache(
+  get_config_value('nodes.power_puter.memoize.max_entries', 256),
+  int(get_config_value('nodes.power_puter.memoize.max_mb', 512) * 1024 * 1024),
+)
+
+
+def _get_memo_key(code: _ParsedCode, ctx: dict[str, Any], prompt, unique_id) -> Optional[str]:
+  """Returns the memo key for the code and its inputs, or None if it shouldn't be memoized."""
+  if code.get_names() & _MEMO_UNSAFE_NAMES:
+    return None
+  hasher = hashlib.sha256(code.key.encode())
+  if not _fingerprint(ctx, hasher):
+    return None
+  references = code.get_prompt_references()
+  if references:
+    if not isinstance(prompt, dict):
+      return None
+    hasher.update(_get_prompt_fingerprint(references, prompt, unique_id).encode())
+  return hasher.hexdigest()
+
+
+def get_puter_cache_stats() -> dict[str, dict[str, int]]:
+  """Returns the stats of the Power Puter's code and memo caches."""
+  return {'code': _CODE_CACHE.stats(), 'memo': _MEMO_CACHE.stats()}
+
+
+def clear_puter_caches():
+  """Clears the Power Puter's code and memo caches."""
+  _CODE_CACHE.clear()
+  _MEMO_CACHE.clear()
+
+
+class _Profile:
+  """Evaluation counts and cumulative time of an execution by ast node type, line and built-in call.
+
+  Times are cumulative, so include those of nested nodes (like the statements in a `for` loop's
+  body being included in the time of the `For` node, and of its line).
+  """
+
+  def __init__(self):
+    self._started = time.perf_counter()
+    self.seconds = 0.0
+    self.types: dict[str, list] = {}
+    self.lines: dict[int, list] = {}
+    self.calls: dict[str, list] = {}
+
+  def record(self, node_type: str, line: Optional[int], seconds: float):
+    """Records the evaluation of a node, and its line if a statement."""
+    _add_profile_entry(self.types, node_type, seconds)
+    if line is not None:
+      _add_profile_entry(self.lines, line, seconds)
+
+  def record_call(self, name: str, seconds: float):
+    """Records a call to a built-in function, like `node()` or `batch()`."""
+    _add_profile_entry(self.calls, name, seconds)
+
+  def finish(self):
+    """Marks the end of the execution."""
+    self.seconds = time.perf_counter() - self._started
+
+  def get_report(self) -> dict[str, Any]:
+    """Returns the report of the profile, with each section sorted by the most time."""
+
+    def get_section(entries: dict) -> list[dict[str, Any]]:
+      return [{
+        'name': name,
+        'count': count,
+        'seconds': round(seconds, 6)
+      } for name, (count, seconds) in sorted(entries.items(), key=lambda e: e[1][1], reverse=True)]
+
+    return {
+      'seconds': round(self.seconds, 6),
+      'types': get_section(self.types),
+      'lines': get_section(self.lines),
+      'calls': get_section(self.calls),
+    }
+
+
+def _add_profile_entry(entries: dict, key: Any, seconds: float):
+  entry = entries.get(key)
+  if entry is None:
+    entries[key] = [1, seconds]
+  else:
+    entry[0] += 1
+    entry[1] += seconds
+
+
+# The most recent profile reports, by node id, for the `/rgthree/api/puter/profile` route.
+_MAX_PROFILE_REPORTS = 64
+_PROFILE_REPORTS: OrderedDict[str, list[dict[str, Any]]] = OrderedDict()
+_PROFILE_REPORTS_LOCK = threading.Lock()
+
+
+def _store_profile_reports(unique_id: str, reports: list[dict[str, Any]]):
+  with _PROFILE_REPORTS_LOCK:
+    _PROFILE_REPORTS[str(unique_id)] = reports
+    _PROFILE_REPORTS.move_to_end(str(unique_id))
+    while len(_PROFILE_REPORTS) > _MAX_PROFILE_REPORTS:
+      _PROFILE_REPORTS.popitem(last=False)
+
+
+def get_puter_profiles(unique_id: Optional[str] = None) -> dict[str, list[dict[str, Any]]]:
+  """Returns the most recent profile reports of Power Puter nodes, or just the node's if passed."""
+  with _PROFILE_REPORTS_LOCK:
+    if unique_id is not None:
+      return {str(unique_id): _PROFILE_REPORTS.get(str(unique_id), [])}
+    return dict(_PROFILE_REPORTS)
+
+
+def _estimate_length(operator: Callable[[Any, Any], Any], left: Any, right: Any) -> Optional[int]:
+  """Estimates the length (or digits) of a binary operation's result that could be very large."""
+  if operator is op.mul and isinstance(right, int) and isinstance(left, _SIZED_TYPES):
+    return len(left) * right
+  if operator is op.mul and isinstance(left, int) and isinstance(right, _SIZED_TYPES):
+    return len(right) * left
+  if isinstance(left, int) and isinstance(right, int) and right > 0:
+    if operator is op.pow and abs(left) > 1:
+      return int(right * math.log10(abs(left)))
+    if operator is op.lshift:
+      return int(right * math.log10(2))
+  return None
+
+
+class _ExecutionBudget:
+  """Tracks the work done by an execution, raising `BudgetExceeded` when over one of the limits.
+
+  The limits default to those in the config under `nodes.power_puter.budgets`, and can be set for
+  a node with a comment in its code, like `# puter: max_seconds=5`, higher or lower, but never
+  above those under `nodes.power_puter.budget_caps`. A limit, or cap, of 0 is unlimited. The clock
+  is sampled periodically and the time since the last sample is attributed to the line of the
+  statement being executed, so an exceeded budget can report where the time went without timing
+  every statement.
+
+  Note, the checks happen between statements and loop iterations, so a single long-running call
+  can't be interrupted; but it will be stopped as soon as it returns.
+  """
+
+  def __init__(
+    self,
+    settings: Optional[dict[str, Any]] = None,
+    limits: Optional[dict[str, float]] = None,
+  ):
+    """Creates the budget of the node's settings, or of the passed limits instead of the config."""
+    settings = settings or {}
+    self.limits: dict[str, float] = {}
+    for key in _BUDGETS:
+      if limits is not None:
+        self.limits[key] = limits.get(key) or 0
+        continue
+      limit = get_config_value(f'nodes.power_puter.budgets.{key}', 0) or 0
+      value = settings.get(key)
+      if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+        limit = value
+      cap = get_config_value(f'nodes.power_puter.budget_caps.{key}', 0) or 0
+      if cap:
+        limit = min(limit, cap) if limit else cap
+      self.limits[key] = limit
+    self.statements = 0
+    self.iterations = 0
+    self.line = 0
+    # The sampled seconds spent, by line.
+    self.lines: dict[int, float] = {}
+    self._max_statements = self.limits['max_statements'] or math.inf
+    self._max_iterations = self.limits['max_loop_iterations'] or math.inf
+    self._max_size = self.limits['max_container_size'] or math.inf
+    self._started = time.perf_counter()
+    self._sampled = self._started
+    max_seconds = self.limits['max_seconds']
+    self._deadline = self._started + max_seconds if max_seconds else math.inf
+
+  def step(self, line: int):
+    """Counts a statement on the line about to be executed."""
+    self.statements += 1
+    self.line = line
+    if self.statements > self._max_statements:
+      self._exceeded('max_statements')
+    # Sample at a prime interval, so we don't keep landing on the same line of a loop's body.
+    if not self.statements % 61:
+      self._sample()
+
+  def iterate(self):
+    """Counts a loop, or comprehension, iteration."""
+    self.iterations += 1
+    if self.iterations > self._max_iterations:
+      self._exceeded('max_loop_iterations')
+    if not self.iterations & 0xFF:
+      self._sample()
+
+  def _sample(self):
+    """Attributes the time since the last sample to the current line, and checks the deadline."""
+    now = time.perf_counter()
+    self.lines[self.line] = self.lines.get(self.line, 0.0) + now - self._sampled
+    self._sampled = now
+    if now > self._deadline:
+      self._exceeded('max_seconds')
+
+  def check_size(self, value: Any) -> Any:
+    """Checks the size of a created value against the container budget, returning the value."""
+    if isinstance(value, _SIZED_TYPES):
+      self.check_length(len(value), f'Created a {type(value).__name__} of size')
+    return value
+
+  def check_length(self, length: int, detail: str = 'Would create a value of size'):
+    """Checks a length, before or after it's created, against the container budget."""
+    if length > self._max_size:
+      self._exceeded('max_container_size', f' {detail} {length:,}.')
+
+  def operate(self, operator: Callable[[Any, Any], Any], left: Any, right: Any) -> Any:
+    """Applies a binary operator, checking the size of the result before it's created if we can.
+
+    Repeating a sequence, or raising an int to a large power, can exhaust memory before we'd have a
+    chance to check the result so those are estimated first.
+    """
+    if self._max_size is not math.inf:
+      size = _estimate_length(operator, left, right)
+      if size is not None:
+        self.check_length(size)
+    return self.check_size(operator(left, right))
+
+  def _exceeded(self, budget: str, detail: str = ''):
+    """Raises `BudgetExceeded` with a report of the work done, and where the time went."""
+    now = time.perf_counter()
+    self.lines[self.line] = self.lines.get(self.line, 0.0) + now - self._sampled
+    self._sampled = now
+    msg = (
+      f"Power Puter code exceeded its {budget} budget of {self.limits[budget]:,}.{detail}"
+      f" Executed {self.statements:,} statements and {self.iterations:,} loop iterations in"
+      f" {now - self._started:.2f}s."
+    )
+    if self.line:
+      msg += f' Stopped on line {self.line}.'
+    slowest = sorted(self.lines.items(), key=lambda item: item[1], reverse=True)[:3]
+    where = ', '.join(f'line {line} ({secs:.2f}s)' for line, secs in slowest if line)
+    if where:
+      msg += f' Most time was spent on {where}.'
+    raise BudgetExceeded(msg)
+
+
+# The variable of the row index, when evaluating in map mode.
+_MAP_ROW_VARIABLE = 'row'
+
+
+def _get_map_rows(setting: Any, ctx: dict[str, Any]) -> Optional[list[dict[str, Any]]]:
+  """Returns the ctx of each row to evaluate in map mode, or None if not mapping.
+
+  The rows are set in the code, mapping over a number of rows, like `# puter: map=10`, the list (or
+  tuple) inputs, like `# puter: map=ab` for inputs `a` and `b`, or all list inputs with `map=true`
+  (the default of the map node). Mapped inputs are zipped (so must be the same length) and other
+  inputs are the same for each row. Each row also has its index as `row`.
+  """
+  if setting is None or setting is False:
+    return None
+  if isinstance(setting, int) and not isinstance(setting, bool):
+    if setting < 0:
+      raise ValueError(f'Power Puter map must be zero or more rows, got {setting}.')
+    return [{**ctx, _MAP_ROW_VARIABLE: i} for i in range(setting)]
+
+  if setting is True:
+    names = [c for c in _INPUT_VARIABLES if isinstance(ctx.get(c), (list, tuple))]
+    if not names:
+      raise ValueError('Power Puter map=true requires at least one list input.')
+  else:
+    names = list(str(setting))
+    for name in names:
+      if name not in _INPUT_VARIABLES:
+        raise ValueError(f'Power Puter map has an unknown input "{name}".')
+      if not isinstance(ctx.get(name), (list, tuple)):
+        raise ValueError(f'Power Puter map input "{name}" is not a list.')
+
+  lengths = {name: len(ctx[name]) for name in names}
+  if len(set(lengths.values())) > 1:
+    raise ValueError(f'Power Puter map inputs must be the same length, got {lengths}.')
+  return [{
+    **ctx,
+    **{name: ctx[name][i] for name in names},
+    _MAP_ROW_VARIABLE: i,
+  } for i in range(next(iter(lengths.values())))]
 
 
 class RgthreePowerPuter:
@@ -274,7 +975,7 @@ class RgthreePowerPuter:
   def INPUT_TYPES(cls):  # pylint: disable = invalid-name, missing-function-docstring
     return {
       "required": {},
-      "optional": FlexibleOptionalInputType(any_type),
+      "optional": FlexibleOptionalInputType(any_type, lazy=_INPUT_VARIABLES),
       "hidden": {
         "unique_id": "UNIQUE_ID",
         "extra_pnginfo": "EXTRA_PNGINFO",
@@ -287,18 +988,21 @@ class RgthreePowerPuter:
   RETURN_NAMES = ByPassTypeTuple(("*",))
   FUNCTION = "main"
 
+  # Whether the code is evaluated for each row, as the map node does.
+  _is_map = False
+  _lazy_requested = None
+
   @classmethod
   def IS_CHANGED(cls, **kwargs):
-    """Forces a changed state if we could be unaware of data changes (like using `node()`)."""
+    """Returns a fingerprint of the prompt data the code looks up (like using `node()`), or forces
+    a changed state if we could be unaware of data changes (like an unseeded random call)."""
 
-    code = _update_code(kwargs['code'], unique_id=kwargs['unique_id'])
-    # Strip string literals and comments.
-    code = re.sub(r"'[^']+?'", "''", code)
-    code = re.sub(r'"[^"]+?"', '""', code)
-    code = re.sub(r'#.*\n', '\n', code)
+    parsed = _CODE_CACHE.get(kwargs['code'])
+    # Inspect the code with string literals and comments stripped.
+    code = parsed.get_stripped_code()
 
     # If we have a non-deterministic function, then we'll always consider ourself changed since we
-    # cannot be sure that the data would be the same (random, another unconnected node, etc).
+    # cannot be sure that the data would be the same (random, data outside the prompt, etc).
     for check in _NON_DETERMINISTIC_FUNCTION_CHECKS:
       matches = re.search(check, code)
       if matches:
@@ -329,11 +1033,64 @@ class RgthreePowerPuter:
           f" calls `random.seed` first. NOTE: Please ensure that the seed value is deterministic."
         )
 
+    # If we look up nodes in the prompt, then we're only changed if the data of those nodes is.
+    try:
+      references = parsed.get_prompt_references()
+    except SyntaxError:
+      references = None
+    if references:
+      prompt = _get_executing_prompt(kwargs)
+      if prompt is None:
+        # Without the executing prompt we can't fingerprint the lookups, so always run.
+        log_node_warn(
+          _NODE_NAME,
+          f"Note, Power Puter (node #{kwargs['unique_id']}) cannot be cached b/c it looks up"
+          " nodes in the prompt, but the executing prompt could not be determined."
+        )
+        return time.time()
+      return _get_prompt_fingerprint(references, prompt, kwargs['unique_id'])
+
     return 42
 
+  def check_lazy_status(self, **kwargs):
+    """Returns the inputs the code will read, given the inputs that have been evaluated so far.
+
+    Our inputs are lazy, so ComfyUI will only evaluate the upstream nodes of the inputs the code
+    actually reads on the path it takes, and call this again as they become available.
+    """
+    dynprompt = kwargs.get('dynprompt')
+    linked = _get_linked_inputs(dynprompt, kwargs.get('unique_id'))
+    if not linked:
+      return []
+
+    # An input we've requested that is still None was evaluated as None, rather than not evaluated
+    # yet. We keep track of what was requested for the current execution (dynprompt) only.
+    if self._lazy_requested is None or self._lazy_requested[0] is not dynprompt:
+      self._lazy_requested = (dynprompt, set())
+    requested = self._lazy_requested[1]
+
+    available = {
+      c: kwargs.get(c)
+      for c in _INPUT_VARIABLES
+      if c not in linked or kwargs.get(c) is not None or c in requested
+    }
+    code = _CODE_CACHE.get(kwargs['code'])
+    # In map mode the values are only known per row, so the path can't be decided ahead of time.
+    if self._is_map:
+      needed = linked
+    else:
+      try:
+        module = code.get_optimized_module()
+        needed = _LazyInputAnalyzer(module, available).analyze()
+      except Exception:  # pylint: disable = broad-exception-caught
+        # Request everything and let the main execution surface the error (like a SyntaxError).
+        needed = linked
+    needed = [c for c in needed if c in linked and c not in available]
+    requested.update(needed)
+    return needed
+
   def main(self, **kwargs):
     """Does the nodes' work."""
-    code = kwargs['code']
     unique_id = kwargs['unique_id']
     pnginfo = kwargs['extra_pnginfo']
     workflow = pnginfo["workflow"] if "workflow" in pnginfo else {"nodes": []}
@@ -349,21 +1106,68 @@ class RgthreePowerPuter:
 
     ctx = {}
     # Set variable names, defaulting to None instead of KeyErrors
-    for c in list('abcdefghijklmnopqrstuvwxyz'):
+    for c in _INPUT_VARIABLES:
       ctx[c] = kwargs[c] if c in kwargs else None
 
-    code = _update_code(kwargs['code'], unique_id=kwargs['unique_id'], log=True)
+    code = _CODE_CACHE.get(kwargs['code'])
+    for warning in code.warnings:
+      log_node_warn(_NODE_NAME, f"Power Puter node #{unique_id} {warning}")
 
-    eva = _Puter(
-      code=code,
-      ctx=ctx,
-      workflow=workflow,
-      prompt=prompt,
-      dynprompt=dynprompt,
-      unique_id=unique_id
+    puter = _Puter(
+      code=code, ctx=ctx, workflow=workflow, prompt=prompt, dynprompt=dynprompt, unique_id=unique_id
     )
-    values = eva.execute()
 
+    # In map mode, the code is evaluated for each row and each output is a list of the row values,
+    # which ComfyUI will map downstream nodes over.
+    rows = self._get_rows(code, ctx)
+    evaluate = lambda ctx: self._evaluate(puter, code, ctx, prompt, dynprompt, unique_id)
+    if rows is None:
+      response = self._get_response(evaluate(ctx), outputs)
+    else:
+      responses = [self._get_response(evaluate(row), outputs) for row in rows]
+      if not responses:
+        response = tuple([] for _ in outputs)
+      else:
+        response = tuple(list(values) for values in zip(*responses))
+
+    # When profiled, the reports (one per row in map mode) are sent to the UI too.
+    if puter.profiles:
+      _store_profile_reports(unique_id, puter.profiles)
+      return {"ui": {"puter_profile": puter.profiles}, "result": response}
+    return response
+
+  def _get_rows(self, code: _ParsedCode, ctx: dict[str, Any]) -> Optional[list[dict[str, Any]]]:
+    """Returns the ctx of each row to evaluate the code with, or None to evaluate it once."""
+    setting = code.settings.get('map')
+    if setting is not None and setting is not False:
+      raise ValueError(f'Power Puter map mode is the "{_MAP_NODE_NAME}" node.')
+    return None
+
+  def _evaluate(
+    self, puter: '_Puter', code: _ParsedCode, ctx: dict[str, Any], prompt, dynprompt, unique_id
+  ) -> Any:
+    """Evaluates the code with the ctx, from the memo cache, the sandbox or the puter."""
+    memo_key = None
+    if code.settings.get('memoize', get_config_value('nodes.power_puter.memoize.enabled', False)):
+      try:
+        memo_key = _get_memo_key(code, ctx, prompt, unique_id)
+      except SyntaxError:
+        memo_key = None
+    memoized, values = _MEMO_CACHE.get(memo_key) if memo_key else (False, None)
+
+    sandboxed = False
+    if not memoized and code.settings.get(
+      'sandbox', get_config_value('nodes.power_puter.sandbox.enabled', False)
+    ):
+      sandboxed, values = _execute_sandboxed(code, ctx, dynprompt, unique_id)
+    if not memoized and not sandboxed:
+      values = puter.execute(ctx=ctx)
+    if memo_key and not memoized:
+      _MEMO_CACHE.put(memo_key, values)
+    return values
+
+  def _get_response(self, values: Any, outputs: list[str]) -> tuple:
+    """Returns the response tuple of the value(s) from the code, cast as the output types."""
     # Check if we have multiple outputs that the returned value is a tuple and raise if not.
     if len(outputs) > 1 and not isinstance(values, tuple):
       t = re.sub(r'^<[a-z]*\s(.*?)>$', r'\1', str(type(values)))
@@ -417,79 +1221,177 @@ class RgthreePowerPuter:
     return tuple(response)
 
 
+class RgthreePowerPuterMap(RgthreePowerPuter):
+  """The Power Puter in map mode; evaluating the code for each row, each output a list of them.
+
+  ComfyUI maps downstream nodes over the list outputs, so one prompt can run a whole sweep.
+  """
+
+  NAME = _MAP_NODE_NAME
+  CATEGORY = get_category()
+  OUTPUT_IS_LIST = (True,) * _MAX_OUTPUTS
+
+  _is_map = True
+
+  def _get_rows(self, code: _ParsedCode, ctx: dict[str, Any]) -> Optional[list[dict[str, Any]]]:
+    rows = _get_map_rows(code.settings.get('map', True), ctx)
+    # Mapping turned off in the code is a single row, since the outputs are lists regardless.
+    return rows if rows is not None else [{**ctx, _MAP_ROW_VARIABLE: 0}]
+
+
+class _PromptNodeIndex:
+  """An index of the prompt nodes, by id, title and class_type, for fast lookups.
+
+  Nodes are expanded once from the dynamic prompt (or a plain API prompt dict) and then looked up by
+  key, rather than scanning every node of the prompt on each call from the code.
+
+  https://github.com/comfyanonymous/ComfyUI/blob/fc657f471a29d07696ca16b566000e8e555d67d1/comfy_execution/graph.py#L22
+
+  Attributes:
+    nodes: All of the prompt nodes, with their 'id' added.
+    by_id: The prompt nodes keyed by their id.
+    by_title: A list of the prompt nodes keyed by their title.
+    by_class_type: A list of the prompt nodes keyed by their class_type.
+    links_from: A list of the prompt nodes with an input linked from the keyed node id.
+  """
+
+  def __init__(self, prompt):
+    self.nodes: list[dict] = []
+    self.by_id: dict[str, dict] = {}
+    self.by_title: dict[str, list[dict]] = {}
+    self.by_class_type: dict[str, list[dict]] = {}
+    self.links_from: dict[str, list[dict]] = {}
+    self._by_pattern: dict[re.Pattern, list[dict]] = {}
+    self._positions: dict[str, int] = {}
+    if isinstance(prompt, dict):
+      for node_id, node in prompt.items():
+        self._add({'id': node_id} | {**node})
+    elif prompt:
+      for node_id in prompt.all_node_ids():
+        self._add({'id': node_id} | {**prompt.get_node(node_id)})
+
+  def _add(self, node: dict):
+    """Adds a node to the index."""
+    self._positions[node['id']] = len(self.nodes)
+    self.nodes.append(node)
+    self.by_id[node['id']] = node
+    self.by_title.setdefault(get_dict_value(node, '_meta.title', ''), []).append(node)
+    self.by_class_type.setdefault(node.get('class_type'), []).append(node)
+    inputs = node.get('inputs')
+    if isinstance(inputs, dict):
+      linked_from = set()
+      for value in inputs.values():
+        # A link is a list of the linked node's id and its output slot.
+        is_link = isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+        if is_link and isinstance(value[1], int) and value[0] not in linked_from:
+          linked_from.add(value[0])
+          self.links_from.setdefault(value[0], []).append(node)
+
+  def find(self, node_id: Union[int, str, re.Pattern, None] = None) -> list[dict]:
+    """Finds a list of nodes that match the node_id, or all the nodes in the prompt.
+
+    A regex pattern matches against the node titles. Otherwise, a numeric node_id is matched
+    against the id first, then the title and, finally, the class_type.
+    """
+    if not node_id:
+      return list(self.nodes)
+
+    if isinstance(node_id, re.Pattern):
+      if node_id not in self._by_pattern:
+        # We only need to search each distinct title once, in the order they were first seen.
+        titles = [t for t in self.by_title if re.search(node_id, t)]
+        found = [n for t in titles for n in self.by_title[t]]
+        if len(titles) > 1:
+          found.sort(key=lambda n: self._positions[n['id']])
+        self._by_pattern[node_id] = found
+      return list(self._by_pattern[node_id])
+
+    node_id = str(node_id)
+    if node_id in self.by_id and re.match(r'\d+$', node_id):
+      return [self.by_id[node_id]]
+    return list(self.by_title.get(node_id) or self.by_class_type.get(node_id) or [])
+
+
 class _Puter:
   """The main computation evaluator, using ast.parse the code.
 
   See https://www.basicexamples.com/example/python/ast for examples.
   """
 
-  def __init__(self, *, code: str, ctx: dict[str, Any], workflow, prompt, dynprompt, unique_id):
+  def __init__(
+    self, *, code: Union[str, _ParsedCode], ctx: dict[str, Any], workflow, prompt, dynprompt,
+    unique_id
+  ):
     ctx = ctx or {}
     self._ctx = {**ctx}
-    self._code = code
+    self._code = code if isinstance(code, _ParsedCode) else _CODE_CACHE.get(code)
     self._workflow = workflow
     self._prompt = prompt
     self._unique_id = unique_id
     self._dynprompt = dynprompt
     # These are now expanded lazily when needed.
-    self._prompt_nodes = None
+    self._prompt_index = None
     self._prompt_node = None
-
-  def execute(self, code=Optional[str]) -> Any:
-    """Evaluates a the code block."""
-
-    # Always store random state and initialize a new seed. We'll restore the state later.
-    initial_random_state = random.getstate()
-    random.seed(datetime.datetime.now().timestamp())
-    last_value = None
+    # The budget of the current execution, checked by the compiled code as it runs.
+    self.budget: Optional[_ExecutionBudget] = None
+    # The random generator of the current execution, for the `random.*` built-ins.
+    self._random: Optional[random.Random] = None
+    # The profile of the current execution, if profiled, and the reports of all profiled ones.
+    self.profile: Optional[_Profile] = None
+    self.profiles: list[dict[str, Any]] = []
+
+  def execute(self, code: Optional[str] = None, ctx: Optional[dict[str, Any]] = None) -> Any:
+    """Evaluates a the code block, or the passed code if provided.
+
+    A ctx can be passed to evaluate with instead of the one the instance was created with, like
+    for each row in map mode, so the prompt lookups are shared while the state is not.
+    """
+    code = _CODE_CACHE.get(code) if code else self._code
+    # Each execution gets its own generator from the node's stream, so seeding it from the code
+    # (like `random.seed(4)`) is reproducible and doesn't affect anything else.
+    self._random = rng.spawn(('power_puter', self._unique_id))
+    self.budget = _ExecutionBudget(code.settings)
+    profiled = code.settings.get(
+      'profile', get_config_value('nodes.power_puter.profile.enabled', False)
+    )
+    self.profile = _Profile() if profiled else None
     try:
-      code = code or self._code
-      node = ast.parse(self._code)
-      ctx = {**self._ctx}
-      for body in node.body:
-        last_value = self._eval_statement(body, ctx)
-        # If we got a return, then that's it folks.
-        if isinstance(body, ast.Return):
-          break
-    except:
-      random.setstate(initial_random_state)
-      raise
-    random.setstate(initial_random_state)
+      last_value = code.get_program(profiled=bool(profiled))(
+        self, {**(self._ctx if ctx is None else ctx)}
+      )
+    finally:
+      if self.profile:
+        self.profile.finish()
+        self.profiles.append(self.profile.get_report())
     return last_value
 
-  def _get_prompt_nodes(self):
-    """Expands the prompt nodes lazily from the dynamic prompt.
+  def _random_int(self, low: int, high: int) -> int:
+    return self._random.randint(low, high)
 
-    https://github.com/comfyanonymous/ComfyUI/blob/fc657f471a29d07696ca16b566000e8e555d67d1/comfy_execution/graph.py#L22
-    """
-    if self._prompt_nodes is None:
-      self._prompt_nodes = []
-      if self._dynprompt:
-        all_ids = self._dynprompt.all_node_ids()
-        self._prompt_nodes = [{'id': k} | {**self._dynprompt.get_node(k)} for k in all_ids]
-    return self._prompt_nodes
+  def _random_choice(self, seq):
+    return self._random.choice(seq)
+
+  def _random_seed(self, seed):
+    self._random.seed(seed)
+
+  def _random_seeds(self, count: int) -> list[int]:
+    """Returns `count` new seeds, at once, from the node's own seed stream (not the execution's)."""
+    return new_random_seeds(count, self._unique_id)
+
+  def _get_prompt_index(self) -> '_PromptNodeIndex':
+    """Builds the index of prompt nodes lazily, once, from the dynamic prompt."""
+    if self._prompt_index is None:
+      self._prompt_index = _PromptNodeIndex(self._dynprompt)
+    return self._prompt_index
 
   def _get_prompt_node(self):
-    if self._prompt_nodes is None:
-      self._prompt_node = [n for n in self._get_prompt_nodes() if n['id'] == self._unique_id][0]
+    if self._prompt_node is None:
+      self._prompt_node = self._get_prompt_index().by_id.get(self._unique_id)
     return self._prompt_node
 
   def _get_nodes(self, node_id: Union[int, str, re.Pattern, None] = None) -> list[Any]:
     """Get a list of the nodes that match the node_id, or all the nodes in the prompt."""
-    nodes = self._get_prompt_nodes().copy()
-    if not node_id:
-      return nodes
-
-    if isinstance(node_id, re.Pattern):
-      found = [n for n in nodes if re.search(node_id, get_dict_value(n, '_meta.title', ''))]
-    else:
-      node_id = str(node_id)
-      found = None
-      if re.match(r'\d+$', node_id):
-        found = [n for n in nodes if node_id == n['id']]
-      if not found:
-        found = [n for n in nodes if node_id == get_dict_value(n, '_meta.title', '')]
-    return found
+    return self._get_prompt_index().find(node_id)
 
   def _get_node(self, node_id: Union[int, str, re.Pattern, None] = None) -> Union[Any, None]:
     """Returns a prompt-node from the hidden prompt."""
@@ -504,351 +1406,1303 @@ class _Puter:
     """Gets the (non-muted) node of an input connection from a node (default to the power puter)."""
     node = node if node else self._get_prompt_node()
     try:
-      connected_node_id = node['inputs'][input_name][0]
-      return [n for n in self._get_prompt_nodes() if n['id'] == connected_node_id][0]
+      connected_node = self._get_prompt_index().by_id.get(node['inputs'][input_name][0])
+      if connected_node is not None:
+        return connected_node
     except (TypeError, IndexError, KeyError):
-      log_node_warn(_NODE_NAME, f'No input node found for "{input_name}". ')
+      pass
+    log_node_warn(_NODE_NAME, f'No input node found for "{input_name}". ')
     return None
 
-  def _eval_statement(self, stmt: ast.AST, ctx: dict, prev_stmt: Union[ast.AST, None] = None):
-    """Evaluates an ast.stmt."""
+  def _get_output_nodes(self, node=None) -> list[Any]:
+    """Gets the nodes connected to the outputs of a node (default to the power puter)."""
+    node = node if node else self._get_prompt_node()
+    if not isinstance(node, dict) or 'id' not in node:
+      return []
+    return list(self._get_prompt_index().links_from.get(node['id'], []))
 
-    if '__returned__' in ctx:
-      return ctx['__returned__']
 
-    # print('\n\n----: _eval_statement')
-    # print(type(stmt))
-    # print(ctx)
+# The signature of a compiled ast node; called with the executing `_Puter` and the ctx dict.
+_Evaluator = Callable[[_Puter, dict], Any]
+
+# Comparison operators for ast.Compare, which evaluate to 1 or 0 rather than a bool.
+_COMPARE_OPERATORS = {
+  ast.Eq: op.eq,
+  ast.NotEq: op.ne,
+  ast.Gt: op.gt,
+  ast.GtE: op.ge,
+  ast.Lt: op.lt,
+  ast.LtE: op.le,
+  ast.In: lambda a, b: a in b,
+  ast.Is: op.is_,
+  ast.IsNot: op.is_not,
+}
 
-    if isinstance(stmt, (ast.FormattedValue, ast.Expr)):
-      return self._eval_statement(stmt.value, ctx=ctx)
 
-    if isinstance(stmt, (ast.Constant, ast.Num)):
-      return stmt.n
+def _get_attr_or_item(item: Any, attr: Any, for_call: bool = False):
+  """Gets the attribute, or item, `attr` of `item` for an ast.Attribute or ast.Subscript.
 
-    if isinstance(stmt, ast.BinOp):
-      left = self._eval_statement(stmt.left, ctx=ctx)
-      right = self._eval_statement(stmt.right, ctx=ctx)
-      return _OPERATORS[type(stmt.op)](left, right)
+  Like: node(14).inputs.sampler_name (Attribute)
+  Like: node(14)['inputs']['sampler_name'] (Subscript)
 
-    if isinstance(stmt, ast.BoolOp):
-      is_and = isinstance(stmt.op, ast.And)
-      is_or = isinstance(stmt.op, ast.Or)
-      stmt_value_eval = None
-      for stmt_value in stmt.values:
-        stmt_value_eval = self._eval_statement(stmt_value, ctx=ctx)
-        # If we're an and operator and have a falsyt value, then we stop and return. Likewise, if
-        # we're an or operator and have a truthy value, we can stop and return.
-        if (is_and and not stmt_value_eval) or (is_or and stmt_value_eval):
-          return stmt_value_eval
-      # Always return the last if we made it here w/o success.
-      return stmt_value_eval
-
-    if isinstance(stmt, ast.UnaryOp):
-      return _OPERATORS[type(stmt.op)](self._eval_statement(stmt.operand, ctx=ctx))
-
-    if isinstance(stmt, (ast.Attribute, ast.Subscript)):
-      # Like: node(14).inputs.sampler_name (Attribute)
-      # Like: node(14)['inputs']['sampler_name'] (Subscript)
-      item = self._eval_statement(stmt.value, ctx=ctx)
-      attr = None
-      # if hasattr(stmt, 'attr'):
-      if isinstance(stmt, ast.Attribute):
-        attr = stmt.attr
+  If `for_call` is set, then the lookup is for the function of an ast.Call and any special
+  function will be returned as a tuple of the callable and the item to pass as the first argument.
+  """
+  # Check if we're blocking access to this attribute/method on this item type.
+  for typ, names in _BLOCKED_METHODS_OR_ATTRS.items():
+    if isinstance(item, typ) and isinstance(attr, str) and attr in names:
+      raise ValueError(f'Disallowed access to "{attr}" for type {typ}.')
+  if _is_blocked_tensor_attr(item, attr):
+    raise ValueError(f'Disallowed access to "{attr}" for type {type(item)}.')
+  try:
+    val = item[attr]
+  except (TypeError, IndexError, KeyError):
+    try:
+      val = getattr(item, attr)
+    except AttributeError:
+      # If we're a dict, then just return None instead of error; saves time.
+      if isinstance(item, dict):
+        # Any special cases in the _SPECIAL_FUNCTIONS
+        class_type = get_dict_value(item, "class_type")
+        if class_type in _SPECIAL_FUNCTIONS and attr in _SPECIAL_FUNCTIONS[class_type]:
+          val = _SPECIAL_FUNCTIONS[class_type][attr]
+          # If we're the function of a Call, then send back a tuple of the callable and the
+          # evaluated item, and it will make the call; perhaps also adding other arguments only it
+          # knows about.
+          if for_call:
+            return (val, item)
+          val = val(item)
+        else:
+          val = None
       else:
-        # Slice could be a name or a constant; evaluate it
-        attr = self._eval_statement(stmt.slice, ctx=ctx)
-      # Check if we're blocking access to this attribute/method on this item type.
-      for typ, names in _BLOCKED_METHODS_OR_ATTRS.items():
-        if isinstance(item, typ) and isinstance(attr, str) and attr in names:
-          raise ValueError(f'Disallowed access to "{attr}" for type {typ}.')
-      try:
-        val = item[attr]
-      except (TypeError, IndexError, KeyError):
-        try:
-          val = getattr(item, attr)
-        except AttributeError:
-          # If we're a dict, then just return None instead of error; saves time.
-          if isinstance(item, dict):
-            # Any special cases in the _SPECIAL_FUNCTIONS
-            class_type = get_dict_value(item, "class_type")
-            if class_type in _SPECIAL_FUNCTIONS and attr in _SPECIAL_FUNCTIONS[class_type]:
-              val = _SPECIAL_FUNCTIONS[class_type][attr]
-              # If our previous statment was a Call, then send back a tuple of the callable and
-              # the evaluated item, and it will make the call; perhaps also adding other arguments
-              # only it knows about.
-              if isinstance(prev_stmt, ast.Call):
-                return (val, item)
-              val = val(item)
-            else:
-              val = None
-          else:
-            raise
-      return val
+        raise
+  return val
+
+
+def _get_name(ctx: dict, name: str) -> Any:
+  """Returns the value of the name from the ctx, or the built-ins."""
+  if name in ctx:
+    return ctx[name]
+  if name in _BUILT_INS:
+    return _BUILT_INS[name]
+  raise NameError(f"Name not found: {name}")
+
+
+def _raiser(error: Exception) -> _Evaluator:
+  """Returns an evaluator that raises the error when evaluated, rather than when compiled."""
+
+  def run_raise(rt, ctx):
+    raise error
 
-    if isinstance(stmt, (ast.List, ast.Tuple)):
-      value = []
-      for elt in stmt.elts:
-        value.append(self._eval_statement(elt, ctx=ctx))
-      return tuple(value) if isinstance(stmt, ast.Tuple) else value
+  return run_raise
 
-    if isinstance(stmt, ast.Dict):
+
+# Marks a comprehension's local variable that hasn't been assigned yet.
+_UNBOUND = object()
+
+# The ast nodes that evaluate in their own _Scope.
+_COMPREHENSION_NODES = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+class _Scope:
+  """The local variables of an evaluating comprehension, chained to its enclosing scope.
+
+  The names local to a comprehension (its targets and named expressions) are known when it's
+  compiled, so each is given a slot and read or written by index rather than copying the whole ctx
+  into a new dict. A scope is passed in place of the ctx to the comprehension's evaluators, which
+  are compiled to resolve other names from the enclosing scopes or the execution's ctx dict.
+
+  Attributes:
+    parent: The enclosing scope, or the execution's ctx dict if this is the outermost scope.
+    base: The execution's ctx dict.
+    slots: The values of the local variables, or _UNBOUND if not yet assigned.
+  """
+
+  __slots__ = ('parent', 'base', 'slots')
+
+  def __init__(self, parent: Union['_Scope', dict], size: int):
+    self.parent = parent
+    self.base = parent.base if isinstance(parent, _Scope) else parent
+    self.slots = [_UNBOUND] * size
+
+
+def _get_comprehension_locals(node: ast.AST) -> list[str]:
+  """Returns the names local to the comprehension; its targets and any named expressions.
+
+  Nested comprehensions are not descended into, as they have their own scope.
+  """
+  names = {}
+
+  def collect(child: ast.AST):
+    if isinstance(child, ast.NamedExpr):
+      names[child.target.id] = None
+    for grandchild in ast.iter_child_nodes(child):
+      if not isinstance(grandchild, _COMPREHENSION_NODES):
+        collect(grandchild)
+
+  for gen in node.generators:
+    targets = gen.target.elts if isinstance(gen.target, ast.Tuple) else [gen.target]
+    for target in targets:
+      if isinstance(target, ast.Name):
+        names[target.id] = None
+  collect(node)
+  return list(names)
+
+
+def _profile_node(evaluator: _Evaluator, node: ast.AST) -> _Evaluator:
+  """Wraps a node's evaluator to record its evaluation in the execution's profile."""
+  node_type = type(node).__name__
+  line = node.lineno if isinstance(node, ast.stmt) else None
+
+  def run_profiled(rt, ctx):
+    started = time.perf_counter()
+    try:
+      return evaluator(rt, ctx)
+    finally:
+      rt.profile.record(node_type, line, time.perf_counter() - started)
+
+  return run_profiled
+
+
+def _budget_statement(evaluator: _Evaluator, line: int) -> _Evaluator:
+  """Wraps a statement's evaluator to count it against the execution budget before evaluating."""
+
+  def run_statement(rt, ctx):
+    rt.budget.step(line)
+    return evaluator(rt, ctx)
+
+  return run_statement
+
+
+# The constant types the `_Optimizer` will fold, and the longest str or bytes it will fold into.
+_FOLDABLE_TYPES = (int, float, complex, str, bytes, type(None))
+_MAX_FOLDED_LENGTH = 4096
+
+
+class _Optimizer(ast.NodeTransformer):
+  """Optimizes the parsed module before it's compiled, or analyzed for lazy inputs.
+
+  - Operations on constants (BinOp, UnaryOp, Compare, BoolOp and f-string parts) are folded into a
+    constant, with the same semantics as the compiled code (like a Compare being 1 or 0).
+  - An `if` statement or expression with a constant test is replaced by the branch that's taken.
+  - A call to a namespaced built-in, like `random.int()`, is replaced by a direct call to the
+    built-in function, unless the namespace name is assigned in the code.
+
+  Anything that can't be folded without error, or that would create a large value, is left as-is so
+  it's evaluated (and budgeted) like before.
+  """
+
+  def __init__(self):
+    self._assigned: frozenset[str] = frozenset()
+
+  def optimize(self, module: ast.Module) -> ast.Module:
+    """Optimizes the module, in place, and returns it."""
+    self._assigned = frozenset(
+      node.id for node in ast.walk(module)
+      if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)
+    )
+    return self.visit(module)
+
+  def _fold(self, node: ast.AST, get_value: Callable[[], Any]) -> ast.AST:
+    """Returns a constant of the value from `get_value`, or the node if it shouldn't be folded."""
+    try:
+      value = get_value()
+    except Exception:  # pylint: disable = broad-exception-caught
+      return node
+    if not isinstance(value, _FOLDABLE_TYPES):
+      return node
+    if isinstance(value, (str, bytes)) and len(value) > _MAX_FOLDED_LENGTH:
+      return node
+    return ast.copy_location(ast.Constant(value=value), node)
+
+  def visit_BinOp(self, node: ast.BinOp) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    operator = _OPERATORS.get(type(node.op))
+    if operator is None or not _is_constant(node.left) or not _is_constant(node.right):
+      return node
+    left = node.left.value
+    right = node.right.value
+    size = _estimate_length(operator, left, right)
+    if size is not None and size > _MAX_FOLDED_LENGTH:
+      return node
+    return self._fold(node, lambda: operator(left, right))
+
+  def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    operator = _OPERATORS.get(type(node.op))
+    if operator is None or not _is_constant(node.operand):
+      return node
+    return self._fold(node, lambda: operator(node.operand.value))
+
+  def visit_Compare(self, node: ast.Compare) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    # Like the compiled Compare, only the first comparison is evaluated.
+    compare = _COMPARE_OPERATORS.get(type(node.ops[0]))
+    if compare is None or not _is_constant(node.left) or not _is_constant(node.comparators[0]):
+      return node
+    return self._fold(node, lambda: 1 if compare(node.left.value, node.comparators[0].value) else 0)
+
+  def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    is_and = isinstance(node.op, ast.And)
+    values = []
+    for value in node.values:
+      values.append(value)
+      # A constant that decides the result means the values after are never evaluated.
+      if _is_constant(value) and (not value.value if is_and else value.value):
+        break
+    # Any other constant is only the result if it's last, so can be dropped otherwise.
+    values = [v for i, v in enumerate(values) if i == len(values) - 1 or not _is_constant(v)]
+    if len(values) == 1:
+      return values[0]
+    node.values = values
+    return node
+
+  def visit_JoinedStr(self, node: ast.JoinedStr) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    values = []
+    for value in node.values:
+      # Like the compiled JoinedStr, formatted values are str()'d, ignoring any directives.
+      if isinstance(value, ast.FormattedValue) and _is_constant(value.value):
+        value = ast.copy_location(ast.Constant(value=str(value.value.value)), value)
+      if isinstance(value, ast.Constant) and values and isinstance(values[-1], ast.Constant):
+        values[-1] = ast.copy_location(
+          ast.Constant(value=str(values[-1].value) + str(value.value)), values[-1]
+        )
+      else:
+        values.append(value)
+    if not values:
+      return ast.copy_location(ast.Constant(value=''), node)
+    if len(values) == 1 and isinstance(values[0], ast.Constant):
+      return ast.copy_location(ast.Constant(value=str(values[0].value)), node)
+    node.values = values
+    return node
+
+  def visit_IfExp(self, node: ast.IfExp) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    if not _is_constant(node.test):
+      return node
+    return node.body if node.test.value else node.orelse
+
+  def visit_If(self, node: ast.If) -> Union[ast.AST, list]:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    if not _is_constant(node.test):
+      return node
+    if node.test.value:
+      return node.body
+    if node.orelse:
+      return node.orelse
+    # The compiled If evaluates to the (falsy) test's value when there's no branch taken.
+    return ast.copy_location(ast.Expr(value=node.test), node)
+
+  def visit_Call(self, node: ast.Call) -> ast.AST:  # pylint: disable = invalid-name
+    self.generic_visit(node)
+    func = node.func
+    if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+      namespace = _BUILT_INS.get(func.value.id) if func.value.id not in self._assigned else None
+      if isinstance(namespace, MappingProxyType) and isinstance(namespace.get(func.attr), str):
+        fn = _get_built_in_fn_by_key(namespace[func.attr])
+        node.func = ast.copy_location(ast.Name(id=fn.name, ctx=ast.Load()), func)
+    return node
+
+
+def _is_constant(node: ast.AST) -> bool:
+  """Checks if the node is a constant the `_Optimizer` can fold."""
+  return isinstance(node, ast.Constant) and isinstance(node.value, _FOLDABLE_TYPES)
+
+
+class _Compiler:
+  """Compiles an ast tree into a tree of specialized closures that can be evaluated many times.
+
+  Rather than walking the tree and checking each node's type on every evaluation, each node is
+  turned into a closure once that knows exactly what to do. The closures are passed the executing
+  `_Puter` and the ctx rather than closing over them, so a compiled module is cached alongside its
+  parsed code and shared across executions.
+
+  Unsupported nodes compile to closures that raise when evaluated, so errors are only surfaced if
+  that code is actually reached.
+
+  When budgeted, the closures count statements, iterations and created sizes against the executing
+  `_Puter`'s `_ExecutionBudget`. Unbudgeted closures can be evaluated without a `_Puter` at all.
+  When profiled, each node's evaluation, and each built-in call, is timed into the `_Puter`'s
+  `_Profile`.
+  """
+
+  def __init__(self, budgeted: bool = False, profiled: bool = False):
+    self._budgeted = budgeted
+    self._profiled = profiled
+    # The slots of the local names of the comprehensions being compiled, innermost last.
+    self._scopes: list[dict[str, int]] = []
+    self._compilers: dict[type, Callable[[Any], _Evaluator]] = {
+      ast.Expr: self._compile_expr,
+      ast.FormattedValue: self._compile_expr,
+      ast.Constant: self._compile_constant,
+      ast.BinOp: self._compile_bin_op,
+      ast.BoolOp: self._compile_bool_op,
+      ast.UnaryOp: self._compile_unary_op,
+      ast.Attribute: self._compile_attribute_or_subscript,
+      ast.Subscript: self._compile_attribute_or_subscript,
+      ast.List: self._compile_list_or_tuple,
+      ast.Tuple: self._compile_list_or_tuple,
+      ast.Dict: self._compile_dict,
+      ast.JoinedStr: self._compile_joined_str,
+      ast.Slice: self._compile_slice,
+      ast.Name: self._compile_name,
+      ast.For: self._compile_for,
+      ast.While: self._compile_while,
+      ast.ListComp: self._compile_comprehension,
+      ast.SetComp: self._compile_comprehension,
+      ast.DictComp: self._compile_comprehension,
+      ast.GeneratorExp: self._compile_comprehension,
+      ast.Call: self._compile_call,
+      ast.Compare: self._compile_compare,
+      ast.If: self._compile_if,
+      ast.IfExp: self._compile_if,
+      ast.Assign: self._compile_assign,
+      ast.AugAssign: self._compile_assign,
+      ast.NamedExpr: self._compile_named_expr,
+      ast.Return: self._compile_return,
+      ast.Break: self._compile_break,
+      ast.Continue: self._compile_continue,
+      ast.Pass: self._compile_pass,
+    }
+
+  def compile_module(self, module: ast.Module) -> _Evaluator:
+    """Compiles a module into an evaluator returning the last evaluated, or returned, value."""
+    bodies = [self.compile(body) for body in module.body]
+
+    def run_module(rt, ctx):
+      last_value = None
+      for body in bodies:
+        last_value = body(rt, ctx)
+        # If we got a return, then that's it folks.
+        if '__returned__' in ctx:
+          return ctx['__returned__']
+      return last_value
+
+    return run_module
+
+  def compile(self, node: ast.AST) -> _Evaluator:
+    """Compiles an ast node into an evaluator."""
+    compiler = self._compilers.get(type(node))
+    if compiler is None:
+      return _raiser(TypeError(node))
+    evaluator = compiler(node)
+    if self._budgeted and isinstance(node, ast.stmt):
+      evaluator = _budget_statement(evaluator, node.lineno)
+    if self._profiled:
+      evaluator = _profile_node(evaluator, node)
+    return evaluator
+
+  def _compile_block(self, nodes: Union[list[ast.AST], ast.AST]) -> _Evaluator:
+    """Compiles a list of statements (or a single expression) into one evaluator.
+
+    The block stops when a statement marks a return, which propagates up through outer blocks.
+    """
+    # ast.If is a list, ast.IfExp is an object.
+    bodies = [self.compile(n) for n in (nodes if isinstance(nodes, list) else [nodes])]
+    if len(bodies) == 1:
+      return bodies[0]
+
+    def run_block(rt, ctx):
+      value = None
+      for body in bodies:
+        value = body(rt, ctx)
+        if '__returned__' in ctx:
+          return ctx['__returned__']
+      return value
+
+    return run_block
+
+  def _compile_expr(self, node: Union[ast.Expr, ast.FormattedValue]) -> _Evaluator:
+    return self.compile(node.value)
+
+  def _compile_constant(self, node: ast.Constant) -> _Evaluator:
+    value = node.value
+    return lambda rt, ctx: value
+
+  def _compile_bin_op(self, node: ast.BinOp) -> _Evaluator:
+    left = self.compile(node.left)
+    right = self.compile(node.right)
+    operator = _OPERATORS.get(type(node.op))
+    if operator is None:
+      return _raiser(KeyError(type(node.op)))
+
+    if self._budgeted and isinstance(node.op, _SIZING_OPERATORS):
+      return lambda rt, ctx: rt.budget.operate(operator, left(rt, ctx), right(rt, ctx))
+
+    def run_bin_op(rt, ctx):
+      return operator(left(rt, ctx), right(rt, ctx))
+
+    return run_bin_op
+
+  def _compile_bool_op(self, node: ast.BoolOp) -> _Evaluator:
+    is_and = isinstance(node.op, ast.And)
+    is_or = isinstance(node.op, ast.Or)
+    values = [self.compile(v) for v in node.values]
+
+    def run_bool_op(rt, ctx):
+      value = None
+      for get_value in values:
+        value = get_value(rt, ctx)
+        # If we're an and operator and have a falsy value, then we stop and return. Likewise, if
+        # we're an or operator and have a truthy value, we can stop and return.
+        if (is_and and not value) or (is_or and value):
+          return value
+      # Always return the last if we made it here w/o success.
+      return value
+
+    return run_bool_op
+
+  def _compile_unary_op(self, node: ast.UnaryOp) -> _Evaluator:
+    operator = _OPERATORS.get(type(node.op))
+    if operator is None:
+      return _raiser(KeyError(type(node.op)))
+    operand = self.compile(node.operand)
+    return lambda rt, ctx: operator(operand(rt, ctx))
+
+  def _compile_attribute_or_subscript(
+    self, node: Union[ast.Attribute, ast.Subscript], for_call: bool = False
+  ) -> _Evaluator:
+    get_item = self.compile(node.value)
+    if isinstance(node, ast.Attribute):
+      attr = node.attr
+      return lambda rt, ctx: _get_attr_or_item(get_item(rt, ctx), attr, for_call)
+    # Slice could be a name or a constant; evaluate it
+    get_attr = self.compile(node.slice)
+
+    def run_subscript(rt, ctx):
+      item = get_item(rt, ctx)
+      return _get_attr_or_item(item, get_attr(rt, ctx), for_call)
+
+    return run_subscript
+
+  def _compile_list_or_tuple(self, node: Union[ast.List, ast.Tuple]) -> _Evaluator:
+    elts = [self.compile(elt) for elt in node.elts]
+    if isinstance(node, ast.Tuple):
+      return lambda rt, ctx: tuple([elt(rt, ctx) for elt in elts])
+    return lambda rt, ctx: [elt(rt, ctx) for elt in elts]
+
+  def _compile_dict(self, node: ast.Dict) -> _Evaluator:
+    if node.keys and len(node.keys) != len(node.values):
+      return _raiser(ValueError('Expected same number of keys as values for dict.'))
+    items = [(self.compile(k), self.compile(v)) for k, v in zip(node.keys, node.values)]
+
+    def run_dict(rt, ctx):
       the_dict = {}
-      if stmt.keys:
-        if len(stmt.keys) != len(stmt.values):
-          raise ValueError('Expected same number of keys as values for dict.')
-        for i, k in enumerate(stmt.keys):
-          item_key = self._eval_statement(k, ctx=ctx)
-          item_value = self._eval_statement(stmt.values[i], ctx=ctx)
-          the_dict[item_key] = item_value
+      for get_key, get_value in items:
+        item_key = get_key(rt, ctx)
+        the_dict[item_key] = get_value(rt, ctx)
       return the_dict
 
+    return run_dict
+
+  def _compile_joined_str(self, node: ast.JoinedStr) -> _Evaluator:
     # f-strings: https://www.basicexamples.com/example/python/ast-JoinedStr
     # Note, this will str() all evaluated items in the fstrings, and doesn't handle f-string
     # directives, like padding, etc.
-    if isinstance(stmt, ast.JoinedStr):
-      vals = [str(self._eval_statement(v, ctx=ctx)) for v in stmt.values]
-      val = ''.join(vals)
-      return val
-
-    if isinstance(stmt, ast.Slice):
-      if not stmt.lower or not stmt.upper:
-        raise ValueError('Unhandled Slice w/o lower or upper.')
-      slice_lower = self._eval_statement(stmt.lower, ctx=ctx)
-      slice_upper = self._eval_statement(stmt.upper, ctx=ctx)
-      if stmt.step:
-        slice_step = self._eval_statement(stmt.step, ctx=ctx)
-        return slice(slice_lower, slice_upper, slice_step)
-      return slice(slice_lower, slice_upper)
-
-    if isinstance(stmt, ast.Name):
-      if stmt.id in ctx:
-        val = ctx[stmt.id]
-        return val
-      if stmt.id in _BUILT_INS:
-        val = _BUILT_INS[stmt.id]
-        return val
-      raise NameError(f"Name not found: {stmt.id}")
-
-    if isinstance(stmt, ast.For):
-      for_iter = self._eval_statement(stmt.iter, ctx=ctx)
-      for item in for_iter:
-        # Set the for var(s)
-        if isinstance(stmt.target, ast.Name):
-          ctx[stmt.target.id] = item
-        elif isinstance(stmt.target, ast.Tuple):  # dict, like `for k, v in d.entries()`
-          for i, elt in enumerate(stmt.target.elts):
-            ctx[elt.id] = item[i]
-        bodies = stmt.body if isinstance(stmt.body, list) else [stmt.body]
-        breaked = False
-        for body in bodies:
-          # Catch any breaks or continues and handle inside the loop normally.
-          try:
-            value = self._eval_statement(body, ctx=ctx)
-          except (LoopBreak, LoopContinue) as e:
-            breaked = isinstance(e, LoopBreak)
-            break
-        if breaked:
+    values = [self.compile(v) for v in node.values]
+    return lambda rt, ctx: ''.join([str(v(rt, ctx)) for v in values])
+
+  def _compile_slice(self, node: ast.Slice) -> _Evaluator:
+    if not node.lower or not node.upper:
+      return _raiser(ValueError('Unhandled Slice w/o lower or upper.'))
+    lower = self.compile(node.lower)
+    upper = self.compile(node.upper)
+    if node.step:
+      step = self.compile(node.step)
+      return lambda rt, ctx: slice(lower(rt, ctx), upper(rt, ctx), step(rt, ctx))
+    return lambda rt, ctx: slice(lower(rt, ctx), upper(rt, ctx))
+
+  def _compile_name(self, node: ast.Name) -> _Evaluator:
+    return self._compile_scoped_name(node.id, len(self._scopes))
+
+  def _compile_scoped_name(self, name: str, num_scopes: int) -> _Evaluator:
+    """Compiles a name lookup, resolving it from the innermost of the first `num_scopes` scopes.
+
+    The evaluator is passed the innermost scope being compiled, so walks up to the scope the name
+    is local to. If it's not yet bound there, it continues to the next scope out, and finally the
+    execution's ctx dict and built-ins.
+    """
+    innermost = len(self._scopes) - 1
+    for index in range(num_scopes - 1, -1, -1):
+      scope = self._scopes[index]
+      if name in scope:
+        slot = scope[name]
+        # How many scopes out from the innermost it is, which the evaluator is passed.
+        depth = innermost - index
+        get_outer = self._compile_scoped_name(name, index)
+        if depth == 0:
+
+          def run_local_name(rt, ctx):
+            value = ctx.slots[slot]
+            return get_outer(rt, ctx) if value is _UNBOUND else value
+
+          return run_local_name
+
+        def run_enclosing_name(rt, ctx):
+          scope = ctx
+          for _ in range(depth):
+            scope = scope.parent
+          value = scope.slots[slot]
+          return get_outer(rt, ctx) if value is _UNBOUND else value
+
+        return run_enclosing_name
+
+    if self._scopes:
+      return lambda rt, ctx: _get_name(ctx.base, name)
+    return lambda rt, ctx: _get_name(ctx, name)
+
+  def _compile_loop_target(self, target: ast.AST) -> Callable[[dict, Any], None]:
+    """Compiles the target of a for loop into a function that sets the item(s) into the ctx."""
+    if isinstance(target, ast.Name):
+      name = target.id
+
+      def set_name(ctx, item):
+        ctx[name] = item
+
+      return set_name
+
+    if isinstance(target, ast.Tuple):  # dict, like `for k, v in d.entries()`
+      elts = target.elts
+
+      def set_tuple(ctx, item):
+        for i, elt in enumerate(elts):
+          ctx[elt.id] = item[i]
+
+      return set_tuple
+
+    return lambda ctx, item: None
+
+  def _compile_loop_body(self, nodes: list[ast.AST]) -> Callable[[_Puter, dict], bool]:
+    """Compiles a loop's body into a function returning True if the loop should stop."""
+    bodies = [self.compile(n) for n in nodes]
+
+    def run_loop_body(rt, ctx):
+      for body in bodies:
+        # Catch any breaks or continues and handle inside the loop normally.
+        try:
+          body(rt, ctx)
+        except LoopBreak:
+          return True
+        except LoopContinue:
+          return False
+        if '__returned__' in ctx:
+          return True
+      return False
+
+    return run_loop_body
+
+  def _compile_for(self, node: ast.For) -> _Evaluator:
+    get_iter = self.compile(node.iter)
+    set_target = self._compile_loop_target(node.target)
+    run_body = self._compile_loop_body(node.body)
+    budgeted = self._budgeted
+
+    def run_for(rt, ctx):
+      for item in get_iter(rt, ctx):
+        if budgeted:
+          rt.budget.iterate()
+        set_target(ctx, item)
+        if run_body(rt, ctx):
           break
       return None
 
-    if isinstance(stmt, ast.While):
-      while self._eval_statement(stmt.test, ctx=ctx):
-        bodies = stmt.body if isinstance(stmt.body, list) else [stmt.body]
-        breaked = False
-        for body in bodies:
-          # Catch any breaks or continues and handle inside the loop normally.
-          try:
-            value = self._eval_statement(body, ctx=ctx)
-          except (LoopBreak, LoopContinue) as e:
-            breaked = isinstance(e, LoopBreak)
-            break
-        if breaked:
+    return run_for
+
+  def _compile_while(self, node: ast.While) -> _Evaluator:
+    test = self.compile(node.test)
+    run_body = self._compile_loop_body(node.body)
+    budgeted = self._budgeted
+
+    def run_while(rt, ctx):
+      while test(rt, ctx):
+        if budgeted:
+          rt.budget.iterate()
+        if run_body(rt, ctx):
           break
       return None
 
-    if isinstance(stmt, ast.ListComp):
-      # Like: [v.lora for name, v in node(19).inputs.items() if name.startswith('lora_')]
-      # Like: [v.lower() for v in lora_list]
-      # Like: [v for v in l if v.startswith('B')]
-      # Like: [v.lower() for v in l if v.startswith('B') or v.startswith('F')]
-      # ---
-      # Like: [l for n in nodes(re('Loras')).values() if (l := n.loras)]
-      final_list = []
-
-      gen_ctx = {**ctx}
-
-      generators = [*stmt.generators]
-
-      def handle_gen(generators: list[ast.comprehension]):
-        gen = generators.pop(0)
-        if isinstance(gen.target, ast.Name):
-          gen_ctx[gen.target.id] = None
-        elif isinstance(gen.target, ast.Tuple):  # dict, like `for k, v in d.entries()`
-          for elt in gen.target.elts:
-            gen_ctx[elt.id] = None
+    return run_while
+
+  def _compile_comprehension(
+    self, node: Union[ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp]
+  ) -> _Evaluator:
+    # Like: [v.lora for name, v in node(19).inputs.items() if name.startswith('lora_')]
+    # Like: [v.lower() for v in lora_list]
+    # Like: [v for v in l if v.startswith('B')]
+    # Like: [v.lower() for v in l if v.startswith('B') or v.startswith('F')]
+    # ---
+    # Like: [l for n in nodes(re('Loras')).values() if (l := n.loras)]
+    # ---
+    # Like: any(n.inputs.seed == 0 for n in nodes(re('KSampler')))
+    # Like: {n.id: n.inputs.seed for n in nodes(re('KSampler'))}
+    names = _get_comprehension_locals(node)
+    self._scopes.append({name: i for i, name in enumerate(names)})
+    try:
+      start = self._compile_comprehension_generators(node.generators)
+      if isinstance(node, ast.DictComp):
+        key = self.compile(node.key)
+        value = self.compile(node.value)
+      else:
+        elt = self.compile(node.elt)
+    finally:
+      self._scopes.pop()
+    budgeted = self._budgeted
+
+    if isinstance(node, ast.GeneratorExp):
+      # A generator streams its items as they're consumed, so `any()` or `next()` can stop early.
+      # Like Python, only its first iterable is evaluated up front.
+      def run_generator_exp(rt, ctx):
+        scope = _Scope(ctx, len(names))
+        return (elt(rt, scope) for _ in start(rt, scope))
+
+      return run_generator_exp
+
+    if isinstance(node, ast.DictComp):
+
+      def run_dict_comp(rt, ctx):
+        scope = _Scope(ctx, len(names))
+        final_dict = {key(rt, scope): value(rt, scope) for _ in start(rt, scope)}
+        return rt.budget.check_size(final_dict) if budgeted else final_dict
+
+      return run_dict_comp
+
+    if isinstance(node, ast.SetComp):
+
+      def run_set_comp(rt, ctx):
+        scope = _Scope(ctx, len(names))
+        final_set = {elt(rt, scope) for _ in start(rt, scope)}
+        return rt.budget.check_size(final_set) if budgeted else final_set
+
+      return run_set_comp
+
+    def run_list_comp(rt, ctx):
+      scope = _Scope(ctx, len(names))
+      final_list = [elt(rt, scope) for _ in start(rt, scope)]
+      return rt.budget.check_size(final_list) if budgeted else final_list
+
+    return run_list_comp
+
+  def _compile_comprehension_generators(
+    self, generators: list[ast.comprehension]
+  ) -> Callable[[_Puter, _Scope], Iterable]:
+    """Compiles a comprehension's generators into a function that starts iterating them.
+
+    The first iterable is evaluated when started, and the rest as they're reached. For each
+    iteration the targets are set into the scope's slots, and the iteration is only yielded if all
+    of the `if` conditions pass. Nothing is allocated per iteration.
+    """
+    scope = self._scopes[-1]
+    gens = []
+    for gen in generators:
+      if isinstance(gen.target, ast.Name):
+        slots = (scope[gen.target.id],)
+      elif isinstance(gen.target, ast.Tuple):  # dict, like `for k, v in d.entries()`
+        slots = tuple(scope[elt.id] for elt in gen.target.elts)
+      else:
+        return _raiser(ValueError('Na'))
+      # A call, like my_dct.items(), or a named ctx list
+      if isinstance(gen.iter, (ast.Call, ast.Name, ast.Attribute, ast.List, ast.Tuple)):
+        get_iter = self.compile(gen.iter)
+      else:
+        get_iter = lambda rt, ctx: None
+      is_tuple = isinstance(gen.target, ast.Tuple)
+      gens.append((slots, is_tuple, get_iter, [self.compile(i) for i in gen.ifs]))
+    last = len(gens) - 1
+    budgeted = self._budgeted
+
+    def get_iters(rt, scope, index):
+      gen_iters = gens[index][2](rt, scope)
+      if not isinstance(gen_iters, Iterable):
+        raise ValueError('No iteraors found for list comprehension')
+      return gen_iters
+
+    def iterate(rt, scope, index, gen_iters):
+      slots, is_tuple, _, ifs = gens[index]
+      values = scope.slots
+      for gen_iter in gen_iters:
+        if budgeted:
+          rt.budget.iterate()
+        if is_tuple:
+          for i, slot in enumerate(slots):
+            values[slot] = gen_iter[i]
         else:
-          raise ValueError('Na')
-
-        gen_iters = None
-        # A call, like my_dct.items(), or a named ctx list
-        if isinstance(gen.iter, ast.Call):
-          gen_iters = self._eval_statement(gen.iter, ctx=gen_ctx)
-        elif isinstance(gen.iter, (ast.Name, ast.Attribute, ast.List, ast.Tuple)):
-          gen_iters = self._eval_statement(gen.iter, ctx=gen_ctx)
-
-        if not isinstance(gen_iters, Iterable):
-          raise ValueError('No iteraors found for list comprehension')
-
-        for gen_iter in gen_iters:
-          if_ctx = {**gen_ctx}
-          if isinstance(gen.target, ast.Tuple):  # dict, like `for k, v in d.entries()`
-            for i, elt in enumerate(gen.target.elts):
-              if_ctx[elt.id] = gen_iter[i]
-          else:
-            if_ctx[gen.target.id] = gen_iter
-          good = True
-          for ifcall in gen.ifs:
-            if not self._eval_statement(ifcall, ctx=if_ctx):
-              good = False
-              break
-          if not good:
-            continue
-          gen_ctx.update(if_ctx)
-          if len(generators):
-            handle_gen(generators)
+          values[slots[0]] = gen_iter
+        good = True
+        for ifcall in ifs:
+          if not ifcall(rt, scope):
+            good = False
+            break
+        if not good:
+          continue
+        if index == last:
+          yield None
+        else:
+          yield from iterate(rt, scope, index + 1, get_iters(rt, scope, index + 1))
+
+    def start(rt, scope):
+      return iterate(rt, scope, 0, get_iters(rt, scope, 0))
+
+    return start
+
+  def _compile_call(self, node: ast.Call) -> _Evaluator:
+    func = node.func
+    num_args = len(node.args)
+    # Indices of starred args, like `batch(*images)`, which are unpacked into the call's args.
+    starred = frozenset(i for i, arg in enumerate(node.args) if isinstance(arg, ast.Starred))
+    args = [self.compile(arg.value if i in starred else arg) for i, arg in enumerate(node.args)]
+    kwargs = [(kwarg.arg, self.compile(kwarg.value)) for kwarg in node.keywords]
+    budgeted = self._budgeted
+    profiled = self._profiled
+
+    def check_num_args(fn: Function, count: int):
+      if count < fn.args[0] or (fn.args[1] is not None and count > fn.args[1]):
+        toErr = " or more" if fn.args[1] is None else f" to {fn.args[1]}"
+        raise SyntaxError(f"Invalid function call: {fn.name} requires {fn.args[0]}{toErr} args")
+
+    def resolve_built_in(rt, call):
+      fn = None
+      if isinstance(call, str) and call.startswith(_BUILTIN_FN_PREFIX):
+        fn = _get_built_in_fn_by_key(call)
+        call = fn.call
+        if isinstance(call, str):
+          call = getattr(rt, call)
+        # With starred args, the number of args is only known once they're evaluated.
+        if not starred:
+          check_num_args(fn, num_args)
+      return call, fn
+
+    def make_call(rt, ctx, call, call_args, fn=None):
+      if starred:
+        num_prefixed = len(call_args)
+        for i, get_arg in enumerate(args):
+          if i in starred:
+            call_args.extend(get_arg(rt, ctx))
           else:
-            final_list.append(self._eval_statement(stmt.elt, gen_ctx))
-        generators.insert(0, gen)
-
-      handle_gen(generators)
-      return final_list
-
-    if isinstance(stmt, ast.Call):
-      call = None
-      args = []
-      kwargs = {}
-      if isinstance(stmt.func, ast.Attribute):
-        call = self._eval_statement(stmt.func, prev_stmt=stmt, ctx=ctx)
+            call_args.append(get_arg(rt, ctx))
+        if fn is not None:
+          check_num_args(fn, len(call_args) - num_prefixed)
+      else:
+        for get_arg in args:
+          call_args.append(get_arg(rt, ctx))
+      call_kwargs = {}
+      for key, get_kwarg in kwargs:
+        call_kwargs[key] = get_kwarg(rt, ctx)
+      if profiled and fn is not None:
+        # Time only the built-in itself, not evaluating its args.
+        started = time.perf_counter()
+        try:
+          return invoke(rt, call, call_args, call_kwargs)
+        finally:
+          rt.profile.record_call(_get_built_in_display_name(fn), time.perf_counter() - started)
+      return invoke(rt, call, call_args, call_kwargs)
+
+    def invoke(rt, call, call_args, call_kwargs):
+      if not budgeted:
+        return call(*call_args, **call_kwargs)
+      # Materializing a sized iterable, like `list(range(n))`, can be checked before it's created.
+      if call in (list, tuple, set) and len(call_args) == 1 and isinstance(call_args[0], range):
+        rt.budget.check_length(len(call_args[0]))
+      return rt.budget.check_size(call(*call_args, **call_kwargs))
+
+    if isinstance(func, ast.Attribute):
+      get_func = self._compile_attribute_or_subscript(func, for_call=True)
+
+      def run_call_attribute(rt, ctx):
+        call_args = []
+        call = get_func(rt, ctx)
         if isinstance(call, tuple):
-          args.append(call[1])
+          call_args.append(call[1])
           call = call[0]
         if not call:
-          raise ValueError(f'No call for ast.Call {stmt.func}')
+          raise ValueError(f'No call for ast.Call {func}')
+        call, fn = resolve_built_in(rt, call)
+        if not call:
+          raise ValueError('No call for ast.Call ')
+        return make_call(rt, ctx, call, call_args, fn)
 
-      name = ''
-      if isinstance(stmt.func, ast.Name):
-        name = stmt.func.id
-        if name in _BUILT_INS:
-          call = _BUILT_INS[name]
+      return run_call_attribute
 
-      if isinstance(call, str) and call.startswith(_BUILTIN_FN_PREFIX):
-        fn = _get_built_in_fn_by_key(call)
-        call = fn.call
-        if isinstance(call, str):
-          call = getattr(self, call)
-        num_args = len(stmt.args)
-        if num_args < fn.args[0] or (fn.args[1] is not None and num_args > fn.args[1]):
-          toErr = " or more" if fn.args[1] is None else f" to {fn.args[1]}"
-          raise SyntaxError(f"Invalid function call: {fn.name} requires {fn.args[0]}{toErr} args")
+    name = func.id if isinstance(func, ast.Name) else ''
+    built_in = _BUILT_INS.get(name) if name else None
+    if not built_in:
+      return _raiser(ValueError(f'No call for ast.Call {name}'))
 
+    # A name call can only be a built-in, so we can resolve it now rather than on every call.
+    if isinstance(built_in, str) and built_in.startswith(_BUILTIN_FN_PREFIX):
+      fn = _get_built_in_fn_by_key(built_in)
+      if not starred:
+        try:
+          check_num_args(fn, num_args)
+        except SyntaxError as e:
+          return _raiser(e)
+      if isinstance(fn.call, str):
+        # A method of the executing `_Puter`, which is passed as `self`.
+        method = getattr(_Puter, fn.call)
+        return lambda rt, ctx: make_call(rt, ctx, method, [rt], fn)
+      call = fn.call
+      return lambda rt, ctx: make_call(rt, ctx, call, [], fn)
+
+    def run_call_name(rt, ctx):
+      call, fn = resolve_built_in(rt, built_in)
       if not call:
         raise ValueError(f'No call for ast.Call {name}')
-
-      for arg in stmt.args:
-        args.append(self._eval_statement(arg, ctx=ctx))
-      for kwarg in stmt.keywords:
-        kwargs[kwarg.arg] = self._eval_statement(kwarg.value, ctx=ctx)
-      return call(*args, **kwargs)
-
-    if isinstance(stmt, ast.Compare):
-      l = self._eval_statement(stmt.left, ctx=ctx)
-      r = self._eval_statement(stmt.comparators[0], ctx=ctx)
-      if isinstance(stmt.ops[0], ast.Eq):
-        return 1 if l == r else 0
-      if isinstance(stmt.ops[0], ast.NotEq):
-        return 1 if l != r else 0
-      if isinstance(stmt.ops[0], ast.Gt):
-        return 1 if l > r else 0
-      if isinstance(stmt.ops[0], ast.GtE):
-        return 1 if l >= r else 0
-      if isinstance(stmt.ops[0], ast.Lt):
-        return 1 if l < r else 0
-      if isinstance(stmt.ops[0], ast.LtE):
-        return 1 if l <= r else 0
-      if isinstance(stmt.ops[0], ast.In):
-        return 1 if l in r else 0
-      if isinstance(stmt.ops[0], ast.Is):
-        return 1 if l is r else 0
-      if isinstance(stmt.ops[0], ast.IsNot):
-        return 1 if l is not r else 0
-      raise NotImplementedError("Operator " + stmt.ops[0].__class__.__name__ + " not supported.")
-
-    if isinstance(stmt, (ast.If, ast.IfExp)):
-      value = self._eval_statement(stmt.test, ctx=ctx)
+      return make_call(rt, ctx, call, [], fn)
+
+    return run_call_name
+
+  def _compile_compare(self, node: ast.Compare) -> _Evaluator:
+    left = self.compile(node.left)
+    right = self.compile(node.comparators[0])
+    compare = _COMPARE_OPERATORS.get(type(node.ops[0]))
+    op_name = node.ops[0].__class__.__name__
+
+    def run_compare(rt, ctx):
+      l = left(rt, ctx)
+      r = right(rt, ctx)
+      if compare is None:
+        raise NotImplementedError("Operator " + op_name + " not supported.")
+      return 1 if compare(l, r) else 0
+
+    return run_compare
+
+  def _compile_if(self, node: Union[ast.If, ast.IfExp]) -> _Evaluator:
+    test = self.compile(node.test)
+    body = self._compile_block(node.body)
+    # ast.If is a list, ast.IfExp is an object. TBH, I don't know why the If is a list, it's only
+    # ever one item AFAICT.
+    orelse = self._compile_block(node.orelse) if node.orelse else None
+
+    def run_if(rt, ctx):
+      value = test(rt, ctx)
       if value:
-        # ast.If is a list, ast.IfExp is an object.
-        bodies = stmt.body if isinstance(stmt.body, list) else [stmt.body]
-        for body in bodies:
-          value = self._eval_statement(body, ctx=ctx)
-      elif stmt.orelse:
-        # ast.If is a list, ast.IfExp is an object. TBH, I don't know why the If is a list, it's
-        # only ever one item AFAICT.
-        orelses = stmt.orelse if isinstance(stmt.orelse, list) else [stmt.orelse]
-        for orelse in orelses:
-          value = self._eval_statement(orelse, ctx=ctx)
+        value = body(rt, ctx)
+      elif orelse is not None:
+        value = orelse(rt, ctx)
       return value
 
-    # Assign a variable and add it to our ctx.
-    if isinstance(stmt, (ast.Assign, ast.AugAssign)):
-      if isinstance(stmt, ast.AugAssign):
-        left = self._eval_statement(stmt.target, ctx=ctx)
-        right = self._eval_statement(stmt.value, ctx=ctx)
-        value = _OPERATORS[type(stmt.op)](left, right)
-        target = stmt.target
-      else:
-        value = self._eval_statement(stmt.value, ctx=ctx)
-        if len(stmt.targets) != 1:
-          raise ValueError('Expected length of assign targets to be 1')
-        target = stmt.targets[0]
+    return run_if
 
-      if isinstance(target, ast.Tuple):  # like `a, z = (1,2)` (ast.Assign only)
-        for i, elt in enumerate(target.elts):
-          ctx[elt.id] = value[i]
-      elif isinstance(target, ast.Name):  # like `a = 1``
-        ctx[target.id] = value
-      elif isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name):  # `a[0] = 1`
-        ctx[target.value.id][self._eval_statement(target.slice, ctx=ctx)] = value
-      else:
-        raise ValueError('Unhandled target type for Assign.')
+  def _compile_assign(self, node: Union[ast.Assign, ast.AugAssign]) -> _Evaluator:
+    if isinstance(node, ast.AugAssign):
+      target = node.target
+      left = self.compile(target)
+      right = self.compile(node.value)
+      operator = _OPERATORS.get(type(node.op))
+      if operator is None:
+        return _raiser(KeyError(type(node.op)))
+
+      budgeted = self._budgeted and isinstance(node.op, _SIZING_OPERATORS)
+
+      def get_value(rt, ctx):
+        if budgeted:
+          return rt.budget.operate(operator, left(rt, ctx), right(rt, ctx))
+        return operator(left(rt, ctx), right(rt, ctx))
+    else:
+      if len(node.targets) != 1:
+        return _raiser(ValueError('Expected length of assign targets to be 1'))
+      target = node.targets[0]
+      get_value = self.compile(node.value)
+
+    set_value = self._compile_assign_target(target)
+
+    def run_assign(rt, ctx):
+      value = get_value(rt, ctx)
+      set_value(rt, ctx, value)
       return value
 
+    return run_assign
+
+  def _compile_assign_target(self, target: ast.AST) -> Callable[[_Puter, dict, Any], None]:
+    """Compiles the target of an assignment into a function that sets the value into the ctx."""
+    if isinstance(target, ast.Tuple):  # like `a, z = (1,2)` (ast.Assign only)
+      elts = target.elts
+
+      def set_tuple(rt, ctx, value):
+        for i, elt in enumerate(elts):
+          ctx[elt.id] = value[i]
+
+      return set_tuple
+
+    if isinstance(target, ast.Name):  # like `a = 1``
+      name = target.id
+
+      def set_name(rt, ctx, value):
+        ctx[name] = value
+
+      return set_name
+
+    if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name):  # `a[0] = 1`
+      name = target.value.id
+      get_slice = self.compile(target.slice)
+
+      def set_subscript(rt, ctx, value):
+        ctx[name][get_slice(rt, ctx)] = value
+
+      return set_subscript
+
+    def set_unhandled(rt, ctx, value):
+      raise ValueError('Unhandled target type for Assign.')
+
+    return set_unhandled
+
+  def _compile_named_expr(self, node: ast.NamedExpr) -> _Evaluator:
     # For assigning a var in a list comprehension.
     # Like [name for node in node_list if (name := node.name)]
-    if isinstance(stmt, ast.NamedExpr):
-      value = self._eval_statement(stmt.value, ctx=ctx)
-      ctx[stmt.target.id] = value
+    name = node.target.id
+    get_value = self.compile(node.value)
+
+    if self._scopes:
+      slot = self._scopes[-1][name]
+
+      def run_local_named_expr(rt, ctx):
+        value = get_value(rt, ctx)
+        ctx.slots[slot] = value
+        return value
+
+      return run_local_named_expr
+
+    def run_named_expr(rt, ctx):
+      value = get_value(rt, ctx)
+      ctx[name] = value
       return value
 
-    if isinstance(stmt, ast.Return):
-      if stmt.value is None:
-        value = None
-      else:
-        value = self._eval_statement(stmt.value, ctx=ctx)
+    return run_named_expr
+
+  def _compile_return(self, node: ast.Return) -> _Evaluator:
+    get_value = self.compile(node.value) if node.value is not None else lambda rt, ctx: None
+
+    def run_return(rt, ctx):
+      value = get_value(rt, ctx)
       # Mark that we have a return value, as we may be deeper in evaluation, like going through an
       # if condition's body.
       ctx['__returned__'] = value
       return value
 
-    # Raise an error for break or continue, which should be caught and handled inside of loops,
-    # otherwise the error will be raised (which is desired when used outside of a loop).
-    if isinstance(stmt, ast.Break):
+    return run_return
+
+  # Raise an error for break or continue, which should be caught and handled inside of loops,
+  # otherwise the error will be raised (which is desired when used outside of a loop).
+  def _compile_break(self, node: ast.Break) -> _Evaluator:
+
+    def run_break(rt, ctx):
       raise LoopBreak()
-    if isinstance(stmt, ast.Continue):
+
+    return run_break
+
+  def _compile_continue(self, node: ast.Continue) -> _Evaluator:
+
+    def run_continue(rt, ctx):
       raise LoopContinue()
 
+    return run_continue
+
+  def _compile_pass(self, node: ast.Pass) -> _Evaluator:
     # Literally nothing.
-    if isinstance(stmt, ast.Pass):
+    return lambda rt, ctx: None
+
+
+def _execute_sandboxed(code: _ParsedCode, ctx: dict[str, Any], dynprompt,
+                       unique_id) -> tuple[bool, Any]:
+  """Executes the code in the sandbox pool, returning if it was and the value.
+
+  If the code uses something that needs ComfyUI, or has inputs that can't be sent to the sandbox,
+  then it's not executed so the caller can execute it in-process instead.
+  """
+  names = code.get_names()
+  unsupported = sorted(names & _SANDBOX_UNSUPPORTED)
+  if unsupported:
+    log_node_info(
+      _NODE_NAME,
+      f"Power Puter node #{unique_id} is executing in-process, rather than in the sandbox, as it"
+      f" uses `{'`, `'.join(unsupported)}`."
+    )
+    return False, None
+
+  # Only send the prompt when the code can look up nodes from it.
+  prompt = None
+  if dynprompt and names & set(_PROMPT_LOOKUP_FUNCTIONS):
+    prompt = {node_id: dynprompt.get_node(node_id) for node_id in dynprompt.all_node_ids()}
+  try:
+    value = get_sandbox_pool().execute(code=code.code, ctx=ctx, prompt=prompt, unique_id=unique_id)
+  except SandboxUnavailable as e:
+    log_node_info(
+      _NODE_NAME,
+      f"Power Puter node #{unique_id} is executing in-process, rather than in the sandbox: {e}"
+    )
+    return False, None
+  return True, value
+
+
+def _get_linked_inputs(dynprompt, unique_id) -> list[str]:
+  """Returns the input variables of the node that are linked to another node in the prompt."""
+  if not dynprompt:
+    return list(_INPUT_VARIABLES)
+  try:
+    inputs = dynprompt.get_node(unique_id)['inputs']
+  except (TypeError, KeyError):
+    return list(_INPUT_VARIABLES)
+  return [c for c in _INPUT_VARIABLES if isinstance(inputs.get(c), list)]
+
+
+# Built-in functions, and methods, without side effects that can be evaluated ahead of execution to
+# decide which branch the code will take.
+_PURE_BUILT_INS = frozenset([
+  'round', 'ceil', 'floor', 'sqrt', 'min', 'max', 'sum', 'any', 'all', 're', 'len', 'int', 'float',
+  'str', 'bool', 'list', 'tuple', 'set', 'type', 'sha264',
+  *(fn.name for fn in _BUILT_IN_FNS_LIST if fn.name.startswith('.tensor_'))
+])
+_NON_EXPRESSION_NODES = (ast.expr_context, ast.operator, ast.unaryop, ast.cmpop, ast.boolop)
+_PURE_METHODS = frozenset([
+  'startswith', 'endswith', 'lower', 'upper', 'strip', 'lstrip', 'rstrip', 'split', 'replace',
+  'join', 'get', 'keys', 'values', 'items', 'count', 'find', 'index', 'isdigit', 'isnumeric',
+  'isalpha', 'search', 'match', 'fullmatch'
+])
+
+
+class _PendingInputs(Exception):
+  """Raised when the rest of the code can't be analyzed until requested inputs are evaluated."""
+
+
+class _LazyInputAnalyzer:
+  """Determines which input variables the code will read, given the inputs available so far.
+
+  The code is walked statically, collecting the input variables read along the way. When the test
+  of an `if` statement or expression (or an operand of `and`/`or`) only reads available inputs and
+  has no side effects, it's evaluated and only the taken path is followed. When that test needs an
+  input that's not yet available then we stop, requesting only what's been read so far; the rest
+  is decided when we're asked again with those inputs evaluated. Anything else is followed
+  conservatively, so an input that may be read is always requested.
+
+  Tests are evaluated under small, fixed budgets, so a test like `10 ** a` with a huge input can't
+  run away; one that exceeds them is undecided, and followed conservatively.
+  """
+
+  def __init__(self, module: ast.Module, available: dict[str, Any]):
+    self._module = module
+    self._available = available
+    # The runtime the tests are evaluated with; pure tests only ever need its budget.
+    self._rt = SimpleNamespace(budget=_ExecutionBudget(limits=_LAZY_TEST_BUDGETS))
+    self._needed: dict[str, None] = {}
+    # Names assigned or mutated anywhere in the code, which can't be decided ahead of execution.
+    self._assigned = set()
+    for node in ast.walk(module):
+      if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+        self._assigned.add(node.id)
+      elif isinstance(node, (ast.Subscript, ast.Attribute)) and isinstance(node.ctx, ast.Store):
+        if isinstance(node.value, ast.Name):
+          self._assigned.add(node.value.id)
+      elif isinstance(node, ast.NamedExpr):
+        self._assigned.add(node.target.id)
+      elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        if isinstance(node.func.value, ast.Name) and node.func.attr not in _PURE_METHODS:
+          self._assigned.add(node.func.value.id)
+
+  def analyze(self) -> list[str]:
+    """Returns the list of input variables that will, or may, be read."""
+    try:
+      self._walk(self._module.body)
+    except _PendingInputs:
+      pass
+    return list(self._needed)
+
+  def _walk(self, stmts: list[ast.stmt]) -> bool:
+    """Walks the statements, returning False if a return means no further statements are run."""
+    for stmt in stmts:
+      if isinstance(stmt, ast.If):
+        taken = self._decide(stmt.test)
+        if taken is None:
+          self._collect(stmt.test)
+          for body in stmt.body + stmt.orelse:
+            self._collect(body)
+        elif not self._walk(stmt.body if taken else stmt.orelse):
+          return False
+        continue
+      self._collect(stmt)
+      if isinstance(stmt, ast.Return):
+        return False
+    return True
+
+  def _collect(self, node: ast.AST):
+    """Collects the input variables read by the node, following decidable expressions only."""
+    if isinstance(node, ast.Name):
+      if node.id in _INPUT_VARIABLES and isinstance(node.ctx, ast.Load):
+        self._needed[node.id] = None
+    elif isinstance(node, ast.IfExp):
+      taken = self._decide(node.test)
+      if taken is None:
+        self._collect(node.test)
+        self._collect(node.body)
+        self._collect(node.orelse)
+      else:
+        self._collect(node.body if taken else node.orelse)
+    elif isinstance(node, ast.BoolOp):
+      is_and = isinstance(node.op, ast.And)
+      for i, value in enumerate(node.values):
+        truthy = self._decide(value) if i < len(node.values) - 1 else None
+        if truthy is None:
+          for remaining in node.values[i:]:
+            self._collect(remaining)
+          break
+        if truthy != is_and:
+          break
+    else:
+      for child in ast.iter_child_nodes(node):
+        self._collect(child)
+
+  def _decide(self, test: ast.expr) -> Optional[bool]:
+    """Returns the truthiness of the test if it can be evaluated now, or None if it cannot.
+
+    Raises _PendingInputs if the test could be evaluated once unavailable inputs are.
+    """
+    if not self._is_pure(test):
       return None
+    reads = [n.id for n in ast.walk(test) if isinstance(n, ast.Name) and n.id in _INPUT_VARIABLES]
+    for name in reads:
+      self._needed[name] = None
+    if any(name not in self._available for name in reads):
+      raise _PendingInputs()
+    try:
+      return bool(_Compiler(budgeted=True).compile(test)(self._rt, {**self._available}))
+    except Exception:  # pylint: disable = broad-exception-caught
+      return None
+
+  def _is_pure(self, node: ast.AST) -> bool:
+    """Checks if the expression can be evaluated ahead of execution with no side effects."""
+    if isinstance(node, ast.Constant):
+      return True
+    if isinstance(node, ast.Name):
+      return node.id in _INPUT_VARIABLES and node.id not in self._assigned
+    if isinstance(node, ast.Call):
+      if node.keywords or any(isinstance(arg, ast.Starred) for arg in node.args):
+        return False
+      if isinstance(node.func, ast.Name):
+        func_ok = node.func.id in _PURE_BUILT_INS and node.func.id not in self._assigned
+      elif isinstance(node.func, ast.Attribute):
+        func_ok = node.func.attr in _PURE_METHODS and self._is_pure(node.func.value)
+      else:
+        func_ok = False
+      return func_ok and all(self._is_pure(arg) for arg in node.args)
+    if isinstance(node, ast.Dict) and None in node.keys:
+      return False
+    if isinstance(
+      node, (
+        ast.Attribute, ast.Subscript, ast.Slice, ast.Compare, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+        ast.IfExp, ast.List, ast.Tuple, ast.Dict, ast.JoinedStr, ast.FormattedValue
+      )
+    ):
+      return all(
+        self._is_pure(child)
+        for child in ast.iter_child_nodes(node)
+        if not isinstance(child, _NON_EXPRESSION_NODES)
+      )
+    return False
+
+
+def _get_prompt_references(module: ast.Module) -> list[tuple]:
+  """Statically determines the nodes the code looks up from the prompt.
 
-    raise TypeError(stmt)
+  Each reference is a tuple of the kind of lookup and its static argument, if any. A lookup whose
+  argument can't be statically determined references the entire prompt.
+  """
+  references = []
+  for node in ast.walk(module):
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+      continue
+    name = node.func.id
+    if name not in _PROMPT_LOOKUP_FUNCTIONS:
+      continue
+    arg = node.args[0] if len(node.args) == 1 and not node.keywords else None
+    if name == 'input_node':
+      # The node linked to our own input, unless looking up the input of another node.
+      is_static = isinstance(arg, ast.Constant) and isinstance(arg.value, str)
+      references.append(('input', arg.value) if is_static else ('prompt', None))
+    elif not node.args and not node.keywords:
+      if name == 'node':
+        references.append(('self', None))
+      elif name == 'output_nodes':
+        references.append(('outputs', None))
+      else:
+        references.append(('prompt', None))
+    elif name != 'output_nodes' and isinstance(arg, ast.Constant):
+      references.append(('find', arg.value))
+    elif (
+      name != 'output_nodes' and isinstance(arg, ast.Call) and isinstance(arg.func, ast.Name) and
+      arg.func.id == 're' and len(arg.args) == 1 and isinstance(arg.args[0], ast.Constant) and
+      isinstance(arg.args[0].value, str)
+    ):
+      references.append(('pattern', arg.args[0].value))
+    else:
+      references.append(('prompt', None))
+  return references
+
+
+def _get_executing_prompt(kwargs: dict) -> Optional[dict]:
+  """Returns the API prompt that is executing, for when we're not passed one (like IS_CHANGED).
+
+  ComfyUI does not pass the hidden prompt inputs to IS_CHANGED, so we look for the prompt that is
+  currently running in the queue, and ensure it is the one with our node and code. Returns None if
+  it can't be determined, which callers must treat as always changed.
+  """
+  prompt = kwargs.get('prompt')
+  if not prompt and kwargs.get('dynprompt'):
+    prompt = kwargs['dynprompt'].get_original_prompt()
+  if prompt:
+    return prompt if _is_prompt_with_code(prompt, kwargs) else None
+  # NOTE: `currently_running` is private to ComfyUI's PromptQueue; each of its values is a queue
+  # item tuple of (number, prompt_id, prompt, extra_data, outputs_to_execute). Since that could
+  # change without notice, we validate the shape of everything and only use a prompt that has our
+  # node with our code, rather than trusting the position of anything.
+  try:
+    from server import PromptServer  # pylint: disable = import-outside-toplevel
+    queue = PromptServer.instance.prompt_queue
+    with queue.mutex:
+      running = list(queue.currently_running.values())
+  except Exception:  # pylint: disable = broad-exception-caught
+    return None
+  prompts = [
+    item[2] for item in running
+    if isinstance(item, (tuple, list)) and len(item) > 2 and _is_prompt_with_code(item[2], kwargs)
+  ]
+  # With more than one match, like the same workflow running on multiple workers, we can't know
+  # which one is ours unless they're the same.
+  if not prompts or any(p != prompts[0] for p in prompts[1:]):
+    return None
+  return prompts[0]
+
+
+def _is_prompt_with_code(prompt: Any, kwargs: dict) -> bool:
+  """Returns whether the prompt is a dict with our node (by `unique_id`) and its code."""
+  if not isinstance(prompt, dict):
+    return False
+  node = prompt.get(str(kwargs.get('unique_id')))
+  return isinstance(node, dict) and get_dict_value(node, 'inputs.code') == kwargs.get('code')
+
+
+def _get_prompt_fingerprint(references: list[tuple], prompt: dict, unique_id) -> str:
+  """Returns a stable hash of the prompt nodes that the references resolve to."""
+  index = _PromptNodeIndex(prompt)
+  nodes = {}
+  for kind, value in references:
+    if kind == 'self':
+      found = [index.by_id.get(str(unique_id))]
+    elif kind == 'outputs':
+      found = index.links_from.get(str(unique_id), [])
+    elif kind == 'input':
+      link = get_dict_value(index.by_id.get(str(unique_id), {}), f'inputs.{value}')
+      found = [index.by_id.get(str(link[0]))] if isinstance(link, list) and link else []
+    elif kind == 'find':
+      found = index.find(value)
+    elif kind == 'pattern':
+      try:
+        found = index.find(re.compile(value))
+      except re.error:
+        found = index.nodes
+    else:
+      found = index.nodes
+    for node in found:
+      if node is not None:
+        nodes[node['id']] = node
+  data = json.dumps([nodes[k] for k in sorted(nodes)], sort_keys=True, default=str)
+  return hashlib.sha256(data.encode()).hexdigest()
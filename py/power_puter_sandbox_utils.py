@@ -0,0 +1,386 @@
+"""Runs Power Puter code in a pool of persistent worker processes, rather than ComfyUI's process.
+
+Heavy string and JSON work then doesn't compete for the GIL with ComfyUI's main thread, and runaway
+code can be killed, with hard CPU-time and RSS limits, without restarting the server. Primitives are
+pickled over the worker's pipes while tensors are passed through shared memory.
+
+A worker is a fresh interpreter (not a multiprocessing spawn, which would re-import ComfyUI's main
+module) that loads this package under a private name, so only code that doesn't need ComfyUI itself
+can run there.
+"""
+
+import atexit
+import builtins
+import io
+import os
+import pickle
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Optional
+
+import numpy as np
+
+from .config import get_config_value
+from .constants import get_name
+from .log import log_node_info
+
+try:
+  import resource
+except ImportError:  # Windows has no resource module, so no CPU limit.
+  resource = None
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Loads this package under a private name in the worker, and runs the worker loop.
+_WORKER_BOOTSTRAP = """
+import importlib, importlib.util, os, sys
+path = sys.argv[1]
+spec = importlib.util.spec_from_file_location(
+  'rgthree_puter_sandbox', os.path.join(path, '__init__.py'), submodule_search_locations=[path])
+package = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = package
+spec.loader.exec_module(package)
+importlib.import_module(spec.name + '.power_puter_sandbox_utils').run_worker()
+"""
+
+# The types that can be sent to, and returned from, a worker.
+_TRANSPORTABLE_TYPES = (
+  type(None), bool, int, float, complex, str, bytes, list, tuple, dict, set, frozenset, np.ndarray,
+  np.generic
+)
+
+
+class SandboxUnavailable(Exception):
+  """Raised when the code, or its inputs, can't be run in the sandbox; it can be run in-process."""
+
+
+class SandboxError(Exception):
+  """Raised when the code errored in the sandbox, or its worker was killed."""
+
+
+def _is_tensor(value: Any) -> bool:
+  """Checks if the value is a tensor, without importing torch if it hasn't been already."""
+  torch = sys.modules.get('torch')
+  return torch is not None and isinstance(value, torch.Tensor)
+
+
+def is_transportable(value: Any) -> bool:
+  """Checks if the value is made up of only primitives, containers, arrays and tensors."""
+  if _is_tensor(value):
+    return True
+  if not isinstance(value, _TRANSPORTABLE_TYPES):
+    return False
+  if isinstance(value, dict):
+    return all(is_transportable(k) and is_transportable(v) for k, v in value.items())
+  if isinstance(value, (list, tuple, set, frozenset)):
+    return all(is_transportable(v) for v in value)
+  return True
+
+
+def _share_tensor(tensor, shms: list[shared_memory.SharedMemory]) -> tuple:
+  """Copies the tensor into a new shared memory block, returning its persistent id."""
+  import torch  # pylint: disable = import-outside-toplevel
+  tensor = tensor.detach().to('cpu').contiguous()
+  data = tensor.reshape(-1).view(torch.uint8).numpy() if tensor.numel() else None
+  shm = shared_memory.SharedMemory(create=True, size=max(1, 0 if data is None else data.nbytes))
+  shms.append(shm)
+  if data is not None:
+    dest = np.ndarray(data.shape, dtype=np.uint8, buffer=shm.buf)
+    dest[:] = data
+    del dest
+  return ('tensor', shm.name, tuple(tensor.shape), str(tensor.dtype).replace('torch.', ''))
+
+
+def _load_tensor(name: str, shape: tuple, dtype: str, unlink: bool):
+  """Copies a tensor out of a shared memory block, and unlinks the block if we own it now."""
+  import torch  # pylint: disable = import-outside-toplevel
+  dtype = getattr(torch, dtype)
+  shm = shared_memory.SharedMemory(name=name)
+  try:
+    numel = int(np.prod(shape)) if shape else 1
+    nbytes = numel * torch.empty(0, dtype=dtype).element_size()
+    data = np.ndarray((nbytes,), dtype=np.uint8, buffer=shm.buf).copy()
+  finally:
+    shm.close()
+    if unlink:
+      shm.unlink()
+    else:
+      # The sender will unlink it, so make sure our resource tracker doesn't try to as well.
+      resource_tracker.unregister(shm._name, 'shared_memory')  # pylint: disable = protected-access
+  return torch.from_numpy(data).view(dtype).reshape(shape)
+
+
+class _Pickler(pickle.Pickler):
+  """Pickles values, putting tensors into shared memory rather than through the pipe."""
+
+  def __init__(self, file, shms: list[shared_memory.SharedMemory]):
+    super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+    self._shms = shms
+
+  def persistent_id(self, obj):
+    return _share_tensor(obj, self._shms) if _is_tensor(obj) else None
+
+
+class _Unpickler(pickle.Unpickler):
+  """Unpickles values, copying tensors out of their shared memory."""
+
+  def __init__(self, file, unlink: bool):
+    super().__init__(file)
+    self._unlink = unlink
+
+  def persistent_load(self, pid):
+    kind, name, shape, dtype = pid
+    if kind != 'tensor':
+      raise pickle.UnpicklingError(f'Unknown persistent id "{kind}".')
+    return _load_tensor(name, shape, dtype, self._unlink)
+
+
+def _dump(value: Any, shms: list[shared_memory.SharedMemory]) -> bytes:
+  """Pickles the value into bytes, so a failure never leaves a partial message in the pipe."""
+  buffer = io.BytesIO()
+  _Pickler(buffer, shms).dump(value)
+  return buffer.getvalue()
+
+
+def _close_shms(shms: list[shared_memory.SharedMemory], unlink: bool):
+  for shm in shms:
+    shm.close()
+    if unlink:
+      shm.unlink()
+    else:
+      resource_tracker.unregister(shm._name, 'shared_memory')  # pylint: disable = protected-access
+  shms.clear()
+
+
+def run_worker():
+  """The worker process's loop, reading tasks from stdin and writing the results to stdout."""
+  # Keep the original stdout for results, and send anything else printed, like `print()` from the
+  # code or our logs, to stderr which is ComfyUI's console.
+  conn_out = os.fdopen(os.dup(1), 'wb')
+  os.dup2(2, 1)
+  conn_in = sys.stdin.buffer
+
+  from .power_puter import _Puter  # pylint: disable = import-outside-toplevel
+
+  # Shared memory we've sent results in, which the main process unlinks once it's read them.
+  sent_shms = []
+  while True:
+    try:
+      task = _Unpickler(conn_in, unlink=False).load()
+    except EOFError:
+      break
+    _close_shms(sent_shms, unlink=False)
+    if resource is not None and task['cpu_seconds']:
+      # The CPU limit is for the process's lifetime, so extend it by the limit for each task.
+      usage = resource.getrusage(resource.RUSAGE_SELF)
+      _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+      soft = int(usage.ru_utime + usage.ru_stime + task['cpu_seconds']) + 1
+      if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+      resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+      value = _Puter(
+        code=task['code'],
+        ctx=task['ctx'],
+        workflow=None,
+        prompt=task['prompt'],
+        dynprompt=task['prompt'],
+        unique_id=task['unique_id'],
+      ).execute()
+      if not is_transportable(value):
+        raise TypeError(f'Cannot return a value of type {type(value).__name__} from the sandbox.')
+      result = _dump(('ok', value), sent_shms)
+    except Exception as e:  # pylint: disable = broad-exception-caught
+      _close_shms(sent_shms, unlink=True)
+      result = _dump(('error', type(e).__name__, str(e)), sent_shms)
+    conn_out.write(result)
+    conn_out.flush()
+  _close_shms(sent_shms, unlink=False)
+
+
+def _get_rss(pid: int) -> int:
+  """Returns the resident memory of the process in bytes, or 0 if it can't be read (not Linux)."""
+  try:
+    with open(f'/proc/{pid}/statm', 'r', encoding='UTF-8') as file:
+      return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError, IndexError, AttributeError):
+    return 0
+
+
+class _Worker:
+  """A persistent worker process, running one task at a time."""
+
+  def __init__(self, cpu_seconds: float, max_rss_mb: float):
+    self.cpu_seconds = cpu_seconds
+    self.max_rss = max_rss_mb * 1024 * 1024
+    self.process = subprocess.Popen(
+      [sys.executable, '-c', _WORKER_BOOTSTRAP, _PACKAGE_DIR],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+    )
+    self._kill_reason: Optional[str] = None
+
+  def is_alive(self) -> bool:
+    return self.process.poll() is None
+
+  def run(self, task: dict, timeout: float) -> tuple:
+    """Runs the task, returning the result tuple or raising SandboxError if the worker died."""
+    shms = []
+    try:
+      try:
+        message = _dump({**task, 'cpu_seconds': self.cpu_seconds}, shms)
+      except Exception as e:
+        raise SandboxUnavailable(f'Could not send the inputs to the sandbox: {e}') from e
+      self._kill_reason = None
+      done = threading.Event()
+      watchdog = threading.Thread(target=self._watch, args=(done, timeout), daemon=True)
+      watchdog.start()
+      try:
+        self.process.stdin.write(message)
+        self.process.stdin.flush()
+        return _Unpickler(self.process.stdout, unlink=True).load()
+      except (EOFError, OSError, pickle.UnpicklingError) as e:
+        raise SandboxError(f'Power Puter sandbox worker {self._get_death_reason()}.') from e
+      finally:
+        done.set()
+    finally:
+      _close_shms(shms, unlink=True)
+
+  def _watch(self, done: threading.Event, timeout: float):
+    """Kills the worker if it runs past the timeout, or its resident memory exceeds the limit."""
+    deadline = time.monotonic() + timeout if timeout else None
+    while not done.wait(0.05):
+      if deadline is not None and time.monotonic() > deadline:
+        self._kill(f'was killed after exceeding the {timeout}s timeout')
+      elif self.max_rss and _get_rss(self.process.pid) > self.max_rss:
+        self._kill(f'was killed after exceeding the {self.max_rss // 1024 // 1024}MB memory limit')
+
+  def _kill(self, reason: str):
+    self._kill_reason = reason
+    self.process.kill()
+
+  def _get_death_reason(self) -> str:
+    if self._kill_reason:
+      return self._kill_reason
+    try:
+      code = self.process.wait(timeout=1)
+    except subprocess.TimeoutExpired:
+      self.process.kill()
+      return 'stopped responding'
+    if hasattr(signal, 'SIGXCPU') and code == -signal.SIGXCPU:
+      return f'was killed after exceeding the {self.cpu_seconds}s CPU time limit'
+    return f'exited unexpectedly with code {code}'
+
+  def close(self):
+    """Closes the worker, which exits when its stdin closes, killing it if it doesn't."""
+    try:
+      self.process.stdin.close()
+      self.process.wait(timeout=1)
+    except (OSError, subprocess.TimeoutExpired):
+      self.process.kill()
+
+
+class SandboxPool:
+  """A pool of persistent sandbox workers, started as they're needed up to the pool size.
+
+  Attributes:
+    size: The maximum number of workers, and so concurrent executions.
+    cpu_seconds: The CPU time an execution can use before its worker is killed, or 0 for no limit.
+    max_rss_mb: The resident memory a worker can use before it's killed, or 0 for no limit.
+    timeout_seconds: The wall time an execution can take before its worker is killed, or 0.
+  """
+
+  def __init__(self, size: int, cpu_seconds: float, max_rss_mb: float, timeout_seconds: float):
+    self.size = max(1, size)
+    self.cpu_seconds = cpu_seconds
+    self.max_rss_mb = max_rss_mb
+    self.timeout_seconds = timeout_seconds
+    self._idle: list[_Worker] = []
+    self._count = 0
+    self._condition = threading.Condition()
+
+  def execute(self, *, code: str, ctx: dict[str, Any], prompt: Optional[dict], unique_id) -> Any:
+    """Executes the code in a worker, returning its value.
+
+    Raises SandboxUnavailable if the inputs can't be sent to a worker, so the caller can fall back
+    to executing in-process, and SandboxError if the code errored or its worker was killed.
+    """
+    if not is_transportable(ctx):
+      raise SandboxUnavailable('The inputs are not all primitives, containers or tensors.')
+    task = {'code': code, 'ctx': ctx, 'prompt': prompt, 'unique_id': unique_id}
+    worker = self._acquire()
+    try:
+      result = worker.run(task, self.timeout_seconds)
+    finally:
+      self._release(worker)
+    if result[0] == 'ok':
+      return result[1]
+    _, error_type, message = result
+    error_class = getattr(builtins, error_type, None)
+    if isinstance(error_class, type) and issubclass(error_class, Exception):
+      raise error_class(message)
+    raise SandboxError(f'{error_type}: {message}')
+
+  def _acquire(self) -> _Worker:
+    with self._condition:
+      while True:
+        while self._idle:
+          worker = self._idle.pop()
+          if worker.is_alive():
+            return worker
+          self._count -= 1
+        if self._count < self.size:
+          self._count += 1
+          break
+        self._condition.wait()
+    try:
+      return _Worker(self.cpu_seconds, self.max_rss_mb)
+    except Exception:
+      with self._condition:
+        self._count -= 1
+        self._condition.notify()
+      raise
+
+  def _release(self, worker: _Worker):
+    with self._condition:
+      if worker.is_alive():
+        self._idle.append(worker)
+      else:
+        self._count -= 1
+      self._condition.notify()
+
+  def shutdown(self):
+    """Closes the idle workers."""
+    with self._condition:
+      workers = self._idle
+      self._idle = []
+      self._count -= len(workers)
+    for worker in workers:
+      worker.close()
+
+
+_POOL: Optional[SandboxPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_sandbox_pool() -> SandboxPool:
+  """Returns the shared sandbox pool, creating it from the config the first time it's needed."""
+  global _POOL
+  with _POOL_LOCK:
+    if _POOL is None:
+      _POOL = SandboxPool(
+        size=get_config_value('nodes.power_puter.sandbox.pool_size', 2),
+        cpu_seconds=get_config_value('nodes.power_puter.sandbox.cpu_seconds', 120),
+        max_rss_mb=get_config_value('nodes.power_puter.sandbox.max_rss_mb', 2048),
+        timeout_seconds=get_config_value('nodes.power_puter.sandbox.timeout_seconds', 120),
+      )
+      atexit.register(_POOL.shutdown)
+      log_node_info(
+        get_name('Power Puter'), f'Using a sandbox pool of up to {_POOL.size} worker processes.'
+      )
+  return _POOL
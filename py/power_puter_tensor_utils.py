@@ -0,0 +1,176 @@
+"""Vectorized tensor functions for the Power Puter, available to the code under `tensor.`
+
+Each works on an IMAGE ([B,H,W,C]), MASK ([B,H,W]) or LATENT (a dict with 'samples' [B,C,H,W]) as
+well as any other tensor, NumPy array or list of numbers, without looping through the interpreter.
+
+Reductions return a number, or a (nested) list of numbers when reducing over some dimensions or
+`per_batch`, so they can be used directly in the code. Element-wise functions return a new tensor
+(or LATENT, if passed one), never modifying the input which may be shared with the workflow.
+
+Like: tensor.mean(image) > 0.5
+Like: tensor.max(image, dim=(0, 1, 2))  # Per-channel max.
+Like: tensor.mean(tensor.gt(mask, 0.5), per_batch=True)  # Mask coverage of each batch item.
+"""
+
+from typing import Any, Callable, Optional, Union
+
+import numpy as np
+
+Dims = Union[int, list[int], tuple[int, ...], None]
+
+
+def _unwrap(value: Any) -> tuple[Any, Callable[[Any], Any]]:
+  """Returns the value as a tensor, and a function that wraps a result like the value was."""
+  import torch  # pylint: disable = import-outside-toplevel
+  if isinstance(value, dict) and 'samples' in value:
+    return value['samples'], lambda samples: {**value, 'samples': samples}
+  if isinstance(value, torch.Tensor):
+    return value, lambda result: result
+  if isinstance(value, np.ndarray):
+    return torch.from_numpy(value), lambda result: result
+  return torch.as_tensor(value), lambda result: result
+
+
+def _as_float(tensor):
+  """Returns the tensor as a floating point tensor, for reductions that need one."""
+  return tensor if tensor.is_floating_point() else tensor.float()
+
+
+def _get_dims(tensor, dim: Dims, per_batch: bool) -> Optional[tuple[int, ...]]:
+  """Returns the dims to reduce; all but the batch dimension if `per_batch`."""
+  if per_batch:
+    return tuple(range(1, tensor.dim()))
+  if dim is None:
+    return None
+  return tuple(dim) if isinstance(dim, (list, tuple)) else (dim,)
+
+
+def _to_value(result) -> Union[int, float, bool, list]:
+  """Returns the result tensor as a number, or a list of numbers."""
+  return result.item() if result.dim() == 0 else result.tolist()
+
+
+def _reduce(fn: Callable, value: Any, dim: Dims, per_batch: bool, needs_float: bool = False):
+  tensor, _ = _unwrap(value)
+  if needs_float:
+    tensor = _as_float(tensor)
+  dims = _get_dims(tensor, dim, per_batch)
+  return _to_value(fn(tensor) if dims is None else fn(tensor, dim=dims))
+
+
+def mean(value: Any, dim: Dims = None, per_batch: bool = False):
+  """Returns the mean of the value, or over the dim(s) or each batch item."""
+  import torch  # pylint: disable = import-outside-toplevel
+  return _reduce(torch.mean, value, dim, per_batch, needs_float=True)
+
+
+def std(value: Any, dim: Dims = None, per_batch: bool = False):
+  """Returns the standard deviation of the value, or over the dim(s) or each batch item."""
+  import torch  # pylint: disable = import-outside-toplevel
+  return _reduce(torch.std, value, dim, per_batch, needs_float=True)
+
+
+def sum_(value: Any, dim: Dims = None, per_batch: bool = False):
+  """Returns the sum of the value, or over the dim(s) or each batch item."""
+  import torch  # pylint: disable = import-outside-toplevel
+  return _reduce(torch.sum, value, dim, per_batch)
+
+
+def min_(value: Any, dim: Dims = None, per_batch: bool = False):
+  """Returns the minimum of the value, or over the dim(s) or each batch item."""
+  import torch  # pylint: disable = import-outside-toplevel
+  return _reduce(torch.amin, value, dim, per_batch)
+
+
+def max_(value: Any, dim: Dims = None, per_batch: bool = False):
+  """Returns the maximum of the value, or over the dim(s) or each batch item."""
+  import torch  # pylint: disable = import-outside-toplevel
+  return _reduce(torch.amax, value, dim, per_batch)
+
+
+def norm(value: Any, p: float = 2, dim: Dims = None, per_batch: bool = False):
+  """Returns the p-norm of the value, or over the dim(s) or each batch item."""
+  import torch  # pylint: disable = import-outside-toplevel
+  return _reduce(
+    lambda t, **kwargs: torch.linalg.vector_norm(t, ord=p, **kwargs), value, dim, per_batch, True
+  )
+
+
+def quantile(value: Any, q: float, dim: Optional[int] = None, per_batch: bool = False):
+  """Returns the q-th quantile (0 to 1) of the value, or along the dim or of each batch item.
+
+  Uses linear interpolation between the two nearest values, like `torch.quantile`, but through
+  `kthvalue` so it's not limited in the number of elements.
+  """
+  import torch  # pylint: disable = import-outside-toplevel
+  if not 0 <= q <= 1:
+    raise ValueError('tensor.quantile() q must be between 0 and 1.')
+  tensor, _ = _unwrap(value)
+  tensor = _as_float(tensor)
+  if per_batch:
+    tensor, dim = tensor.reshape(tensor.shape[0], -1), 1
+  elif dim is None:
+    tensor, dim = tensor.reshape(-1), 0
+  position = q * (tensor.shape[dim] - 1)
+  lower = int(position)
+  low = torch.kthvalue(tensor, lower + 1, dim=dim).values
+  if position == lower:
+    return _to_value(low)
+  high = torch.kthvalue(tensor, lower + 2, dim=dim).values
+  return _to_value(low + (high - low) * (position - lower))
+
+
+def histogram(  # pylint: disable = redefined-builtin
+  value: Any, bins: int = 10, min: Optional[float] = None, max: Optional[float] = None
+):
+  """Returns the counts of the values in each of the bins, between the min and max.
+
+  The min and max default to those of the value.
+  """
+  import torch  # pylint: disable = import-outside-toplevel
+  tensor, _ = _unwrap(value)
+  tensor = _as_float(tensor)
+  low = tensor.min().item() if min is None else min
+  high = tensor.max().item() if max is None else max
+  return [int(c) for c in torch.histc(tensor, bins=bins, min=low, max=high).tolist()]
+
+
+def clamp(  # pylint: disable = redefined-builtin
+  value: Any, min: Optional[float] = None, max: Optional[float] = None
+):
+  """Returns a new tensor with the values clamped between the min and max."""
+  import torch  # pylint: disable = import-outside-toplevel
+  tensor, wrap = _unwrap(value)
+  return wrap(torch.clamp(tensor, min=min, max=max))
+
+
+def where(condition: Any, value: Any, other: Any):
+  """Returns a new tensor of value where the condition is true and other where it is not."""
+  import torch  # pylint: disable = import-outside-toplevel
+  condition, _ = _unwrap(condition)
+  value, wrap = _unwrap(value) if not isinstance(value, (int, float)) else (value, None)
+  other, other_wrap = _unwrap(other) if not isinstance(other, (int, float)) else (other, None)
+  result = torch.where(condition.bool(), value, other)
+  wrap = wrap or other_wrap
+  return wrap(result) if wrap else result
+
+
+def _compare(fn_name: str) -> Callable[[Any, Any], Any]:
+  """Returns an element-wise comparison function, returning a tensor of bools."""
+
+  def compare(value: Any, other: Any):
+    import torch  # pylint: disable = import-outside-toplevel
+    tensor, _ = _unwrap(value)
+    if not isinstance(other, (int, float)):
+      other, _ = _unwrap(other)
+    return getattr(torch, fn_name)(tensor, other)
+
+  compare.__doc__ = f'Compares the value and other element-wise, like `torch.{fn_name}`.'
+  return compare
+
+
+gt = _compare('gt')
+ge = _compare('ge')
+lt = _compare('lt')
+le = _compare('le')
+eq = _compare('eq')
@@ -1,29 +1,25 @@
 """See node."""
-import random
-from datetime import datetime
-
 from .utils_graph import get_worflow_node
+from .utils_rng import rng
 
 from .constants import get_category, get_name
 from .log import log_node_warn, log_node_info
 
-# Some extension must be setting a seed as server-generated seeds were not random. We'll set a new
-# seed and use that state going forward.
-initial_random_state = random.getstate()
-random.seed(datetime.now().timestamp())
-rgthree_seed_random_state = random.getstate()
-random.setstate(initial_random_state)
+_MAX_SEED = 1125899906842624
+
+
+def new_random_seed(unique_id=None):
+  """Gets a new random seed from the node's own stream, leaving the global random state alone.
+
+  Some extension must be setting a seed as server-generated seeds were not random, which is why
+  these come from a dedicated stream rather than the global `random`.
+  """
+  return rng.new_seed(('seed', unique_id), 1, _MAX_SEED)
 
 
-def new_random_seed():
-  """ Gets a new random seed from the rgthree_seed_random_state and resetting the previous state."""
-  global rgthree_seed_random_state
-  prev_random_state = random.getstate()
-  random.setstate(rgthree_seed_random_state)
-  seed = random.randint(1, 1125899906842624)
-  rgthree_seed_random_state = random.getstate()
-  random.setstate(prev_random_state)
-  return seed
+def new_random_seeds(count: int, unique_id=None) -> list[int]:
+  """Gets `count` new random seeds from the node's own stream, at once."""
+  return rng.new_seeds(('seed', unique_id), count, 1, _MAX_SEED)
 
 
 class RgthreeSeed:
@@ -58,7 +54,7 @@ class RgthreeSeed:
     """Forces a changed state if we happen to get a special seed, as if from the API directly."""
     if seed in (-1, -2, -3):
       # This isn't used, but a different value than previous will force it to be "changed"
-      return new_random_seed()
+      return new_random_seed(unique_id)
     return seed
 
   def main(self, seed=0, prompt=None, extra_pnginfo=None, unique_id=None):
@@ -84,7 +80,7 @@ class RgthreeSeed:
         )
 
       original_seed = seed
-      seed = new_random_seed()
+      seed = new_random_seed(unique_id)
       log_node_info(self.NAME, f'Server-generated random seed {seed} and saving to workflow.')
       log_node_warn(
         self.NAME,
@@ -1,14 +1,20 @@
+import asyncio
 import os
 import json
+from collections import deque
+from urllib.parse import quote
 from aiohttp import web
 
+from ..config import get_config_value
 from ..log import log
 from server import PromptServer
 import folder_paths
 
 from ..utils import abspath, path_exists
-from .utils_server import get_param, is_param_falsy
+from .utils_server import get_param, is_param_falsy, is_param_truthy
 from .utils_info import delete_model_info, get_model_info, set_model_info_partial, get_file_info
+from .utils_catalog import search_model_catalog
+from .utils_index import cancel_model_index, get_model_index_state, start_model_index
 
 routes = PromptServer.instance.routes
 
@@ -38,8 +44,8 @@ async def api_get_models_list(request):
     response = []
     bad_files_first = None
     bad_files_num = 0
-    for file in files:
-      file_info = get_file_info(file, model_type)
+    file_infos = await asyncio.to_thread(lambda: [get_file_info(f, model_type) for f in files])
+    for file, file_info in zip(files, file_infos):
       # Some folks were seeing null in this list, which is odd since it's coming from ComfyUI files.
       # See https://github.com/rgthree/rgthree-comfy/issues/574#issuecomment-3494629132 We'll check
       # and log if we haven't found, maybe someone will have more info.
@@ -68,7 +74,8 @@ async def api_get_models_list(request):
 async def api_get_models_info(request):
   """Returns a list model info; either all or a specific ones if provided a 'files' param.
 
-  If a `light` param is specified and not falsy, no metadata will be fetched.
+  If a `light` param is specified and not falsy, no metadata will be fetched. See
+  `models_info_response` for paging, projecting fields and streaming.
   """
   if _check_valid_model_type(request):
     return _check_valid_model_type(request)
@@ -78,10 +85,7 @@ async def api_get_models_info(request):
   maybe_fetch_metadata = files_param is not None
   if not is_param_falsy(request, 'light'):
     maybe_fetch_metadata = False
-  api_response = await models_info_response(
-    request, model_type, maybe_fetch_metadata=maybe_fetch_metadata
-  )
-  return web.json_response(api_response)
+  return await models_info_response(request, model_type, maybe_fetch_metadata=maybe_fetch_metadata)
 
 
 @routes.get('/rgthree/api/{type}/info/refresh')
@@ -91,10 +95,9 @@ async def api_get_refresh_get_models_info(request):
     return _check_valid_model_type(request)
 
   model_type = request.match_info['type']
-  api_response = await models_info_response(
+  return await models_info_response(
     request, model_type, maybe_fetch_civitai=True, maybe_fetch_metadata=True
   )
-  return web.json_response(api_response)
 
 
 @routes.get('/rgthree/api/{type}/info/clear')
@@ -149,6 +152,69 @@ async def api_post_save_model_data(request):
   return web.json_response(api_response)
 
 
+@routes.get('/rgthree/api/{type}/search')
+async def api_get_search_models(request):
+  """Searches the catalog of the model type's info, returning a page of matches and the total.
+
+  A `q` param full text searches the name, file and trained words; `base_model`, `model_type` and
+  `sha256` params filter exactly. A `sort` of name, file, modified or base_model (prefixed with a
+  "-" for descending) orders them, otherwise by best match. Paged by `limit` and `offset`.
+  """
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+
+  limit = get_param(request, 'limit', '100')
+  offset = get_param(request, 'offset', '0')
+  if not limit.isdigit() or not offset.isdigit():
+    return web.json_response({'status': 400, 'error': 'The limit and offset must be integers.'})
+  limit = min(int(limit), 1000)
+  offset = int(offset)
+  data, total = await asyncio.to_thread(
+    search_model_catalog,
+    request.match_info['type'],
+    sync=is_param_truthy(request, 'sync'),
+    query=get_param(request, 'q'),
+    filters={key: get_param(request, key) for key in ['base_model', 'model_type', 'sha256']},
+    sort=get_param(request, 'sort'),
+    limit=limit,
+    offset=offset,
+  )
+  api_response = {'status': 200, 'data': data, 'total': total}
+  if offset + len(data) < total:
+    api_response['next_offset'] = offset + len(data)
+  return web.json_response(api_response)
+
+
+@routes.get('/rgthree/api/{type}/index')
+async def api_get_model_index(request):
+  """Returns the state of the background indexing of the model type."""
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+  return web.json_response(
+    {'status': 200, 'data': get_model_index_state(request.match_info['type'])}
+  )
+
+
+@routes.get('/rgthree/api/{type}/index/start')
+async def api_get_start_model_index(request):
+  """Starts indexing the model type in the background, if not already.
+
+  The job hashes, reads metadata and writes the info file for each model, sending its progress as
+  `rgthree-index-{type}` events.
+  """
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+  return web.json_response({'status': 200, 'data': start_model_index(request.match_info['type'])})
+
+
+@routes.get('/rgthree/api/{type}/index/cancel')
+async def api_get_cancel_model_index(request):
+  """Cancels the background indexing of the model type."""
+  if _check_valid_model_type(request):
+    return _check_valid_model_type(request)
+  return web.json_response({'status': 200, 'data': cancel_model_index(request.match_info['type'])})
+
+
 @routes.get('/rgthree/api/{type}/img')
 async def api_get_models_info_img(request):
   """ Returns an image response if one exists for the model. """
@@ -179,21 +245,103 @@ async def api_get_models_info_img(request):
 async def models_info_response(
   request, model_type, maybe_fetch_civitai=False, maybe_fetch_metadata=False
 ):
-  """Gets model info for all or a single model type."""
-  api_response = {'status': 200, 'data': []}
+  """Returns a response of model info for all or a single model type.
+
+  The files can be paged with a `limit`, and a `cursor` of the last file of the previous page; the
+  `next_cursor` is returned while there are more. A `fields` param of comma separated keys returns
+  only those keys, or all but those prefixed with a "-" (like `fields=-raw`).
+
+  With `format=ndjson` (or accepting `application/x-ndjson`) each model's info is streamed on its
+  own line as soon as it's ready, with the next cursor in an `X-Rgthree-Next-Cursor` header.
+  """
   light = not is_param_falsy(request, 'light')
+  files, next_cursor = _get_files_page(request, model_type)
+  project = _get_fields_projection(request)
+  infos = _iter_models_info(
+    files,
+    model_type,
+    maybe_fetch_civitai=maybe_fetch_civitai,
+    maybe_fetch_metadata=maybe_fetch_metadata,
+    light=light
+  )
+
+  accept = request.headers.get('Accept', '')
+  if get_param(request, 'format') == 'ndjson' or 'application/x-ndjson' in accept:
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    if next_cursor is not None:
+      response.headers['X-Rgthree-Next-Cursor'] = quote(next_cursor)
+    await response.prepare(request)
+    try:
+      async for info_data in infos:
+        await response.write(f'{json.dumps(project(info_data))}\n'.encode('utf-8'))
+    finally:
+      # Close it now, cancelling the infos in flight, if the client disconnected or we errored.
+      await infos.aclose()
+    await response.write_eof()
+    return response
+
+  api_response = {'status': 200, 'data': []}
+  try:
+    async for info_data in infos:
+      api_response['data'].append(project(info_data))
+  finally:
+    await infos.aclose()
+  if next_cursor is not None:
+    api_response['next_cursor'] = next_cursor
+  return web.json_response(api_response)
+
+
+def _get_files_page(request, model_type):
+  """Returns the requested files, paged by the `cursor` and `limit` params, and the next cursor."""
   files_param = get_param(request, 'files')
   if files_param is not None:
-    files_param = files_param.split(',')
+    files = files_param.split(',')
   else:
-    files_param = folder_paths.get_filename_list(model_type)
-  for file_param in files_param:
-    info_data = await get_model_info(
-      file_param,
-      model_type,
-      maybe_fetch_civitai=maybe_fetch_civitai,
-      maybe_fetch_metadata=maybe_fetch_metadata,
-      light=light
-    )
-    api_response['data'].append(info_data)
-  return api_response
+    files = folder_paths.get_filename_list(model_type)
+
+  cursor = get_param(request, 'cursor')
+  if cursor:
+    if cursor in files:
+      start = files.index(cursor) + 1
+    else:
+      # The cursor's file was removed, so start from the file that would've followed it.
+      start = next((i for i, file in enumerate(files) if file > cursor), len(files))
+    files = files[start:]
+
+  limit = get_param(request, 'limit')
+  if limit is not None and limit.isdigit() and 0 < int(limit) < len(files):
+    files = files[:int(limit)]
+    return files, files[-1]
+  return files, None
+
+
+def _get_fields_projection(request):
+  """Returns a function projecting a model info to the fields requested in a `fields` param."""
+  fields = [f.strip() for f in (get_param(request, 'fields') or '').split(',') if f.strip()]
+  include = [f for f in fields if not f.startswith('-')]
+  exclude = {f[1:] for f in fields if f.startswith('-')}
+
+  def project(info_data):
+    if not isinstance(info_data, dict) or not fields:
+      return info_data
+    if include:
+      return {key: info_data[key] for key in include if key in info_data and key not in exclude}
+    return {key: value for key, value in info_data.items() if key not in exclude}
+
+  return project
+
+
+async def _iter_models_info(files, model_type, **kwargs):
+  """Yields the model info of each file, in order, compiling up to a configured number at once."""
+  max_concurrency = max(1, get_config_value('model_info.max_concurrency', 16))
+  tasks = deque()
+  try:
+    for file in files:
+      if len(tasks) >= max_concurrency:
+        yield await tasks.popleft()
+      tasks.append(asyncio.ensure_future(get_model_info(file, model_type, **kwargs)))
+    while tasks:
+      yield await tasks.popleft()
+  finally:
+    for task in tasks:
+      task.cancel()
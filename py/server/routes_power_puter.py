@@ -0,0 +1,27 @@
+from aiohttp import web
+
+from server import PromptServer
+
+from .utils_server import get_param
+from ..power_puter import clear_puter_caches, get_puter_cache_stats, get_puter_profiles
+
+routes = PromptServer.instance.routes
+
+
+@routes.get('/rgthree/api/puter/cache')
+async def api_get_puter_cache_stats(request):
+  """Returns the stats of the Power Puter's code and memo caches."""
+  return web.json_response(get_puter_cache_stats())
+
+
+@routes.get('/rgthree/api/puter/cache/clear')
+async def api_clear_puter_caches(request):
+  """Clears the Power Puter's code and memo caches."""
+  clear_puter_caches()
+  return web.json_response({"status": 200})
+
+
+@routes.get('/rgthree/api/puter/profile')
+async def api_get_puter_profiles(request):
+  """Returns the most recent profile reports of profiled Power Puter nodes, or a `node` id's."""
+  return web.json_response(get_puter_profiles(get_param(request, 'node')))
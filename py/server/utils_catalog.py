@@ -0,0 +1,324 @@
+"""A SQLite catalog of the model info files, for searching a library without reading every one.
+
+The catalog mirrors each model's `.rgthree-info.json` file, indexing its name, type, base model,
+hash, trained words and modified time, with full text search (FTS5, where SQLite has it) over the
+text. It's stored in the userdata directory and synced incrementally; only models whose file or
+info file changed since the last sync (by modified time and size) are read again.
+
+Info files saved or deleted through rgthree (like by "Show Info", or indexing) mark just their model
+to be synced by the next search. Checking every file, for changes made outside of rgthree, is only
+done by the first search, one passing `sync`, or one after the configured interval.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import folder_paths
+
+from ..config import get_config_value
+from ..utils_userdata import clean_path
+from .utils_info import get_folder_path, get_info_file
+from .utils_info_cache import add_info_file_listener, read_info_file
+
+# Bump when the schema changes; the catalog is then rebuilt from the info files.
+_SCHEMA_VERSION = 1
+
+_SORTS = {
+  'name': 'name COLLATE NOCASE',
+  'file': 'file COLLATE NOCASE',
+  'modified': 'modified',
+  'base_model': 'base_model COLLATE NOCASE',
+}
+
+
+def _get_stat_key(path: Optional[str]) -> tuple[int, int]:
+  """Returns the modified time and size of the path, or zeros if it doesn't exist."""
+  try:
+    stat = os.stat(path) if path else None
+  except OSError:
+    stat = None
+  return (stat.st_mtime_ns, stat.st_size) if stat else (0, 0)
+
+
+def _get_like_pattern(word: str) -> str:
+  """Returns a LIKE pattern (escaped with a backslash) matching text containing the word."""
+  escaped = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+  return f'%{escaped}%'
+
+
+def _get_fts_query(query: str) -> str:
+  """Returns an FTS query matching all of the query's words, each as a prefix."""
+  words = [word.replace('"', '""') for word in query.split()]
+  return ' '.join(f'"{word}"*' for word in words)
+
+
+class _ModelCatalog:
+  """The catalog database, safe to use from any thread."""
+
+  def __init__(self, rel_path: str):
+    self._file_path = clean_path(rel_path)
+    self._connection: Optional[sqlite3.Connection] = None
+    self._has_fts = False
+    # Held while using the database, which can be a while.
+    self._lock = threading.Lock()
+    # Held, briefly, while using the sync state below; it's also changed by the info file listener.
+    self._state_lock = threading.Lock()
+    # When each model type last had every file checked, and a count of the times that was reset.
+    self._synced: dict[str, float] = {}
+    self._resets = 0
+    # The model type and file of each synced model's info file, and the info files changed since.
+    self._info_files: dict[str, tuple[str, str]] = {}
+    self._changed: set[str] = set()
+
+  def _get_connection(self) -> sqlite3.Connection:
+    """Returns the connection, opening and creating the database the first time."""
+    if self._connection is None:
+      os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
+      connection = sqlite3.connect(self._file_path, check_same_thread=False)
+      connection.execute('PRAGMA journal_mode=WAL')
+      if connection.execute('PRAGMA user_version').fetchone()[0] != _SCHEMA_VERSION:
+        connection.executescript('DROP TABLE IF EXISTS models; DROP TABLE IF EXISTS models_fts;')
+      connection.executescript(
+        '''
+        CREATE TABLE IF NOT EXISTS models (
+          id INTEGER PRIMARY KEY,
+          type TEXT NOT NULL,
+          file TEXT NOT NULL,
+          name TEXT,
+          model_type TEXT,
+          base_model TEXT,
+          sha256 TEXT,
+          trained_words TEXT,
+          modified REAL,
+          file_stat TEXT,
+          info_stat TEXT,
+          UNIQUE (type, file)
+        );
+        CREATE INDEX IF NOT EXISTS models_base_model ON models (type, base_model COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS models_model_type ON models (type, model_type COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS models_modified ON models (type, modified);
+        CREATE INDEX IF NOT EXISTS models_sha256 ON models (sha256);
+        '''
+      )
+      try:
+        connection.execute(
+          'CREATE VIRTUAL TABLE IF NOT EXISTS models_fts USING fts5(name, file, trained_words)'
+        )
+        self._has_fts = True
+      except sqlite3.OperationalError:
+        self._has_fts = False
+      connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+      connection.commit()
+      self._connection = connection
+    return self._connection
+
+  def mark_changed(self, info_path: str):
+    """Marks the info file's model to be synced by the next search, as the info file changed.
+
+    An info file of a model that isn't synced yet marks every model type to be checked instead.
+    """
+    with self._state_lock:
+      if info_path in self._info_files:
+        self._changed.add(info_path)
+      else:
+        self._synced.clear()
+        self._resets += 1
+
+  def invalidate(self, model_type: str):
+    """Marks the model type to have every file checked by the next search."""
+    with self._state_lock:
+      self._synced.pop(model_type, None)
+      self._resets += 1
+
+  def sync(self, model_type: str, force=False):
+    """Syncs the catalog with the model type's files.
+
+    Every file is checked if forced, the first time, or after the configured interval; otherwise,
+    only those of the info files marked as changed. Either way, only the models whose file or info
+    file changed since they were last synced are read.
+    """
+    interval = get_config_value('model_catalog.sync_interval_seconds', 300)
+    with self._state_lock:
+      last_synced = self._synced.get(model_type)
+      changed = [
+        (path, self._info_files[path][1])
+        for path in self._changed
+        if self._info_files[path][0] == model_type
+      ]
+      self._changed.difference_update(path for path, _ in changed)
+    if force or last_synced is None or time.monotonic() - last_synced >= interval:
+      self._sync_all(model_type)
+    elif changed:
+      with self._lock:
+        connection = self._get_connection()
+        for _, file in changed:
+          row = connection.execute(
+            'SELECT id, file_stat, info_stat FROM models WHERE type = ? AND file = ?',
+            (model_type, file)
+          ).fetchone()
+          self._sync_file(connection, model_type, file, row)
+        connection.commit()
+
+  def _sync_all(self, model_type: str):
+    """Syncs the catalog with all of the model type's files, removing the models now gone."""
+    with self._lock:
+      with self._state_lock:
+        synced = time.monotonic()
+        resets = self._resets
+      connection = self._get_connection()
+      existing = {
+        row[0]: (row[1], row[2], row[3]) for row in connection.execute(
+          'SELECT file, id, file_stat, info_stat FROM models WHERE type = ?', (model_type,)
+        )
+      }
+      files = folder_paths.get_filename_list(model_type)
+      for file in files:
+        self._sync_file(connection, model_type, file, existing.pop(file, None))
+      for file, row in existing.items():
+        self._delete(connection, row[0])
+      connection.commit()
+      with self._state_lock:
+        # Unless it was reset while checking, since that may have been a change we missed.
+        if self._resets == resets:
+          self._synced[model_type] = synced
+
+  def _sync_file(self, connection, model_type: str, file: str, row: Optional[tuple]):
+    """Syncs the model's row (of its id and stats), if its file or info file changed."""
+    file_path = get_folder_path(file, model_type)
+    if file_path is None:
+      if row is not None:
+        self._delete(connection, row[0])
+      return
+    info_path = get_info_file(file_path, force=True)
+    with self._state_lock:
+      self._info_files[info_path] = (model_type, file)
+    file_stat = repr(_get_stat_key(file_path))
+    info_stat = repr(_get_stat_key(info_path))
+    if row is not None and row[1] == file_stat and row[2] == info_stat:
+      return
+    model_id = row[0] if row is not None else None
+    self._upsert(connection, model_id, model_type, file, file_path, file_stat, info_stat)
+
+  def _upsert(self, connection, model_id, model_type, file, file_path, file_stat, info_stat):
+    """Inserts, or updates, the model's row from its info file."""
+    info_data = read_info_file(get_info_file(file_path), default={})
+    if not isinstance(info_data, dict):
+      info_data = {}
+    words = [w.get('word') for w in info_data.get('trainedWords') or [] if isinstance(w, dict)]
+    values = {
+      'type': model_type,
+      'file': file,
+      'name': info_data.get('name') or None,
+      'model_type': info_data.get('type') or None,
+      'base_model': info_data.get('baseModel') or None,
+      'sha256': (info_data.get('sha256') or '').lower() or None,
+      'trained_words': '\n'.join(w for w in words if isinstance(w, str)),
+      'modified': os.path.getmtime(file_path) * 1000,  # millis, like the info's 'modified'.
+      'file_stat': file_stat,
+      'info_stat': info_stat,
+    }
+    if model_id is None:
+      columns = ', '.join(values)
+      placeholders = ', '.join('?' * len(values))
+      model_id = connection.execute(
+        f'INSERT INTO models ({columns}) VALUES ({placeholders})', tuple(values.values())
+      ).lastrowid
+    else:
+      assignments = ', '.join(f'{key} = ?' for key in values)
+      connection.execute(
+        f'UPDATE models SET {assignments} WHERE id = ?', (*values.values(), model_id)
+      )
+    if self._has_fts:
+      connection.execute('DELETE FROM models_fts WHERE rowid = ?', (model_id,))
+      connection.execute(
+        'INSERT INTO models_fts (rowid, name, file, trained_words) VALUES (?, ?, ?, ?)',
+        (model_id, values['name'] or '', file, values['trained_words'])
+      )
+
+  def _delete(self, connection, model_id: int):
+    connection.execute('DELETE FROM models WHERE id = ?', (model_id,))
+    if self._has_fts:
+      connection.execute('DELETE FROM models_fts WHERE rowid = ?', (model_id,))
+
+  def search(
+    self,
+    model_type: str,
+    query: Optional[str] = None,
+    filters: Optional[dict] = None,
+    sort: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+  ) -> tuple[list[dict], int]:
+    """Returns a page of the matching models, and the total number that match.
+
+    Filters are exact matches of `base_model`, `model_type` or `sha256`. The sort is a key of
+    `_SORTS`, descending if prefixed with a "-"; by default the best text matches, or the file.
+    """
+    source = 'models m'
+    where = ['m.type = ?']
+    params: list = [model_type]
+    order = 'm.file COLLATE NOCASE'
+    if query and query.strip():
+      if self._has_fts:
+        # Match first, with a CROSS JOIN so SQLite doesn't instead run the match for every model.
+        source = (
+          '(SELECT rowid, rank FROM models_fts WHERE models_fts MATCH ?) f '
+          'CROSS JOIN models m ON m.id = f.rowid'
+        )
+        params.insert(0, _get_fts_query(query))
+        order = 'f.rank'
+      else:
+        for word in query.split():
+          where.append(
+            "(m.name LIKE ? ESCAPE '\\' OR m.file LIKE ? ESCAPE '\\'"
+            " OR m.trained_words LIKE ? ESCAPE '\\')"
+          )
+          params.extend([_get_like_pattern(word)] * 3)
+    for key, value in (filters or {}).items():
+      if key == 'sha256' and value:
+        where.append('m.sha256 = ?')
+        params.append(value.lower())
+      elif key in ('base_model', 'model_type') and value:
+        where.append(f'm.{key} = ? COLLATE NOCASE')
+        params.append(value)
+    if sort and sort.lstrip('-') in _SORTS:
+      order = f'm.{_SORTS[sort.lstrip("-")]} {"DESC" if sort.startswith("-") else "ASC"}'
+
+    with self._lock:
+      connection = self._get_connection()
+      sql_where = ' AND '.join(where)
+      total = connection.execute(
+        f'SELECT COUNT(*) FROM {source} WHERE {sql_where}', params
+      ).fetchone()[0]
+      rows = connection.execute(
+        f'''SELECT m.file, m.name, m.model_type, m.base_model, m.sha256, m.trained_words, m.modified
+        FROM {source} WHERE {sql_where} ORDER BY {order}, m.file LIMIT ? OFFSET ?''',
+        [*params, limit, offset]
+      ).fetchall()
+    return [{
+      'file': row[0],
+      'name': row[1],
+      'type': row[2],
+      'baseModel': row[3],
+      'sha256': row[4],
+      'trainedWords': row[5].split('\n') if row[5] else [],
+      'modified': row[6],
+    } for row in rows], total
+
+
+_CATALOG = _ModelCatalog('catalog.sqlite3')
+add_info_file_listener(_CATALOG.mark_changed)
+
+
+def search_model_catalog(model_type: str, sync=False, **kwargs) -> tuple[list[dict], int]:
+  """Syncs the model type's catalog, fully if it's due or forced, and searches it. Blocks on I/O."""
+  _CATALOG.sync(model_type, force=sync)
+  return _CATALOG.search(model_type, **kwargs)
+
+
+def invalidate_model_catalog(model_type: str):
+  """Marks the model type's catalog to check every file on the next search."""
+  _CATALOG.invalidate(model_type)
@@ -0,0 +1,198 @@
+"""An async client of the Civitai api, for looking up models by their hash.
+
+A single shared session pools connections, with the number of requests in flight bounded and their
+starts spaced out to the configured rate. Requests that fail transiently (a timeout, a connection
+error, a 429 or a 5xx) are retried with exponential backoff, honoring a `Retry-After` header.
+
+Lookups by hash made at about the same time, like when refreshing a whole library, are batched
+into Civitai's multi-hash endpoint rather than each being a round trip of its own.
+
+The api's url is from the config (`civitai.api_url`), unless the client is given one.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Optional
+
+import aiohttp
+
+from ..config import get_config_value
+from ..log import log
+
+_DEFAULT_API_URL = 'https://civitai.com/api/v1'
+
+# How long lookups are gathered for before being batched into a single request.
+_BATCH_WINDOW = 0.05
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_civitai_by_hash_url(file_hash: str) -> str:
+  """Returns the api url of the model version for the file hash."""
+  return CIVITAI.get_by_hash_url(file_hash)
+
+
+class _CivitaiClient:
+  """A pooled, rate limited Civitai client, batching lookups by hash."""
+
+  def __init__(self, api_url: Optional[str] = None):
+    self._api_url = api_url
+    self._session: Optional[aiohttp.ClientSession] = None
+    self._semaphore: Optional[asyncio.Semaphore] = None
+    self._rate_lock: Optional[asyncio.Lock] = None
+    self._next_start = 0.0
+    self._pending: dict[str, list[asyncio.Future]] = {}
+    self._flush_handle: Optional[asyncio.TimerHandle] = None
+    # The batches in flight. The loop only keeps weak references to tasks, so we hold them.
+    self._tasks: set[asyncio.Task] = set()
+
+  @property
+  def api_url(self) -> str:
+    """The api's url, without a trailing slash; the client's own, or from the config."""
+    return (self._api_url or get_config_value('civitai.api_url', _DEFAULT_API_URL)).rstrip('/')
+
+  def get_by_hash_url(self, file_hash: str) -> str:
+    """Returns the api url of the model version for the file hash."""
+    return f'{self.api_url}/model-versions/by-hash/{file_hash}'
+
+  def _get_session(self) -> aiohttp.ClientSession:
+    """Returns the shared session, creating it (in the running loop) the first time."""
+    if self._session is None or self._session.closed:
+      max_concurrency = max(1, get_config_value('civitai.max_concurrency', 4))
+      self._session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=max_concurrency),
+        timeout=aiohttp.ClientTimeout(total=get_config_value('civitai.timeout_seconds', 30)),
+      )
+      self._semaphore = asyncio.Semaphore(max_concurrency)
+      self._rate_lock = asyncio.Lock()
+    return self._session
+
+  async def close(self):
+    """Cancels the lookups in flight, or waiting to be batched, and closes the shared session."""
+    if self._flush_handle is not None:
+      self._flush_handle.cancel()
+      self._flush_handle = None
+    pending, self._pending = self._pending, {}
+    for futures in pending.values():
+      for future in futures:
+        future.cancel()
+    tasks = list(self._tasks)
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if self._session is not None and not self._session.closed:
+      await self._session.close()
+    self._session = None
+
+  async def _wait_for_rate(self):
+    """Waits until the next request can start, within the configured requests per second."""
+    requests_per_second = get_config_value('civitai.requests_per_second', 0)
+    if not requests_per_second:
+      return
+    async with self._rate_lock:
+      now = time.monotonic()
+      start = max(now, self._next_start)
+      self._next_start = start + 1 / requests_per_second
+    await asyncio.sleep(start - now)
+
+  async def request(self, method: str, url: str, json_data: Any = None) -> tuple[int, Any]:
+    """Requests the url, retrying transient failures, and returns the status and the json.
+
+    Raises the last error if all retries fail. A response that isn't json is returned as None.
+    """
+    session = self._get_session()
+    retries = max(0, get_config_value('civitai.retries', 3))
+    backoff = get_config_value('civitai.backoff_seconds', 1)
+    for attempt in range(retries + 1):
+      retry_after = None
+      try:
+        async with self._semaphore:
+          await self._wait_for_rate()
+          async with session.request(method, url, json=json_data) as response:
+            if response.status not in _RETRY_STATUSES or attempt == retries:
+              try:
+                return response.status, await response.json(content_type=None)
+              except ValueError:
+                return response.status, None
+            retry_after = response.headers.get('Retry-After')
+      except (aiohttp.ClientError, asyncio.TimeoutError):
+        if attempt == retries:
+          raise
+      delay = backoff * 2**attempt * (1 + random.random() / 2)
+      if retry_after is not None and retry_after.isdigit():
+        delay = max(delay, int(retry_after))
+      await asyncio.sleep(delay)
+    raise AssertionError('Unreachable')
+
+  async def get_model_version_by_hash(self, file_hash: str) -> Optional[dict]:
+    """Returns the model version for the file hash, batched with other lookups.
+
+    Like the by-hash api, an unknown hash returns a dict with an `error`. Returns None if Civitai
+    couldn't be reached, so that isn't cached.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.setdefault(file_hash.upper(), []).append(future)
+    if self._flush_handle is None:
+      self._flush_handle = loop.call_later(_BATCH_WINDOW, self._flush)
+    return await future
+
+  def _flush(self):
+    """Sends the pending lookups, in batches of the configured size."""
+    self._flush_handle = None
+    pending, self._pending = self._pending, {}
+    batch_size = max(1, get_config_value('civitai.batch_size', 100))
+    hashes = list(pending)
+    for i in range(0, len(hashes), batch_size):
+      batch = {h: pending[h] for h in hashes[i:i + batch_size]}
+      task = asyncio.ensure_future(self._lookup_batch(batch))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+
+  async def _lookup_batch(self, batch: dict[str, list[asyncio.Future]]):
+    """Looks up the batch, resolving its futures; or cancelling them, if we're cancelled."""
+    try:
+      if len(batch) == 1:
+        file_hash = next(iter(batch))
+        status, data = await self.request('GET', self.get_by_hash_url(file_hash))
+        # Still failing after the retries isn't an answer, so isn't resolved as one (or cached).
+        if status in _RETRY_STATUSES:
+          raise ValueError(f'Unexpected by-hash response ({status}).')
+        results = {file_hash: data}
+      else:
+        results = await self._get_model_versions_by_hashes(list(batch))
+    except asyncio.CancelledError:
+      for futures in batch.values():
+        for future in futures:
+          future.cancel()
+      raise
+    except Exception as e:  # pylint: disable = broad-exception-caught
+      log(
+        f'Could not reach Civitai: {e}',
+        prefix='Civitai',
+        color='YELLOW',
+        id='civitai_request_error',
+        at_most_secs=30
+      )
+      results = {}
+    for file_hash, futures in batch.items():
+      for future in futures:
+        if not future.done():
+          future.set_result(results.get(file_hash))
+
+  async def _get_model_versions_by_hashes(self, hashes: list[str]) -> dict[str, dict]:
+    """Returns the model versions for the hashes from the multi-hash endpoint."""
+    status, data = await self.request('POST', f'{self.api_url}/model-versions/by-hash', hashes)
+    if status != 200 or not isinstance(data, list):
+      raise ValueError(f'Unexpected by-hash response ({status}).')
+    results = {}
+    for version in data:
+      for file in version.get('files', []) if isinstance(version, dict) else []:
+        file_hash = str((file.get('hashes') or {}).get('SHA256', '')).upper()
+        if file_hash in hashes:
+          results[file_hash] = version
+    # Like the single by-hash api, the hashes not found are an error.
+    return {h: results.get(h, {'error': 'Model not found'}) for h in hashes}
+
+
+CIVITAI = _CivitaiClient()
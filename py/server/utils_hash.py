@@ -0,0 +1,326 @@
+"""Hashing of model files, with a persistent store so each file is only hashed once.
+
+Hashes are stored in the userdata directory keyed by the file's real path, and validated by its
+size, modified time and inode so a changed (or replaced) file is automatically hashed again. The
+store survives restarts, and is shared by everything that needs a model's hash. It's saved shortly
+after hashes are stored rather than on each one, so indexing a library saves it only every so often.
+
+Files are hashed with the fastest strategy for the platform and the file's size; memory mapped,
+read into a large reused buffer or `hashlib.file_digest`. Each tells the OS the file is read
+sequentially. The memory mapped and buffered strategies also drop what's been read from the page
+cache as they go, so hashing a large library doesn't evict the models ComfyUI has cached, while
+`file_digest` can only drop the file once it's done; it's only the default where the OS can't drop
+pages at all. `__benchmark_hash__.py` compares the strategies.
+
+Files are hashed in a small, bounded pool of threads (hashlib releases the GIL while hashing) so
+the server's event loop is never blocked, and concurrent requests for the same file share a single
+in-flight hash. A hash can be limited to a rate of reading, like for the background indexing of a
+library, in which case the reading thread sleeps between its reads to keep within it.
+"""
+
+import asyncio
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from ..log import log
+from ..utils import file_exists, load_json_file
+from ..utils_userdata import clean_path
+
+
+def _get_stat_key(stat: os.stat_result) -> list[int]:
+  """Returns the parts of a file's stat that change when its contents do."""
+  return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+# How long after a hash is stored that the store is saved, so storing many saves it just once.
+_SAVE_DELAY = 2
+
+
+class _HashStore:
+  """A persistent store of file hashes, keyed by real path and validated by the file's stat."""
+
+  def __init__(self, rel_path: str):
+    self._file_path = clean_path(rel_path)
+    self._entries: Optional[dict[str, list]] = None
+    self._lock = threading.Lock()
+    # Held while saving, so saves of successive snapshots can't be written out of order.
+    self._save_lock = threading.Lock()
+    self._dirty = False
+    self._save_timer: Optional[threading.Timer] = None
+
+  def _get_entries(self) -> dict[str, list]:
+    """Returns the entries, loading them from the file the first time."""
+    if self._entries is None:
+      data = load_json_file(self._file_path, default={})
+      entries = data.get('files') if isinstance(data, dict) else None
+      self._entries = entries if isinstance(entries, dict) else {}
+    return self._entries
+
+  def get(self, real_path: str, stat: os.stat_result) -> Optional[str]:
+    """Returns the stored hash of the file, if it's unchanged since it was stored."""
+    with self._lock:
+      entry = self._get_entries().get(real_path)
+    if isinstance(entry, list) and len(entry) == 4 and entry[:3] == _get_stat_key(stat):
+      return entry[3]
+    return None
+
+  def put(self, real_path: str, stat: os.stat_result, file_hash: str):
+    """Stores the hash of the file, and schedules the store to be saved."""
+    with self._lock:
+      self._get_entries()[real_path] = [*_get_stat_key(stat), file_hash]
+      self._dirty = True
+      if self._save_timer is None:
+        self._save_timer = threading.Timer(_SAVE_DELAY, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+  def flush(self):
+    """Saves the store now, if it's changed since it was last saved."""
+    with self._save_lock:
+      with self._lock:
+        if self._save_timer is not None:
+          self._save_timer.cancel()
+          self._save_timer = None
+        if not self._dirty:
+          return
+        self._dirty = False
+        # Entries are replaced rather than changed, so a shallow copy is a consistent snapshot.
+        entries = dict(self._entries or {})
+      try:
+        self._save(entries)
+      except OSError as e:
+        with self._lock:
+          self._dirty = True
+        log(f'Could not save the hash store: {e}', prefix='Hash', color='RED')
+
+  def _save(self, entries: dict[str, list]):
+    """Saves the entries, writing to a temp file first so a crash can't leave it corrupt."""
+    os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
+    tmp_path = f'{self._file_path}.tmp'
+    with open(tmp_path, 'w', encoding='UTF-8') as file:
+      json.dump({'version': 1, 'files': entries}, file, separators=(',', ':'))
+    os.replace(tmp_path, self._file_path)
+
+
+_HASH_STORE = _HashStore('hashes.json')
+atexit.register(_HASH_STORE.flush)
+
+
+# Large reads keep the time in the interpreter low, while hashlib does the work without the GIL.
+_BUFFER_SIZE = 1024 * 1024 * 8
+# Files at least this large are memory mapped and hashed a window at a time; smaller files aren't
+# worth the mapping. A 32-bit address space can't map large models at all.
+_MMAP_MIN_SIZE = 1024 * 1024 * 64
+_MMAP_WINDOW = 1024 * 1024 * 64
+_CAN_MMAP = sys.maxsize > 2**32
+_HAS_FILE_DIGEST = hasattr(hashlib, 'file_digest')  # Python 3.11+
+_CAN_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def _advise(fd: int, offset: int, length: int, advice_name: str):
+  """Gives the OS a hint on how the file is read, where it's supported."""
+  advice = getattr(os, advice_name, None)
+  if advice is not None and _CAN_FADVISE:
+    try:
+      os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+      pass
+
+
+class _Throttle:
+  """Limits reading to a rate, by sleeping the reading thread when it's read ahead of it."""
+
+  def __init__(self, bytes_per_second: float):
+    self._bytes_per_second = bytes_per_second
+    self._start = time.perf_counter()
+    self._read = 0
+
+  def wait(self, size: int):
+    """Accounts for `size` bytes just read, sleeping until they're within the rate."""
+    self._read += size
+    ahead = self._read / self._bytes_per_second - (time.perf_counter() - self._start)
+    if ahead > 0:
+      time.sleep(ahead)
+
+
+def _hash_file_buffered(file_path: str, throttle: Optional[_Throttle] = None) -> str:
+  """Hashes the file by reading it into a single, large, reused buffer."""
+  sha256_hash = hashlib.sha256()
+  buf = bytearray(_BUFFER_SIZE)
+  view = memoryview(buf)
+  offset = 0
+  with open(file_path, 'rb', buffering=0) as file:
+    fd = file.fileno()
+    _advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+    while size := file.readinto(buf):
+      sha256_hash.update(view[:size])
+      _advise(fd, offset, size, 'POSIX_FADV_DONTNEED')
+      offset += size
+      if throttle is not None:
+        throttle.wait(size)
+  return sha256_hash.hexdigest()
+
+
+def _hash_file_digest(file_path: str, throttle: Optional[_Throttle] = None) -> str:
+  """Hashes the file with `hashlib.file_digest`, falling back to buffered before Python 3.11.
+
+  This reads the whole file before we get control back, so its pages are dropped only at the end,
+  and it can't be throttled; a throttled hash is buffered instead.
+  """
+  if not _HAS_FILE_DIGEST or throttle is not None:
+    return _hash_file_buffered(file_path, throttle)
+  with open(file_path, 'rb') as file:
+    fd = file.fileno()
+    _advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+    file_hash = hashlib.file_digest(file, 'sha256').hexdigest()
+    _advise(fd, 0, 0, 'POSIX_FADV_DONTNEED')
+  return file_hash
+
+
+def _hash_file_mmap(file_path: str, throttle: Optional[_Throttle] = None) -> str:
+  """Hashes the file by memory mapping it, a window at a time, falling back to buffered."""
+  sha256_hash = hashlib.sha256()
+  with open(file_path, 'rb') as file:
+    fd = file.fileno()
+    size = os.fstat(fd).st_size
+    if not _CAN_MMAP or size == 0:
+      return _hash_file_buffered(file_path, throttle)
+    try:
+      mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      return _hash_file_buffered(file_path, throttle)
+    _advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+    with mapped:
+      can_madvise = hasattr(mapped, 'madvise')
+      if can_madvise and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+      with memoryview(mapped) as view:
+        for offset in range(0, size, _MMAP_WINDOW):
+          length = min(_MMAP_WINDOW, size - offset)
+          with view[offset:offset + length] as window:
+            sha256_hash.update(window)
+          # Unmap the window's pages, so they can then be dropped from the page cache.
+          if can_madvise and hasattr(mmap, 'MADV_DONTNEED'):
+            mapped.madvise(mmap.MADV_DONTNEED, offset, length)
+          _advise(fd, offset, length, 'POSIX_FADV_DONTNEED')
+          if throttle is not None:
+            throttle.wait(length)
+  return sha256_hash.hexdigest()
+
+
+HASH_STRATEGIES: dict[str, Callable[..., str]] = {
+  'mmap': _hash_file_mmap,
+  'file_digest': _hash_file_digest,
+  'buffered': _hash_file_buffered,
+}
+
+
+def hash_file(
+  file_path: str, strategy: Optional[str] = None, max_bytes_per_second: float = 0
+) -> str:
+  """Reads and hashes the file, with the strategy or the best one for its size if not provided.
+
+  A `max_bytes_per_second` limits the rate the file is read at; 0 is unlimited.
+  """
+  if strategy is None:
+    if _CAN_MMAP and os.path.getsize(file_path) >= _MMAP_MIN_SIZE:
+      strategy = 'mmap'
+    elif _CAN_FADVISE:
+      # Buffered drops pages as it goes, where `file_digest` would hold the whole file until done.
+      strategy = 'buffered'
+    else:
+      strategy = 'file_digest'
+  if max_bytes_per_second > 0:
+    return HASH_STRATEGIES[strategy](file_path, _Throttle(max_bytes_per_second))
+  return HASH_STRATEGIES[strategy](file_path)
+
+
+# Hashing is mostly bound by the disk, so there's little to gain from more than a couple at once.
+_MAX_HASH_WORKERS = 2
+_HASH_EXECUTOR = ThreadPoolExecutor(
+  max_workers=_MAX_HASH_WORKERS, thread_name_prefix='rgthree_hash'
+)
+_IN_FLIGHT: dict[str, Future] = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+def _hash_and_store(real_path: str, stat: os.stat_result, max_bytes_per_second: float = 0) -> str:
+  """Hashes the file and stores the hash, if the file didn't change while we were reading it."""
+  file_hash = hash_file(real_path, max_bytes_per_second=max_bytes_per_second)
+  if _get_stat_key(os.stat(real_path)) == _get_stat_key(stat):
+    _HASH_STORE.put(real_path, stat, file_hash)
+  return file_hash
+
+
+def _get_hash_future(file_path: Optional[str], max_bytes_per_second: float = 0) -> Future:
+  """Returns a future of the file's hash; from the store, an in-flight hash, or a new one."""
+  if not file_path or not file_exists(file_path):
+    return _get_done_future(None)
+  real_path = os.path.realpath(file_path)
+  stat = os.stat(real_path)
+  file_hash = _HASH_STORE.get(real_path, stat)
+  if file_hash is not None:
+    return _get_done_future(file_hash)
+
+  with _IN_FLIGHT_LOCK:
+    future = _IN_FLIGHT.get(real_path)
+    if future is None:
+      future = _HASH_EXECUTOR.submit(_hash_and_store, real_path, stat, max_bytes_per_second)
+      _IN_FLIGHT[real_path] = future
+
+      def on_done(done: Future):
+        with _IN_FLIGHT_LOCK:
+          if _IN_FLIGHT.get(real_path) is done:
+            del _IN_FLIGHT[real_path]
+
+      future.add_done_callback(on_done)
+  return future
+
+
+def _get_done_future(value) -> Future:
+  future = Future()
+  future.set_result(value)
+  return future
+
+
+def get_stored_sha256_hash(file_path: Optional[str]) -> Optional[str]:
+  """Returns the stored hash of the file, if it has one, without hashing it."""
+  if not file_path or not file_exists(file_path):
+    return None
+  real_path = os.path.realpath(file_path)
+  return _HASH_STORE.get(real_path, os.stat(real_path))
+
+
+def flush_sha256_hashes():
+  """Saves the hashes stored since the store was last saved, rather than waiting. Blocks on I/O."""
+  _HASH_STORE.flush()
+
+
+def get_sha256_hash(file_path: Optional[str]) -> Optional[str]:
+  """Returns the sha256 hash of the file, waiting for it to be hashed if it's not in the store.
+
+  This blocks, so shouldn't be called from the event loop; use `get_sha256_hash_async` there.
+  """
+  return _get_hash_future(file_path).result()
+
+
+async def get_sha256_hash_async(
+  file_path: Optional[str], max_bytes_per_second: float = 0
+) -> Optional[str]:
+  """Returns the sha256 hash of the file, awaiting it being hashed if it's not in the store.
+
+  Checking the file and the store (which loads it the first time) is done in a thread too, so
+  nothing blocks the event loop. The in-flight hash is shielded, so a cancelled caller doesn't
+  cancel it for others sharing it. A new hash reads the file at most `max_bytes_per_second` (0 is
+  unlimited); one already in flight is shared as it is.
+  """
+  future = await asyncio.to_thread(_get_hash_future, file_path, max_bytes_per_second)
+  return await asyncio.shield(asyncio.wrap_future(future))
@@ -0,0 +1,169 @@
+"""A background job that indexes a model type's library, so info is ready before it's asked for.
+
+For each model it computes a missing hash, reads the file's metadata and writes the info file next
+to it, just as the first "Show Info" would otherwise do interactively. The job runs on the server's
+event loop (the hashing itself in the hash pool), reporting its progress to the UI as it goes. So
+it doesn't compete with ComfyUI for the disk, its hashing reads at a limited rate, and it pauses
+between each model.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional
+
+from server import PromptServer
+import folder_paths
+
+from ..config import get_config_value
+from ..log import log
+from .utils_catalog import invalidate_model_catalog
+from .utils_hash import flush_sha256_hashes, get_sha256_hash_async, get_stored_sha256_hash
+from .utils_info import get_folder_path, get_model_info
+
+# The most often a progress event is sent to the UI, in seconds.
+_PROGRESS_INTERVAL = 0.5
+
+
+def _get_unhashed_size(file_path: Optional[str]) -> Optional[int]:
+  """Returns the size of the file if it will need hashing, or None if its hash is stored."""
+  if file_path is None or get_stored_sha256_hash(file_path) is not None:
+    return None
+  return os.path.getsize(file_path)
+
+
+class _IndexJob:
+  """An indexing job of a single model type."""
+
+  def __init__(self, model_type: str):
+    self.model_type = model_type
+    self.status = 'idle'
+    self.total = 0
+    self.done = 0
+    self.hashed = 0
+    self.errors = 0
+    self.current: Optional[str] = None
+    self.started: Optional[float] = None
+    self.finished: Optional[float] = None
+    self._task: Optional[asyncio.Task] = None
+    self._cancelled = False
+    self._last_progress = 0.0
+
+  @property
+  def is_running(self) -> bool:
+    return self._task is not None and not self._task.done()
+
+  def get_state(self) -> dict:
+    """Returns the state of the job, as sent to the UI and returned from the api."""
+    return {
+      'type': self.model_type,
+      'status': self.status,
+      'total': self.total,
+      'done': self.done,
+      'hashed': self.hashed,
+      'errors': self.errors,
+      'current': self.current,
+      'started': self.started * 1000 if self.started else None,  # millis
+      'finished': self.finished * 1000 if self.finished else None,  # millis
+    }
+
+  def start(self):
+    """Starts the job, if it's not already running."""
+    if self.is_running:
+      return
+    self.status = 'running'
+    self.total = self.done = self.hashed = self.errors = 0
+    self.current = None
+    self.started = time.time()
+    self.finished = None
+    self._cancelled = False
+    self._task = asyncio.create_task(self._run())
+
+  def cancel(self):
+    """Cancels the job, which stops once the model being indexed is done."""
+    if self.is_running:
+      self._cancelled = True
+      self.status = 'cancelling'
+
+  async def _run(self):
+    try:
+      files = folder_paths.get_filename_list(self.model_type)
+      self.total = len(files)
+      await self._send_progress(force=True)
+      for file in files:
+        if self._cancelled:
+          break
+        self.current = file
+        await self._index_file(file)
+        self.done += 1
+        await self._send_progress()
+      self.status = 'cancelled' if self._cancelled else 'finished'
+    except Exception as e:  # pylint: disable = broad-exception-caught
+      self.status = 'error'
+      log(f'Indexing {self.model_type} failed: {e}', prefix='Model Index', color='RED')
+    # Save the hashes now, rather than leaving the last of them to the store's timer.
+    await asyncio.to_thread(flush_sha256_hashes)
+    # Indexing reads the whole library, so the catalog should check for models added or removed.
+    invalidate_model_catalog(self.model_type)
+    self.current = None
+    self.finished = time.time()
+    await self._send_progress(force=True)
+
+  async def _index_file(self, file: str):
+    """Indexes a single model, pausing after for the configured time."""
+    start = time.perf_counter()
+    try:
+      file_path = await asyncio.to_thread(get_folder_path, file, self.model_type)
+      if await asyncio.to_thread(_get_unhashed_size, file_path) is not None:
+        # Hash it first, throttled, so getting the info then finds the hash stored.
+        max_mb_per_second = get_config_value('model_index.max_mb_per_second', 0)
+        await get_sha256_hash_async(file_path, max_mb_per_second * 1024 * 1024)
+        self.hashed += 1
+      await get_model_info(file, self.model_type, maybe_fetch_metadata=True, notify=False)
+    except Exception as e:  # pylint: disable = broad-exception-caught
+      self.errors += 1
+      log(
+        f'Could not index {file}: {e}',
+        prefix='Model Index',
+        color='YELLOW',
+        id=f'index_error_{self.model_type}',
+        at_most_secs=30
+      )
+
+    pause = get_config_value('model_index.pause_ms', 0) / 1000
+    # Sleep for whatever's left of the pause; at least yielding to the event loop.
+    await asyncio.sleep(max(0, pause - (time.perf_counter() - start)))
+
+  async def _send_progress(self, force=False):
+    now = time.perf_counter()
+    if force or now - self._last_progress >= _PROGRESS_INTERVAL:
+      self._last_progress = now
+      await PromptServer.instance.send(f'rgthree-index-{self.model_type}', self.get_state())
+
+
+_JOBS: dict[str, _IndexJob] = {}
+
+
+def _get_job(model_type: str) -> _IndexJob:
+  if model_type not in _JOBS:
+    _JOBS[model_type] = _IndexJob(model_type)
+  return _JOBS[model_type]
+
+
+def start_model_index(model_type: str) -> dict:
+  """Starts indexing the model type, if not already, returning the job's state."""
+  job = _get_job(model_type)
+  job.start()
+  return job.get_state()
+
+
+def cancel_model_index(model_type: str) -> dict:
+  """Cancels indexing the model type, returning the job's state."""
+  job = _get_job(model_type)
+  job.cancel()
+  return job.get_state()
+
+
+def get_model_index_state(model_type: str) -> dict:
+  """Returns the state of the model type's indexing job."""
+  return _get_job(model_type).get_state()
@@ -1,4 +1,4 @@
-import hashlib
+import asyncio
 import json
 import os
 import re
@@ -9,8 +9,11 @@ import requests
 from server import PromptServer
 import folder_paths
 
-from ..utils import abspath, get_dict_value, load_json_file, file_exists, remove_path, save_json_file
+from ..utils import abspath, get_dict_value, file_exists, remove_path
 from ..utils_userdata import read_userdata_json, save_userdata_json, delete_userdata_file
+from .utils_civitai import CIVITAI, get_civitai_by_hash_url
+from .utils_hash import get_sha256_hash_async
+from .utils_info_cache import discard_info_file, read_info_file, save_info_file
 
 
 def _get_info_cache_file(data_type: str, file_hash: str):
@@ -25,9 +28,11 @@ async def delete_model_info(
   if file_path is None:
     return
   if del_info:
-    remove_path(get_info_file(file_path))
+    info_path = get_info_file(file_path, force=True)
+    remove_path(info_path)
+    discard_info_file(info_path)
   if del_civitai or del_metadata:
-    file_hash = _get_sha256_hash(file_path)
+    file_hash = await get_sha256_hash_async(file_path)
     if del_civitai:
       json_file_path = _get_info_cache_file(file_hash, 'civitai')
       delete_userdata_file(json_file_path)
@@ -64,11 +69,14 @@ def get_img_file(file_path: str, force=False):
 
 
 def get_model_info_file_data(file: str, model_type, default=None):
-  """Returns the data from the info file, or a default value if it doesn't exist."""
+  """Returns the data from the info file, or a default value if it doesn't exist.
+
+  The data is shared from the info cache, so must not be modified; use `get_model_info` for that.
+  """
   file_path = get_folder_path(file, model_type)
   if file_path is None:
     return default
-  return load_json_file(get_info_file(file_path), default=default)
+  return read_info_file(get_info_file(file_path), default=default)
 
 
 async def get_model_info(
@@ -79,19 +87,20 @@ async def get_model_info(
   force_fetch_civitai=False,
   maybe_fetch_metadata=False,
   force_fetch_metadata=False,
-  light=False
+  light=False,
+  notify=True
 ):
-  """Compiles a model info given a stored file next to the model, and/or metadata/civitai."""
+  """Compiles a model info given a stored file next to the model, and/or metadata/civitai.
 
-  file_path = get_folder_path(file, model_type)
+  If `notify` is falsy, the UI isn't sent the refreshed info when it's saved, like when indexing.
+  File I/O is done in an executor, so many models can be compiled concurrently.
+  """
+
+  file_path, basic_data, info_data = await asyncio.to_thread(_read_model_files, file, model_type)
   if file_path is None:
     return default
 
   should_save = False
-  # basic data
-  basic_data = get_file_info(file, model_type)
-  # Try to load a rgthree-info.json file next to the file.
-  info_data = get_model_info_file_data(file, model_type, default={})
 
   for key in ['file', 'path', 'modified', 'imageLocal', 'hasInfoFile']:
     if key in basic_data and basic_data[key] and (
@@ -132,17 +141,19 @@ async def get_model_info(
   )
 
   if should_fetch_metadata:
-    data_meta = _get_model_metadata(file, model_type, default={}, refresh=force_fetch_metadata)
+    data_meta = await _get_model_metadata(
+      file, model_type, default={}, refresh=force_fetch_metadata
+    )
     should_save = _merge_metadata(info_data, data_meta) or should_save
 
   if should_fetch_civitai:
-    data_civitai = _get_model_civitai_data(
+    data_civitai = await _get_model_civitai_data(
       file, model_type, default={}, refresh=force_fetch_civitai
     )
     should_save = _merge_civitai_data(info_data, data_civitai) or should_save
 
   if 'sha256' not in info_data:
-    file_hash = _get_sha256_hash(file_path)
+    file_hash = await get_sha256_hash_async(file_path)
     if file_hash is not None:
       info_data['sha256'] = file_hash
       should_save = True
@@ -155,14 +166,46 @@ async def get_model_info(
         key=lambda w: w['count'] if 'count' in w else 99999,
         reverse=True
       )
-    save_model_info(file, info_data, model_type)
+    await asyncio.to_thread(save_model_info, file, info_data, model_type)
 
     # If we're saving, then the UI is likely waiting to see if the refreshed data is coming in.
-    await PromptServer.instance.send(f"rgthree-refreshed-{model_type}-info", {"data": info_data})
+    if notify:
+      await PromptServer.instance.send(f"rgthree-refreshed-{model_type}-info", {"data": info_data})
 
   return info_data
 
 
+def _read_model_files(file: str, model_type) -> tuple[str | None, dict | None, dict]:
+  """Returns the model's path, basic file info and the data of its info file, if it exists."""
+  file_path = get_folder_path(file, model_type)
+  if file_path is None:
+    return None, None, {}
+  # Try to load a rgthree-info.json file next to the file.
+  info_data = _copy_info_data(read_info_file(get_info_file(file_path), default={}))
+  return file_path, get_file_info(file, model_type), info_data
+
+
+def _copy_info_data(info_data: dict) -> dict:
+  """Returns a copy of the (shared, cached) info data that can be modified.
+
+  The contents of `raw` are only ever replaced, never modified, so aren't copied; they're also most
+  of the data, so copying the rest is much quicker than reading the file again.
+  """
+  return {
+    key: {**value} if key == 'raw' and isinstance(value, dict) else _copy_json(value)
+    for key, value in info_data.items()
+  }
+
+
+def _copy_json(value):
+  """Returns a deep copy of json data, quicker than `copy.deepcopy`."""
+  if isinstance(value, dict):
+    return {k: _copy_json(v) for k, v in value.items()}
+  if isinstance(value, list):
+    return [_copy_json(v) for v in value]
+  return value
+
+
 def _update_data(info_data: dict) -> bool:
   """Ports old data to new data if necessary."""
   should_save = False
@@ -324,30 +367,21 @@ def _merge_civitai_data(info_data: dict, data_civitai: dict) -> bool:
   return should_save
 
 
-def _get_model_civitai_data(file: str, model_type, default=None, refresh=False):
+async def _get_model_civitai_data(file: str, model_type, default=None, refresh=False):
   """Gets the civitai data, either cached from the user directory, or from civitai api."""
-  file_hash = _get_sha256_hash(get_folder_path(file, model_type))
+  file_hash = await get_sha256_hash_async(get_folder_path(file, model_type))
   if file_hash is None:
     return None
 
   json_file_path = _get_info_cache_file(file_hash, 'civitai')
 
-  api_url = f'https://civitai.com/api/v1/model-versions/by-hash/{file_hash}'
-  file_data = read_userdata_json(json_file_path)
+  api_url = get_civitai_by_hash_url(file_hash)
+  file_data = await asyncio.to_thread(read_userdata_json, json_file_path)
   if file_data is None or refresh is True:
-    try:
-      response = requests.get(api_url, timeout=5000)
-      data = response.json()
-      save_userdata_json(
-        json_file_path, {
-          'url': api_url,
-          'timestamp': datetime.now().timestamp(),
-          'response': data
-        }
-      )
-      file_data = read_userdata_json(json_file_path)
-    except requests.exceptions.RequestException as e:  # This is the correct syntax
-      print(e)
+    data = await CIVITAI.get_model_version_by_hash(file_hash)
+    if data is not None:
+      file_data = {'url': api_url, 'timestamp': datetime.now().timestamp(), 'response': data}
+      await asyncio.to_thread(save_userdata_json, json_file_path, file_data)
   response = file_data['response'] if file_data is not None and 'response' in file_data else None
   if response is not None:
     response['_sha256'] = file_hash
@@ -355,21 +389,21 @@ def _get_model_civitai_data(file: str, model_type, default=None, refresh=False):
   return response if response is not None else default
 
 
-def _get_model_metadata(file: str, model_type, default=None, refresh=False):
+async def _get_model_metadata(file: str, model_type, default=None, refresh=False):
   """Gets the metadata from the file itself."""
   file_path = get_folder_path(file, model_type)
-  file_hash = _get_sha256_hash(file_path)
+  file_hash = await get_sha256_hash_async(file_path)
   if file_hash is None:
     return default
 
   json_file_path = _get_info_cache_file(file_hash, 'metadata')
 
-  file_data = read_userdata_json(json_file_path)
+  file_data = await asyncio.to_thread(read_userdata_json, json_file_path)
   if file_data is None or refresh is True:
-    data = _read_file_metadata_from_header(file_path)
+    data = await asyncio.to_thread(_read_file_metadata_from_header, file_path)
     if data is not None:
       file_data = {'url': file, 'timestamp': datetime.now().timestamp(), 'response': data}
-      save_userdata_json(json_file_path, file_data)
+      await asyncio.to_thread(save_userdata_json, json_file_path, file_data)
   response = file_data['response'] if file_data is not None and 'response' in file_data else None
   if response is not None:
     response['_sha256'] = file_hash
@@ -421,26 +455,11 @@ def get_folder_path(file: str, model_type) -> str | None:
   return file_path
 
 
-def _get_sha256_hash(file_path: str | None):
-  """Returns the hash for the file."""
-  if not file_path or not file_exists(file_path):
-    return None
-  BUF_SIZE = 1024 * 128  # lets read stuff in 64kb chunks!
-  file_hash = None
-  sha256_hash = hashlib.sha256()
-  with open(file_path, "rb") as f:
-    # Read and update hash string value in blocks of BUF_SIZE
-    for byte_block in iter(lambda: f.read(BUF_SIZE), b""):
-      sha256_hash.update(byte_block)
-    file_hash = sha256_hash.hexdigest()
-  return file_hash
-
-
 async def set_model_info_partial(file: str, model_type: str, info_data_partial):
   """Sets partial data into the existing model info data."""
   info_data = await get_model_info(file, model_type, default={})
   info_data = {**info_data, **info_data_partial}
-  save_model_info(file, info_data, model_type)
+  await asyncio.to_thread(save_model_info, file, info_data, model_type)
 
 
 def save_model_info(file: str, info_data, model_type):
@@ -449,4 +468,4 @@ def save_model_info(file: str, info_data, model_type):
   if file_path is None:
     return
   info_path = get_info_file(file_path, force=True)
-  save_json_file(info_path, info_data)
+  save_info_file(info_path, _copy_info_data(info_data))
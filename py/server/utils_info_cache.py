@@ -0,0 +1,122 @@
+"""A process-wide cache of parsed model info files, so reading them is free unless they change.
+
+Each entry is validated by the info file's modified time and size on every read, so a file changed
+outside of rgthree (or by another process) is read again. Saving through `save_info_file` writes
+through to the cache, so readers never see stale data. The least recently used entries are evicted
+once the info files cached exceed the configured size.
+
+The cached data is shared by all readers and must not be modified; copy it first.
+
+Listeners can be added to be told of info files saved or discarded, like to invalidate data derived
+from them, rather than polling the files for changes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from ..config import get_config_value
+from ..utils import load_json_file, save_json_file
+
+
+def _get_stat_key(path: str) -> Optional[tuple[int, int]]:
+  """Returns the modified time and size of the file, or None if it doesn't exist."""
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  return (stat.st_mtime_ns, stat.st_size)
+
+
+class _InfoCache:
+  """An LRU cache of parsed json files, validated by their stat and capped by their size."""
+
+  def __init__(self):
+    self._entries: OrderedDict[str, tuple[tuple[int, int], dict]] = OrderedDict()
+    self._size = 0
+    self._lock = threading.Lock()
+
+  def read(self, path: Optional[str]) -> Optional[dict]:
+    """Returns the parsed file, from the cache if unchanged, or None if it doesn't exist."""
+    if not path:
+      return None
+    stat_key = _get_stat_key(path)
+    if stat_key is None:
+      self.discard(path)
+      return None
+    with self._lock:
+      entry = self._entries.get(path)
+      if entry is not None and entry[0] == stat_key:
+        self._entries.move_to_end(path)
+        return entry[1]
+    data = load_json_file(path)
+    if isinstance(data, dict):
+      self._put(path, stat_key, data)
+    return data
+
+  def write(self, path: str, data: dict):
+    """Saves the data to the file, and to the cache."""
+    save_json_file(path, data)
+    stat_key = _get_stat_key(path)
+    if stat_key is not None:
+      self._put(path, stat_key, data)
+
+  def discard(self, path: str):
+    """Removes the file from the cache."""
+    with self._lock:
+      entry = self._entries.pop(path, None)
+      if entry is not None:
+        self._size -= entry[0][1]
+
+  def _put(self, path: str, stat_key: tuple[int, int], data: dict):
+    max_size = get_config_value('model_info.cache_mb', 64) * 1024 * 1024
+    with self._lock:
+      entry = self._entries.pop(path, None)
+      if entry is not None:
+        self._size -= entry[0][1]
+      if stat_key[1] > max_size:
+        return
+      self._entries[path] = (stat_key, data)
+      self._size += stat_key[1]
+      while self._size > max_size:
+        _, (evicted_key, _) = self._entries.popitem(last=False)
+        self._size -= evicted_key[1]
+
+
+_INFO_CACHE = _InfoCache()
+_LISTENERS: list[Callable[[str], None]] = []
+
+
+def add_info_file_listener(listener: Callable[[str], None]):
+  """Adds a listener, called with the path of each info file saved or discarded.
+
+  It's called on the thread that saved the file, which can be the event loop, so must be quick.
+  """
+  _LISTENERS.append(listener)
+
+
+def _notify_listeners(path: str):
+  for listener in _LISTENERS:
+    listener(path)
+
+
+def read_info_file(path: Optional[str], default=None):
+  """Returns the info file's data, shared from the cache, or the default if it doesn't exist."""
+  data = _INFO_CACHE.read(path)
+  return default if data is None else data
+
+
+def save_info_file(path: str, data: dict):
+  """Saves the info file's data, writing through to the cache.
+
+  The cache keeps the data itself, so it must not be modified after saving; pass a copy if it will.
+  """
+  _INFO_CACHE.write(path, data)
+  _notify_listeners(path)
+
+
+def discard_info_file(path: str):
+  """Removes the info file from the cache, like when it's deleted."""
+  _INFO_CACHE.discard(path)
+  _notify_listeners(path)
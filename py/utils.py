@@ -2,7 +2,7 @@ import json
 import os
 import re
 
-from typing import Union
+from typing import Iterable, Union
 
 
 class AnyType(str):
@@ -27,7 +27,9 @@ class FlexibleOptionalInputType(dict):
   real type, or use the AnyType for additional flexibility.
   """
 
-  def __init__(self, type, data: Union[dict, None] = None):
+  def __init__(
+    self, type, data: Union[dict, None] = None, lazy: Union[Iterable[str], None] = None
+  ):
     """Initializes the FlexibleOptionalInputType.
 
     Args:
@@ -36,9 +38,12 @@ class FlexibleOptionalInputType(dict):
         can look it up without hitting our overrides, as well as iterated over and adding its key
         and values to our `self` keys. This way, when looked at, we will appear to represent this
         data. When used in an "optional" INPUT_TYPES, these are the starting optional node types.
+      lazy: An optional collection of unknown keys that should be marked as lazy inputs, so ComfyUI
+        will only evaluate them when requested from the node's `check_lazy_status`.
     """
     self.type = type
     self.data = data
+    self.lazy = frozenset(lazy) if lazy is not None else frozenset()
     if self.data is not None:
       for k, v in self.data.items():
         self[k] = v
@@ -49,6 +54,8 @@ class FlexibleOptionalInputType(dict):
     if self.data is not None and key in self.data:
       val = self.data[key]
       return val
+    if key in self.lazy:
+      return (self.type, {"lazy": True})
     return (self.type,)
 
   def __contains__(self, key):
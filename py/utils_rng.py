@@ -0,0 +1,77 @@
+"""Isolated, reproducible random number streams.
+
+Rather than saving, reseeding and restoring the global `random` state (which other extensions can
+also be using, or seeding) each stream is a dedicated `random.Random`, or NumPy generator, keyed by
+a name like a node's id. Every stream is derived from a root seed so, given the same root seed
+(set in the config as `rng.root_seed`), the same streams produce the same values. Without one, the
+root seed is from the OS and so differs every start.
+"""
+
+import hashlib
+import random
+import threading
+from typing import Any, Optional
+
+import numpy as np
+
+from .config import get_config_value
+
+
+class RngService:
+  """Dedicated random number streams, keyed and derived from a root seed."""
+
+  def __init__(self, root_seed: Optional[int] = None):
+    self._lock = threading.RLock()
+    self._randoms: dict[Any, random.Random] = {}
+    self._numpys: dict[Any, np.random.Generator] = {}
+    self.root_seed = 0
+    self.reseed(root_seed)
+
+  def reseed(self, root_seed: Optional[int] = None):
+    """Sets the root seed, from the OS if not provided, starting all streams over."""
+    with self._lock:
+      self.root_seed = random.SystemRandom().getrandbits(128) if root_seed is None else root_seed
+      self._randoms.clear()
+      self._numpys.clear()
+
+  def derive_seed(self, *keys: Any) -> int:
+    """Returns a seed deterministically derived from the root seed and the keys."""
+    data = repr((self.root_seed, keys)).encode()
+    return int.from_bytes(hashlib.sha256(data).digest()[:16], 'big')
+
+  def get_random(self, key: Any) -> random.Random:
+    """Returns the `random.Random` stream for the key."""
+    stream = self._randoms.get(key)
+    if stream is None:
+      with self._lock:
+        stream = self._randoms.setdefault(key, random.Random(self.derive_seed('random', key)))
+    return stream
+
+  def get_numpy(self, key: Any) -> np.random.Generator:
+    """Returns the NumPy generator stream for the key."""
+    stream = self._numpys.get(key)
+    if stream is None:
+      with self._lock:
+        stream = self._numpys.setdefault(key, np.random.default_rng(self.derive_seed('numpy', key)))
+    return stream
+
+  def spawn(self, key: Any) -> random.Random:
+    """Returns a new `random.Random`, seeded from the key's stream, for a single use.
+
+    Like an execution that may call `seed()` on it, without affecting the stream.
+    """
+    with self._lock:
+      return random.Random(self.get_random(key).getrandbits(64))
+
+  def new_seed(self, key: Any, low: int, high: int) -> int:
+    """Returns a new seed from the key's stream, between low and high (inclusive)."""
+    with self._lock:
+      return self.get_random(key).randint(low, high)
+
+  def new_seeds(self, key: Any, count: int, low: int, high: int) -> list[int]:
+    """Returns `count` new seeds from the key's NumPy stream, between low and high (inclusive)."""
+    with self._lock:
+      return self.get_numpy(key).integers(low, high, size=count, endpoint=True).tolist()
+
+
+rng = RngService(get_config_value('rng.root_seed', None))
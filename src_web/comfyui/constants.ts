@@ -33,6 +33,7 @@ export const NodeTypesString = {
   POWER_PROMPT: addRgthree("Power Prompt"),
   POWER_PROMPT_SIMPLE: addRgthree("Power Prompt - Simple"),
   POWER_PUTER: addRgthree("Power Puter"),
+  POWER_PUTER_MAP: addRgthree("Power Puter Map"),
   POWER_CONDUCTOR: addRgthree("Power Conductor"),
   SDXL_EMPTY_LATENT_IMAGE: addRgthree("SDXL Empty Latent Image"),
   SDXL_POWER_PROMPT_POSITIVE: addRgthree("SDXL Power Prompt - Positive"),
@@ -29,16 +29,15 @@ const ALPHABET = "abcdefghijklmnopqrstuv".split("");
 
 const OUTPUT_TYPES = ["STRING", "INT", "FLOAT", "BOOLEAN", "*"];
 
-class RgthreePowerPuter extends RgthreeBaseServerNode {
-  static override title = NodeTypesString.POWER_PUTER;
-  static override type = NodeTypesString.POWER_PUTER;
-  static comfyClass = NodeTypesString.POWER_PUTER;
-
+/**
+ * The base of the Power Puter nodes, which share everything but whether they map over rows.
+ */
+class BasePowerPuter extends RgthreeBaseServerNode {
   private outputTypeWidget!: OutputsWidget;
   private expressionWidget!: IWidget;
   private stabilizeBound = this.stabilize.bind(this);
 
-  constructor(title = NODE_CLASS.title) {
+  constructor(title: string) {
     super(title);
     // Note, configure will add as many as was in the stored workflow automatically.
     this.addAnyInput(2);
@@ -55,10 +54,6 @@ class RgthreePowerPuter extends RgthreeBaseServerNode {
   //   this.outputTypeWidget
   // }
 
-  static override setUp(comfyClass: typeof LGraphNode, nodeData: ComfyNodeDef) {
-    RgthreeBaseServerNode.registerForOverride(comfyClass, nodeData, NODE_CLASS);
-  }
-
   override onConnectionsChange(...args: any[]): void {
     super.onConnectionsChange?.apply(this, [...arguments] as any);
     this.scheduleStabilize();
@@ -150,8 +145,41 @@ class RgthreePowerPuter extends RgthreeBaseServerNode {
   }
 }
 
-/** An uniformed name reference to the node class. */
-const NODE_CLASS = RgthreePowerPuter;
+/**
+ * The Power Puter node.
+ */
+class RgthreePowerPuter extends BasePowerPuter {
+  static override title = NodeTypesString.POWER_PUTER;
+  static override type = NodeTypesString.POWER_PUTER;
+  static comfyClass = NodeTypesString.POWER_PUTER;
+
+  constructor(title = RgthreePowerPuter.title) {
+    super(title);
+  }
+
+  static override setUp(comfyClass: typeof LGraphNode, nodeData: ComfyNodeDef) {
+    RgthreeBaseServerNode.registerForOverride(comfyClass, nodeData, RgthreePowerPuter);
+  }
+}
+
+/**
+ * The Power Puter Map node, which evaluates the code for each row and outputs lists.
+ */
+class RgthreePowerPuterMap extends BasePowerPuter {
+  static override title = NodeTypesString.POWER_PUTER_MAP;
+  static override type = NodeTypesString.POWER_PUTER_MAP;
+  static comfyClass = NodeTypesString.POWER_PUTER_MAP;
+
+  constructor(title = RgthreePowerPuterMap.title) {
+    super(title);
+  }
+
+  static override setUp(comfyClass: typeof LGraphNode, nodeData: ComfyNodeDef) {
+    RgthreeBaseServerNode.registerForOverride(comfyClass, nodeData, RgthreePowerPuterMap);
+  }
+}
+
+const NODE_CLASSES = [RgthreePowerPuter, RgthreePowerPuterMap];
 
 type OutputsWidgetValue = {
   outputs: string[];
@@ -174,7 +202,7 @@ class OutputsWidget extends RgthreeBaseWidget<OutputsWidgetValue> {
 
   private rows = 1;
   private neededHeight = LiteGraph.NODE_WIDGET_HEIGHT + 8;
-  private node!: RgthreePowerPuter;
+  private node!: BasePowerPuter;
 
   protected override hitAreas: RgthreeBaseHitAreas<
     | "add"
@@ -202,7 +230,7 @@ class OutputsWidget extends RgthreeBaseWidget<OutputsWidgetValue> {
     output9: {bounds: [0, 0] as Vector2, onClick: this.onOutputChipDown, data: {index: 9}},
   };
 
-  constructor(name: string, node: RgthreePowerPuter) {
+  constructor(name: string, node: BasePowerPuter) {
     super(name);
     this.node = node;
   }
@@ -455,8 +483,11 @@ class OutputsWidget extends RgthreeBaseWidget<OutputsWidgetValue> {
 app.registerExtension({
   name: "rgthree.PowerPuter",
   async beforeRegisterNodeDef(nodeType: typeof LGraphNode, nodeData: ComfyNodeDef) {
-    if (nodeData.name === NODE_CLASS.type) {
-      NODE_CLASS.setUp(nodeType, nodeData);
+    for (const nodeClass of NODE_CLASSES) {
+      if (nodeData.name === nodeClass.type) {
+        nodeClass.setUp(nodeType, nodeData);
+        break;
+      }
     }
   },
 });
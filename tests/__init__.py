@@ -0,0 +1,4 @@
+"""Tests of the parts of rgthree-comfy that don't need a running ComfyUI.
+
+Run from the root of the repo with: python -m unittest discover -s tests -t .
+"""
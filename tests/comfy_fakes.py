@@ -0,0 +1,81 @@
+"""Stand-ins of the ComfyUI modules that rgthree's server code imports, to test it without ComfyUI.
+
+Import this before anything from `py.server`. The stand-ins are only installed where ComfyUI's own
+modules can't be imported; either way, tests point the model folders at a directory of their own
+with `patch_models_dir`.
+"""
+
+import contextlib
+import importlib.util
+import os
+import sys
+import types
+from unittest import mock
+
+
+class _Routes:
+  """Collects the routes added with decorators, like aiohttp's `RouteTableDef`."""
+
+  def __init__(self):
+    self.routes = []
+
+  def __getattr__(self, method: str):
+
+    def route(path: str):
+
+      def decorator(handler):
+        self.routes.append((method, path, handler))
+        return handler
+
+      return decorator
+
+    return route
+
+
+class _PromptServer:
+  """A stand-in of ComfyUI's `server.PromptServer`, recording the events sent to the UI."""
+
+  instance: '_PromptServer'
+
+  def __init__(self):
+    self.routes = _Routes()
+    self.sent: list[tuple[str, object]] = []
+
+  async def send(self, event: str, data, sid=None):
+    self.sent.append((event, data))
+
+  def send_sync(self, event: str, data, sid=None):
+    self.sent.append((event, data))
+
+
+if importlib.util.find_spec('folder_paths') is None:
+  folder_paths = types.ModuleType('folder_paths')
+  folder_paths.get_full_path = lambda folder_name, filename: None
+  folder_paths.get_filename_list = lambda folder_name: []
+  sys.modules['folder_paths'] = folder_paths
+
+if importlib.util.find_spec('server') is None:
+  server = types.ModuleType('server')
+  server.PromptServer = _PromptServer
+  _PromptServer.instance = _PromptServer()
+  sys.modules['server'] = server
+
+
+@contextlib.contextmanager
+def patch_models_dir(models_dir: str):
+  """Patches the model folders to be the subdirectories of the directory, like `loras`."""
+
+  def get_full_path(folder_name: str, filename: str):
+    path = os.path.join(models_dir, folder_name, filename)
+    return path if os.path.isfile(path) else None
+
+  def get_filename_list(folder_name: str):
+    folder = os.path.join(models_dir, folder_name)
+    if not os.path.isdir(folder):
+      return []
+    return sorted(f for f in os.listdir(folder) if f.endswith('.safetensors'))
+
+  folder_paths = importlib.import_module('folder_paths')
+  with mock.patch.object(folder_paths, 'get_full_path', get_full_path), \
+      mock.patch.object(folder_paths, 'get_filename_list', get_filename_list):
+    yield
@@ -0,0 +1,605 @@
+"""Tests of the Power Puter's execution, and its analysis ahead of and around it."""
+
+import ast
+import importlib.util
+import re
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from typing import Optional
+from unittest import mock
+
+import numpy as np
+
+from py import config
+from py import power_puter
+
+
+class LazyInputAnalyzerTest(unittest.TestCase):
+  """Tests of deciding which inputs the code reads, ahead of execution."""
+
+  def analyze(self, code: str, **available):
+    return power_puter._LazyInputAnalyzer(ast.parse(code), available).analyze()
+
+  def test_follows_only_the_decided_branch(self):
+    self.assertEqual(self.analyze('if a > 3:\n  b\nc', a=1), ['a', 'c'])
+    self.assertEqual(self.analyze('if a > 3:\n  b\nc', a=5), ['a', 'b', 'c'])
+
+  def test_tests_are_budgeted(self):
+    # Without a budget, these would allocate a terabyte string, or compute a billion digit int.
+    cases = [("if len('x' * a) > 3:\n  b\nc", 10**12), ('if 10 ** a > 0:\n  b\nc', 10**9)]
+    for code, value in cases:
+      start = time.perf_counter()
+      self.assertEqual(self.analyze(code, a=value), ['a', 'b', 'c'])
+      self.assertLess(time.perf_counter() - start, 1)
+
+
+def execute(code: str, **ctx):
+  """Executes the code in-process, with the variables of the ctx."""
+  return power_puter._Puter(
+    code=code, ctx=ctx, workflow={}, prompt={}, dynprompt=None, unique_id='1'
+  ).execute()
+
+
+def with_budgets(budgets: dict, caps: Optional[dict] = None):
+  """Patches the config's Power Puter budgets, and caps."""
+  node_config = {'budgets': budgets, 'budget_caps': caps or {}}
+  return mock.patch.dict(config.RGTHREE_CONFIG, {'nodes': {'power_puter': node_config}})
+
+
+class ExecutionBudgetTest(unittest.TestCase):
+  """Tests of limiting the work an execution can do."""
+
+  LOOP = 'x = 0\nwhile True:\n  x += 1\n'
+
+  def test_exceeded_budget_names_the_line(self):
+    with self.assertRaisesRegex(power_puter.BudgetExceeded, r'max_loop_iterations.* line 4\b'):
+      execute(f'# puter: max_loop_iterations=100\n{self.LOOP}')
+    with self.assertRaisesRegex(power_puter.BudgetExceeded, r'max_statements.* line 4\b'):
+      execute('# puter: max_statements=50\nx = []\nfor i in range(100):\n  x.append(i)')
+
+  def test_default_config_is_unlimited(self):
+    with mock.patch.dict(config.RGTHREE_CONFIG, config.get_rgthree_default_config()):
+      self.assertEqual(execute('len(list(range(10_000_001)))'), 10_000_001)
+      self.assertEqual(execute("len('x' * 10_000_001)"), 10_000_001)
+      self.assertEqual(execute('x = 0\nfor i in range(100_000):\n  x += 1\nx'), 100_000)
+
+  def test_node_settings_override_the_config_up_to_the_cap(self):
+    code = 'x = 0\nfor i in range(100):\n  x += 1\nx'
+    with with_budgets({'max_loop_iterations': 10}):
+      with self.assertRaises(power_puter.BudgetExceeded):
+        execute(code)
+      self.assertEqual(execute(f'# puter: max_loop_iterations=1000\n{code}'), 100)
+      self.assertEqual(execute(f'# puter: max_loop_iterations=0\n{code}'), 100)
+    with with_budgets({}, {'max_loop_iterations': 50}):
+      with self.assertRaisesRegex(power_puter.BudgetExceeded, 'budget of 50'):
+        execute(f'# puter: max_loop_iterations=1000\n{code}')
+      with self.assertRaisesRegex(power_puter.BudgetExceeded, 'budget of 50'):
+        execute(code)
+
+  def test_container_size_is_checked_before_creating(self):
+    with self.assertRaisesRegex(power_puter.BudgetExceeded, 'max_container_size'):
+      execute("# puter: max_container_size=1000\n'x' * 10 ** 12")
+
+
+class OptimizerTest(unittest.TestCase):
+  """Tests of folding constants, and dropping dead branches, before the code is compiled."""
+
+  def optimize(self, code: str) -> str:
+    return ast.unparse(power_puter._Optimizer().optimize(ast.parse(code)))
+
+  def has_call(self, code: str) -> bool:
+    module = power_puter._Optimizer().optimize(ast.parse(code))
+    return any(isinstance(node, ast.Call) for node in ast.walk(module))
+
+  def test_folds_constants(self):
+    cases = [
+      ('1 + 2 * 3', '7'),
+      ('1 < 2 < 0', '1'),
+      ('not 1', '0'),
+      ('a and 1 and b', 'a and b'),
+      ('0 and a', '0'),
+      ("f'x{1+1}y{a}z{2}'", "f'x2y{a}z2'"),
+      # Large values, and errors, are left to be evaluated (and budgeted) at execution.
+      ("'a' * 10000", "'a' * 10000"),
+      ('1 / 0', '1 / 0'),
+    ]
+    for code, expected in cases:
+      with self.subTest(code=code):
+        self.assertEqual(self.optimize(code), expected)
+    with self.assertRaises(ZeroDivisionError):
+      execute('1 / 0')
+
+  def test_drops_dead_branches(self):
+    self.assertEqual(self.optimize('if 1:\n  x = 2\nelse:\n  x = 3\nx'), 'x = 2\nx')
+    self.assertEqual(self.optimize("'yes' if 0 else a"), 'a')
+    # The dead branch isn't run, so its error isn't raised.
+    self.assertEqual(execute('if 0:\n  round(1, 2, 3)\n  1 / 0\n5'), 5)
+    # So its inputs are never requested.
+    module = power_puter._CODE_CACHE.get('if 2 < 1:\n  b\nc').get_optimized_module()
+    self.assertEqual(power_puter._LazyInputAnalyzer(module, {}).analyze(), ['c'])
+
+  def test_looks_up_namespaced_built_ins_once(self):
+    self.assertEqual(self.optimize('random.int(1, 5)'), '.random_int(1, 5)')
+    self.assertEqual(self.optimize('tensor.mean(a)'), '.tensor_mean(a)')
+    # Unless the namespace is assigned in the code, so it's the user's value that's called.
+    code = 'random = 3\nrandom.int(1, 2)'
+    self.assertEqual(self.optimize(code), code)
+    with self.assertRaisesRegex(AttributeError, "'int' object has no attribute 'int'"):
+      execute(code)
+
+  def test_does_not_run_calls(self):
+    for code in ["len('abc') + 1", "str(1) + 'x'", 'random.int(1, 5) * 0', 'node(1) and 0']:
+      with self.subTest(code=code):
+        self.assertTrue(self.has_call(code))
+    with mock.patch.object(power_puter._Puter, '_get_node') as get_node:
+      self.assertEqual(self.optimize('0 and node(1)'), '0')
+      self.optimize("if node('KSampler'):\n  1\nelse:\n  2")
+    get_node.assert_not_called()
+
+
+class _DynPrompt:
+  """A minimal stand-in of ComfyUI's DynamicPrompt, over an API prompt."""
+
+  def __init__(self, prompt: dict):
+    self._prompt = prompt
+
+  def all_node_ids(self):
+    return list(self._prompt)
+
+  def get_node(self, node_id):
+    return self._prompt[node_id]
+
+
+class MemoizeTest(unittest.TestCase):
+  """Tests of memoizing the code's output across executions."""
+
+  def setUp(self):
+    power_puter.clear_puter_caches()
+
+  def run_puter(self, code: str, prompt: dict):
+    return power_puter.RgthreePowerPuter().main(
+      code=code,
+      unique_id='2',
+      extra_pnginfo={},
+      prompt=prompt,
+      dynprompt=_DynPrompt(prompt),
+      outputs={'outputs': ['STRING']},
+      a='value',
+    )
+
+  def test_input_node_data_is_in_the_memo_key(self):
+    code = '# puter: memoize=true\ninput_node("a").inputs.text'
+    for text in ('cat', 'dog'):
+      prompt = {
+        '1': {'class_type': 'Text', 'inputs': {'text': text}},
+        '2': {'class_type': 'Power Puter (rgthree)', 'inputs': {'a': ['1', 0], 'code': code}},
+      }
+      self.assertEqual(self.run_puter(code, prompt), (text,))
+      self.assertEqual(self.run_puter(code, prompt), (text,))
+
+
+class MapTest(unittest.TestCase):
+  """Tests of the map node, evaluating the code for each row."""
+
+  def setUp(self):
+    power_puter.clear_puter_caches()
+
+  def run_puter(self, code: str, outputs=('STRING',), node=power_puter.RgthreePowerPuterMap, **ctx):
+    return node().main(
+      code=code,
+      unique_id='2',
+      extra_pnginfo={},
+      prompt={},
+      dynprompt=None,
+      outputs={'outputs': list(outputs)},
+      **ctx,
+    )
+
+  def test_list_outputs_are_declared_by_the_class(self):
+    self.assertTrue(all(power_puter.RgthreePowerPuterMap.OUTPUT_IS_LIST))
+    self.assertGreaterEqual(len(power_puter.RgthreePowerPuterMap.OUTPUT_IS_LIST), 10)
+    self.assertFalse(hasattr(power_puter.RgthreePowerPuter, 'OUTPUT_IS_LIST'))
+    node = power_puter.RgthreePowerPuterMap()
+    node.main(code='a', unique_id='2', extra_pnginfo={}, prompt={}, dynprompt=None, a=[1])
+    self.assertNotIn('OUTPUT_IS_LIST', vars(node))
+
+  def test_rows_from_list_inputs(self):
+    self.assertEqual(self.run_puter('a + b', a=[1, 2], b=(10, 20), c=5), (['11', '22'],))
+    self.assertEqual(
+      self.run_puter("# puter: map=a\n(a * c, b)", ('INT', '*'), a=[1, 2, 3], b=[4], c=5),
+      ([5, 10, 15], [[4], [4], [4]]),
+    )
+    with self.assertRaisesRegex(ValueError, 'same length'):
+      self.run_puter('1', a=[1, 2], b=[1])
+    with self.assertRaisesRegex(ValueError, 'is not a list'):
+      self.run_puter('# puter: map=a\n1', a=5)
+
+  def test_rows_from_a_range(self):
+    self.assertEqual(self.run_puter('# puter: map=3\nrow * 10', ('INT',)), ([0, 10, 20],))
+    self.assertEqual(self.run_puter('# puter: map=0\n1', ('INT', 'INT')), ([], []))
+
+  def test_state_resets_per_row(self):
+    code = '# puter: map=3\nif row == 0:\n  y = 5\nx = [row]\n(y, x)'
+    self.assertEqual(self.run_puter(code, ('*', '*')), ([5, None, None], [[0], [1], [2]]))
+
+  def test_map_mode_is_the_map_node(self):
+    with self.assertRaisesRegex(ValueError, 'Power Puter Map'):
+      self.run_puter('# puter: map=3\nrow', node=power_puter.RgthreePowerPuter)
+    with self.assertRaisesRegex(ValueError, 'Power Puter Map'):
+      self.run_puter('# puter: map=0\n1', node=power_puter.RgthreePowerPuter)
+    code = '# puter: map=false\n1'
+    self.assertEqual(self.run_puter(code, node=power_puter.RgthreePowerPuter), ('1',))
+
+
+# A prompt of two KSamplers, and the Power Puter (node 3) with its `a` input linked from the first.
+PROMPT = {
+  '1': {
+    'class_type': 'KSampler',
+    'inputs': {'seed': 5, 'steps': 20},
+    '_meta': {'title': 'KSampler'},
+  },
+  '2': {
+    'class_type': 'KSampler',
+    'inputs': {'seed': 7, 'model': ['1', 0]},
+    '_meta': {'title': 'KSampler 2'},
+  },
+  '3': {
+    'class_type': 'Power Puter (rgthree)',
+    'inputs': {'a': ['1', 0], 'code': ''},
+    '_meta': {'title': 'Puter'},
+  },
+}
+
+# Code, the inputs it's executed with, and what it evaluates to; from before the code was compiled.
+SNIPPETS = [
+  ('1 + 2 * 3', {}, 7),
+  ('a + b', {'a': 1, 'b': 2}, 3),
+  ('x = 0\nfor i in range(10):\n  if i == 5:\n    break\n  x += i\nx', {}, 10),
+  ('x = 0\nfor i in range(10):\n  if i % 2:\n    continue\n  x += i\nx', {}, 20),
+  ('[v * 2 for v in [1,2,3] if v > 1]', {}, [4, 6]),
+  ("[(k, v) for k, v in {'a': 1, 'b': 2}.items()]", {}, [('a', 1), ('b', 2)]),
+  ('[x + y for x in [1,2] for y in [10, 20]]', {}, [11, 21, 12, 22]),
+  ('[n for v in [1,2,3] if (n := v * 3) > 3]', {}, [6, 9]),
+  ("f'hello {a} {1+1}'", {'a': 'w'}, 'hello w 2'),
+  ("if a:\n  return 'yes'\n'no'", {'a': 1}, 'yes'),
+  ("if a:\n  return 'yes'\n'no'", {'a': 0}, 'no'),
+  ('x = 5\nwhile x > 0:\n  x -= 1\nx', {}, 0),
+  ('1 < 2', {}, 1),
+  ('a is None', {}, 1),
+  ('3 in [1,2,3]', {}, 1),
+  ('not a', {'a': 0}, 1),
+  ('a and b or c', {'a': 1, 'b': 0, 'c': 'z'}, 'z'),
+  ("'abc'[1:3]", {}, 'bc'),
+  ("d = {'a': [1, 2]}\nd['a'][0]", {}, 1),
+  ('l = [1,2]\nl[0] = 9\nl', {}, [9, 2]),
+  ('x, y = (1, 2)\nx + y', {}, 3),
+  ('node(1).inputs.seed', {}, 5),
+  ('node().inputs.a', {}, ['1', 0]),
+  ("[n.inputs.seed for n in nodes(re('KSampler'))]", {}, [5, 7]),
+  ("node('KSampler 2')['inputs']['seed']", {}, 7),
+  ("input_node('a').inputs.steps", {}, 20),
+  ('len(nodes())', {}, 3),
+  ('random.seed(3)\nrandom.int(1, 100)', {}, 31),
+  ('round(3.14159, 2)', {}, 3.14),
+  ("'a,b'.split(',')", {}, ['a', 'b']),
+  ('max(1, 5, 3)', {}, 5),
+  ('x = 3 if a else 4\nx', {'a': 0}, 4),
+  ('-a', {'a': 3}, -3),
+  ('1 != 2', {}, 1),
+  ('return', {}, None),
+  ('pass', {}, None),
+  ('l = []\nfor k, v in [(1, 2), (3, 4)]:\n  l = l + [k * v]\nl', {}, [2, 12]),
+  ('1 < 2 < 0', {}, 1),
+  ('for i in range(3):\n  if i == 1:\n    return i\n9', {}, 1),
+  ("if 0:\n  +a\n'ok'", {'a': 3}, 'ok'),
+  ('x = [1]\nx[0] += 5\nx', {}, [6]),
+  ("d = {}\nd['k'] = 1\nd", {}, {'k': 1}),
+  ('[a for a in (1,2)]\na', {'a': 3}, 3),
+  ('if 0:\n  1', {}, 0),
+  ('x = 5\n[x * 2 for x in [1,2,3]]', {}, [2, 4, 6]),
+  ('x = 5\n[x * 2 for x in [1,2,3]]\nx', {}, 5),
+  ('[[y * x for y in [1, 2]] for x in [10, 20]]', {}, [[10, 20], [20, 40]]),
+  ("[(k, v) for k, v in {'a': 1, 'b': 2}.items() if v > 1]", {}, [('b', 2)]),
+  ('[x + y for x in [1, 2] for y in [10, 20] if x != 2 or y != 10]', {}, [11, 21, 22]),
+  ('[l for n in [1, 0, 3] if (l := n * 2)]', {}, [2, 6]),
+  ('l = 99\n[l for n in [1, 0, 3] if (l := n * 2)]\nl', {}, 99),
+  ('t = 3\n[t + i for i in range(3)]', {}, [3, 4, 5]),
+  ('x = [1,2]\n[x for x in x]', {}, [1, 2]),
+  ('[[z for z in range(x)] for x in range(3)]', {}, [[], [0], [0, 1]]),
+  ('[[x for z in range(2)] for x in range(3)]', {}, [[0, 0], [1, 1], [2, 2]]),
+  ('[y for x in [[1,2],[3]] for y in x]', {}, [1, 2, 3]),
+  ('[(q := i) + q for i in [1,2]]', {}, [2, 4]),
+  ("[len(s) for s in ['ab', 'c']]", {}, [2, 1]),
+  ("{k: v * 2 for k, v in {'a': 1}.items()}", {}, {'a': 2}),
+  ('{x % 2 for x in range(5)}', {}, {0, 1}),
+  ('sum(x for x in range(4))', {}, 6),
+  ('sum([1, 2, 3])', {}, 6),
+  ('min([4, 2, 8])', {}, 2),
+  ("int('4') + 1", {}, 5),
+  ("float('1.5') * 2", {}, 3.0),
+  ("str(12) + 'x'", {}, '12x'),
+  ('bool(0)', {}, False),
+  ('list((1, 2))', {}, [1, 2]),
+  ('tuple([1])', {}, (1,)),
+  ("' '.join(['a', 'b'])", {}, 'a b'),
+  ("'abc'.upper()", {}, 'ABC'),
+  ("'%s-%s' % ('a', 'b')", {}, 'a-b'),
+  ('7 // 2', {}, 3),
+  ('7 % 3', {}, 1),
+  ('2 ** 10', {}, 1024),
+  ('-7 / 2', {}, -3.5),
+  ('x = 1\nx += 2\nx *= 3\nx', {}, 9),
+  ('i = 0\nwhile True:\n  i += 1\n  if i > 3:\n    break\ni', {}, 4),
+  ('x = 0\nwhile True:\n  x += 1\n  if x == 3:\n    return x * 10\n-1', {}, 30),
+  (
+    'i = 0\nwhile i < 5:\n  i += 1\n  for j in range(3):\n    if j == 1:\n      return (i, j)\n-1',
+    {},
+    (1, 1),
+  ),
+  (
+    'n = 0\nfor i in range(3):\n  for j in range(3):\n    if j == i:\n      continue\n'
+    '    n += 1\nn',
+    {},
+    6,
+  ),
+  ('a if a > 2 else b', {'a': 3, 'b': 6}, 3),
+  ('a < b <= 10', {'a': 3, 'b': 6}, 1),
+  ('[1, 2] + [3]', {}, [1, 2, 3]),
+  ('(1, 2)[-1]', {}, 2),
+  ("{'a': 1}.get('b', 5)", {}, 5),
+  ('None is not None', {}, 0),
+  ('(x := 4) + x', {}, 8),
+  ("random.choice(['only'])", {}, 'only'),
+  ("len('abc') if a else 0", {'a': 3}, 3),
+  ('round(2.5)', {}, 2),
+  ("'{:>3}'.format(1)", {}, '  1'),
+  ('range(3)[1]', {}, 1),
+  ('for i in range(2):\n  pass\ni', {}, 1),
+]
+
+
+def execute_in_prompt(code: str, **ctx):
+  """Executes the code as the Power Puter of `PROMPT`, with the other inputs None."""
+  ctx = {**{c: None for c in power_puter._INPUT_VARIABLES}, **ctx}
+  return power_puter._Puter(
+    code=code, ctx=ctx, workflow={}, prompt=PROMPT, dynprompt=_DynPrompt(PROMPT), unique_id='3'
+  ).execute()
+
+
+class CompiledProgramTest(unittest.TestCase):
+  """Tests that the code, compiled into closures, evaluates as it did when the ast was walked."""
+
+  def setUp(self):
+    power_puter.clear_puter_caches()
+
+  def test_snippets(self):
+    for code, ctx, expected in SNIPPETS:
+      with self.subTest(code=code):
+        self.assertEqual(execute_in_prompt(code, **ctx), expected)
+
+  def test_errors(self):
+    cases = [
+      ('zz', NameError, 'Name not found: zz'),
+      ('break', power_puter.LoopBreak, 'outside of a loop'),
+      ('continue', power_puter.LoopContinue, 'outside of a loop'),
+      ('len(1, 2)', SyntaxError, 'len requires 1 to 1 args'),
+      ('f = 1\nf()', ValueError, 'No call for ast.Call f'),
+      ('a.tofile', ValueError, 'Disallowed access to "tofile"'),
+    ]
+    for code, error, message in cases:
+      with self.subTest(code=code), self.assertRaisesRegex(error, message):
+        execute_in_prompt(code, a=np.zeros(2))
+
+  def test_compiles_once_for_every_execution(self):
+    compile_module = power_puter._Compiler.compile_module
+    with mock.patch.object(
+      power_puter._Compiler, 'compile_module', autospec=True, side_effect=compile_module
+    ) as compiled:
+      for a in range(3):
+        self.assertEqual(execute_in_prompt('[i * a for i in range(3)]', a=a), [0, a, 2 * a])
+    self.assertEqual(compiled.call_count, 1)
+
+  def test_return_exits_every_loop(self):
+    code = 'x = 0\nwhile True:\n  x += 1\n  if x == 3:\n    return x * 10\n-1'
+    self.assertEqual(execute(code), 30)
+    code = 'while True:\n  for i in range(3):\n    while True:\n      return i + a\n-1'
+    self.assertEqual(execute(code, a=5), 5)
+
+
+class PromptNodeIndexTest(unittest.TestCase):
+  """Tests of looking up prompt nodes, through an index built once for each execution."""
+
+  def setUp(self):
+    power_puter.clear_puter_caches()
+
+  def test_finds_by_id_title_and_class_type(self):
+    cases = [
+      ('node(2).id', '2'),
+      ("node('KSampler 2').inputs.seed", 7),
+      # A title is matched before a class_type.
+      ("[n.id for n in nodes('KSampler')]", ['1']),
+      ("[n.id for n in nodes('Power Puter (rgthree)')]", ['3']),
+      ("[n.id for n in nodes(re('^KSampler'))]", ['1', '2']),
+      ("input_node('a').id", '1'),
+      ('[n.id for n in output_nodes(node(1))]', ['2', '3']),
+      ('output_nodes()', []),
+      ("node('Missing')", None),
+    ]
+    for code, expected in cases:
+      with self.subTest(code=code):
+        self.assertEqual(execute_in_prompt(code), expected)
+
+  def test_is_built_once_for_each_execution(self):
+    prompt = {
+      str(i): {
+        'class_type': 'KSampler' if i % 2 else 'Text',
+        'inputs': {'seed': i, 'model': [str(i - 1), 0]},
+        '_meta': {'title': f'Node {i % 10}'},
+      } for i in range(1, 601)
+    }
+    prompt['600']['inputs']['a'] = ['5', 0]
+    dynprompt = mock.Mock(wraps=_DynPrompt(prompt))
+    code = (
+      "seeds = [n.inputs.seed for n in nodes(re('Node [13]'))]\n"
+      "(len(seeds), seeds[0:3], node(7).inputs.seed, input_node('a').inputs.seed,"
+      " len(output_nodes(node(5))), len(nodes('KSampler')))"
+    )
+    for _ in range(2):
+      puter = power_puter._Puter(
+        code=code, ctx={}, workflow={}, prompt=prompt, dynprompt=dynprompt, unique_id='600'
+      )
+      self.assertEqual(puter.execute(), (120, [1, 3, 11], 7, 5, 2, 300))
+      # Running it again shares the index of the execution.
+      puter.execute()
+    self.assertEqual(dynprompt.all_node_ids.call_count, 2)
+    self.assertEqual(dynprompt.get_node.call_count, 1200)
+
+  def test_is_not_built_without_lookups(self):
+    dynprompt = mock.Mock(wraps=_DynPrompt(PROMPT))
+    power_puter._Puter(
+      code='a + 1', ctx={'a': 1}, workflow={}, prompt=PROMPT, dynprompt=dynprompt, unique_id='3'
+    ).execute()
+    dynprompt.all_node_ids.assert_not_called()
+
+  def test_found_lists_are_copies(self):
+    index = power_puter._PromptNodeIndex(PROMPT)
+    for node_id in (None, re.compile('KSampler'), 'KSampler'):
+      index.find(node_id).clear()
+    self.assertEqual([n['id'] for n in index.find(re.compile('KSampler'))], ['1', '2'])
+    self.assertEqual(len(index.find()), 3)
+
+
+class ScopeTest(unittest.TestCase):
+  """Tests of the scopes of comprehensions, layered over the ctx rather than copying it."""
+
+  def test_comprehension_variables_are_local(self):
+    cases = [
+      ('x = 5\n[x * 2 for x in [1, 2, 3]]\nx', {}, 5),
+      ('[a for a in (1, 2)]\na', {'a': 'A'}, 'A'),
+      ('t = 3\n[t + i for i in range(3)]', {}, [3, 4, 5]),
+      ('[[x for z in range(2)] for x in range(3)]', {}, [[0, 0], [1, 1], [2, 2]]),
+      ('[y for x in [[1, 2], [3]] for y in x]', {}, [1, 2, 3]),
+      ('{k: [v for v in range(k)] for k in range(3)}', {}, {0: [], 1: [0], 2: [0, 1]}),
+      ('sum(x * y for x in range(3) for y in range(3))\nx', {'x': 'X'}, 'X'),
+    ]
+    for code, ctx, expected in cases:
+      with self.subTest(code=code):
+        self.assertEqual(execute(code, **ctx), expected)
+
+  def test_first_iterable_is_of_the_enclosing_scope(self):
+    self.assertEqual(execute('x = [1, 2]\n[x for x in x]'), [1, 2])
+    self.assertEqual(execute('[[x for x in x] for x in [[1], [2, 3]]]'), [[1], [2, 3]])
+    self.assertEqual(execute('{x for x in x}', x=(4, 4)), {4})
+
+  def test_iterating_does_not_copy_the_ctx(self):
+    ctx = {f'v{i}': i for i in range(20000)}
+    start = time.perf_counter()
+    self.assertEqual(len(execute('[i for i in range(20000) if i >= 0]', **ctx)), 20000)
+    # Copying the ctx for each item, like before, would take minutes.
+    self.assertLess(time.perf_counter() - start, 2)
+
+
+@unittest.skipUnless(importlib.util.find_spec('torch'), 'Needs torch.')
+class BatchTest(unittest.TestCase):
+  """Tests of batching images and latents, in one concatenation rather than pair by pair."""
+
+  def setUp(self):
+    import torch  # pylint: disable = import-outside-toplevel
+    self.torch = torch
+
+    def common_upscale(samples, width, height, upscale_method, crop):
+      return torch.nn.functional.interpolate(samples, size=(height, width), mode=upscale_method)
+
+    # A stand-in of ComfyUI's `comfy.utils`, with the resize the batch nodes use.
+    self.common_upscale = mock.Mock(side_effect=common_upscale)
+    comfy = SimpleNamespace(utils=SimpleNamespace(common_upscale=self.common_upscale))
+    patcher = mock.patch.dict('sys.modules', {'comfy': comfy, 'comfy.utils': comfy.utils})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def batch(self, code: str, **ctx):
+    with mock.patch.object(self.torch, 'cat', wraps=self.torch.cat) as cat:
+      result = execute(code, **ctx)
+    self.assertEqual(cat.call_count, 1)
+    return result
+
+  def test_images_are_concatenated_at_once(self):
+    a, b, c = (self.torch.rand(n, 8, 8, 3) for n in (2, 1, 3))
+    expected = self.torch.cat([a, b, c])
+    for code in ('batch(a, b, c)', 'batch(a, [b, c])', 'batch(*l)'):
+      with self.subTest(code=code):
+        self.assertTrue(self.torch.equal(self.batch(code, a=a, b=b, c=c, l=(a, b, c)), expected))
+    frames = [self.torch.rand(1, 8, 8, 3) for _ in range(64)]
+    self.assertEqual(self.batch('batch(*a)', a=frames).shape, (64, 8, 8, 3))
+    self.common_upscale.assert_not_called()
+
+  def test_only_mismatched_images_are_resized_and_padded(self):
+    a = self.torch.rand(2, 8, 8, 3)
+    b = self.torch.rand(1, 4, 6, 3)
+    c = self.torch.rand(1, 8, 8, 4)
+    result = self.batch('batch(a, b, a, c)', a=a, b=b, c=c)
+    self.assertEqual(result.shape, (6, 8, 8, 4))
+    self.assertEqual(self.common_upscale.call_count, 1)
+    # Images without an alpha channel are padded with an opaque one.
+    self.assertTrue(self.torch.equal(result[:2, ..., :3], a))
+    self.assertTrue(bool((result[:5, ..., 3] == 1).all()))
+    self.assertTrue(self.torch.equal(result[5:], c))
+
+  def test_latents_are_concatenated_with_their_batch_index(self):
+    a = {'samples': self.torch.rand(2, 4, 8, 8)}
+    b = {'samples': self.torch.rand(1, 4, 4, 4), 'batch_index': [5]}
+    result = self.batch('batch(a, b, a)', a=a, b=b)
+    self.assertEqual(result['samples'].shape, (5, 4, 8, 8))
+    self.assertEqual(result['batch_index'], [0, 1, 5, 0, 1])
+    self.assertEqual(self.common_upscale.call_count, 1)
+
+  def test_errors(self):
+    with self.assertRaisesRegex(ValueError, 'at least one'):
+      execute('batch(a)', a=[])
+    latent = {'samples': self.torch.rand(1, 4, 1, 1)}
+    with self.assertRaisesRegex(ValueError, 'Expecting "IMAGE" but got "LATENT"'):
+      execute('batch(a, b)', a=self.torch.rand(1, 8, 8, 3), b=latent)
+
+
+class ExecutingPromptTest(unittest.TestCase):
+  """Tests of finding the executing prompt in ComfyUI's queue, for IS_CHANGED."""
+
+  CODE = 'node("Text").inputs.text'
+
+  def get_prompt(self, running: dict):
+    queue = SimpleNamespace(mutex=threading.Lock(), currently_running=running)
+    instance = SimpleNamespace(prompt_queue=queue)
+    server = SimpleNamespace(PromptServer=SimpleNamespace(instance=instance))
+    with mock.patch.dict('sys.modules', {'server': server}):
+      return power_puter._get_executing_prompt({'unique_id': '2', 'code': self.CODE})
+
+  def make_prompt(self, code: str, text='cat'):
+    return {
+      '1': {'class_type': 'Text', 'inputs': {'text': text}},
+      '2': {'class_type': 'Power Puter (rgthree)', 'inputs': {'code': code}},
+    }
+
+  def test_matches_the_running_prompt_with_our_code(self):
+    ours = self.make_prompt(self.CODE)
+    running = {1: (0, 'a', self.make_prompt('"other"'), {}, []), 2: (1, 'b', ours, {}, [])}
+    self.assertIs(self.get_prompt(running), ours)
+
+  def test_returns_none_when_unknown(self):
+    for running in [
+      {},
+      {1: 'not a queue item', 2: (0, 'a')},
+      {1: (0, 'a', ['not', 'a', 'prompt'], {}, [])},
+      {1: (0, 'a', self.make_prompt('"other"'), {}, [])},
+      {
+        1: (0, 'a', self.make_prompt(self.CODE, 'cat'), {}, []),
+        2: (1, 'b', self.make_prompt(self.CODE, 'dog'), {}, []),
+      },
+    ]:
+      self.assertIsNone(self.get_prompt(running))
+    self.assertIsNone(self.get_prompt(None))
+
+
+if __name__ == '__main__':
+  unittest.main()
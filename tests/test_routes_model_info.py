@@ -0,0 +1,68 @@
+"""Tests of the model info api routes."""
+
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import make_mocked_request
+
+from tests import comfy_fakes
+from py.server import routes_model_info
+
+
+class ModelsInfoResponseTest(unittest.IsolatedAsyncioTestCase):
+  """Tests of responding with the info of many models, compiled a few at once."""
+
+  async def asyncSetUp(self):
+    self.started: list[str] = []
+    self.cancelled: list[str] = []
+    self.infos = []
+    patcher = mock.patch.object(routes_model_info, 'get_model_info', self.get_model_info)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    iter_models_info = routes_model_info._iter_models_info
+
+    def record_infos(*args, **kwargs):
+      self.infos.append(iter_models_info(*args, **kwargs))
+      return self.infos[-1]
+
+    patcher = mock.patch.object(routes_model_info, '_iter_models_info', record_infos)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def get_model_info(self, file: str, model_type: str, **kwargs):
+    """Returns the info of `ready` files at once, while the others never finish."""
+    self.started.append(file)
+    if file.startswith('ready'):
+      return {'file': file, 'raw': {}}
+    try:
+      await asyncio.Event().wait()
+    except asyncio.CancelledError:
+      self.cancelled.append(file)
+      raise
+
+  def respond(self, query: str):
+    request = make_mocked_request('GET', f'/rgthree/api/loras/info?{query}')
+    return routes_model_info.models_info_response(request, 'loras')
+
+  async def test_responds_with_each_info(self):
+    response = await self.respond('files=ready1,ready2&fields=file')
+    self.assertEqual(json.loads(response.text)['data'], [{'file': 'ready1'}, {'file': 'ready2'}])
+
+  async def test_infos_in_flight_are_cancelled_when_responding_fails(self):
+    for query in ('files=ready1,slow1,slow2', 'files=ready1,slow1,slow2&format=ndjson'):
+      with self.subTest(query=query), \
+          mock.patch.object(routes_model_info, '_get_fields_projection') as projection:
+        projection.return_value.side_effect = ConnectionResetError()
+        self.cancelled.clear()
+        with self.assertRaises(ConnectionResetError):
+          await self.respond(query)
+        # Closed before the error's raised, rather than whenever it's garbage collected.
+        self.assertIsNone(self.infos[-1].ag_frame)
+        await asyncio.sleep(0)
+        self.assertEqual(self.cancelled, ['slow1', 'slow2'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+"""Tests of the searchable catalog of model info files."""
+
+import contextlib
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import comfy_fakes
+from py.server import utils_catalog
+from py.server import utils_info_cache
+from py.server.utils_info_cache import save_info_file
+
+MODELS = {
+  'my_lora.safetensors': {'name': 'Sketchy Style', 'baseModel': 'SDXL 1.0', 'sha256': 'AB12'},
+  'myXlora.safetensors': {'name': 'Anime Portraits', 'baseModel': 'SD 1.5'},
+  'percent.safetensors': {'name': 'Detail 100% Boost', 'trainedWords': [{'word': 'ultra_sharp'}]},
+  'thousand.safetensors': {'name': 'Detail 1000 Boost', 'trainedWords': [{'word': 'ultraxsharp'}]},
+  'no_info.safetensors': None,
+}
+
+
+class ModelCatalogTest(unittest.TestCase):
+  """Tests of syncing the catalog with the info files, and searching it."""
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.loras = os.path.join(directory.name, 'models', 'loras')
+    os.makedirs(self.loras)
+    for file, info in MODELS.items():
+      self.write_model(file, info)
+    stack = contextlib.ExitStack()
+    self.addCleanup(stack.close)
+    stack.enter_context(comfy_fakes.patch_models_dir(os.path.join(directory.name, 'models')))
+    self.catalog = utils_catalog._ModelCatalog('catalog.sqlite3')
+    self.catalog._file_path = os.path.join(directory.name, 'catalog.sqlite3')
+    self.addCleanup(lambda: self.catalog._connection and self.catalog._connection.close())
+
+  def write_model(self, file: str, info):
+    path = os.path.join(self.loras, file)
+    with open(path, 'wb') as f:
+      f.write(b'model')
+    if info is not None:
+      with open(f'{path}.rgthree-info.json', 'w', encoding='UTF-8') as f:
+        json.dump(info, f)
+
+  def search(self, query=None, **kwargs) -> list[str]:
+    self.catalog.sync('loras')
+    return [model['file'] for model in self.catalog.search('loras', query, **kwargs)[0]]
+
+  def check_searches(self):
+    self.assertEqual(self.search('sketchy'), ['my_lora.safetensors'])
+    self.assertEqual(self.search('anime port'), ['myXlora.safetensors'])
+    detail = ['percent.safetensors', 'thousand.safetensors']
+    self.assertEqual(self.search('detail boost', sort='name'), detail)
+    self.assertEqual(self.search('ultra', sort='file'), detail)
+    self.assertEqual(self.search('missing'), [])
+
+  def test_full_text_search(self):
+    self.catalog._get_connection()
+    if not self.catalog._has_fts:
+      self.skipTest('SQLite has no FTS5')
+    self.check_searches()
+
+  def test_like_search(self):
+    self.catalog._get_connection()
+    self.catalog._has_fts = False
+    self.check_searches()
+    # LIKE's wildcards in the query are matched literally.
+    self.assertEqual(self.search('my_lora'), ['my_lora.safetensors'])
+    self.assertEqual(self.search('100%'), ['percent.safetensors'])
+    self.assertEqual(self.search('ultra_sharp'), ['percent.safetensors'])
+    self.assertEqual(self.search('\\'), [])
+
+  def test_filters_sort_and_pages(self):
+    self.assertEqual(self.search(filters={'base_model': 'sdxl 1.0'}), ['my_lora.safetensors'])
+    self.assertEqual(self.search(filters={'sha256': 'ab12'}), ['my_lora.safetensors'])
+    files = sorted(MODELS, key=str.lower)
+    self.assertEqual(self.search(), files)
+    self.assertEqual(self.search(sort='-file', limit=2, offset=1), files[::-1][1:3])
+    self.assertEqual(self.catalog.search('loras', limit=1)[1], len(MODELS))
+
+  def test_saved_info_files_are_synced_by_the_next_search(self):
+    self.search()
+    info_path = os.path.join(self.loras, 'no_info.safetensors.rgthree-info.json')
+    save_info_file(info_path, {'name': 'Zebra Stripes'})
+    # Saving notifies the shared catalog, so this one is told directly.
+    self.catalog.mark_changed(info_path)
+    self.assertEqual(self.search('zebra'), ['no_info.safetensors'])
+    # Files changed outside of rgthree wait for a full check.
+    self.write_model('myXlora.safetensors', {'name': 'Yak'})
+    self.assertEqual(self.search('yak'), [])
+    self.catalog.invalidate('loras')
+    self.assertEqual(self.search('yak'), ['myXlora.safetensors'])
+
+  def test_info_files_are_read_through_the_cache(self):
+    self.search()
+    # A new catalog reads every info file, but they're cached and unchanged so none is read again.
+    catalog = utils_catalog._ModelCatalog('catalog.sqlite3')
+    catalog._file_path = f'{self.catalog._file_path}.new'
+    self.addCleanup(lambda: catalog._connection and catalog._connection.close())
+    read_info_file = mock.Mock(wraps=utils_info_cache.read_info_file)
+    with mock.patch.object(utils_catalog, 'read_info_file', read_info_file), \
+        mock.patch.object(utils_info_cache, 'load_json_file') as load_json_file:
+      catalog.sync('loras')
+    self.assertEqual(read_info_file.call_count, len(MODELS))
+    load_json_file.assert_not_called()
+    self.assertEqual(catalog.search('loras', 'sketchy')[1], 1)
+
+  def test_removed_models_are_removed(self):
+    self.search()
+    os.remove(os.path.join(self.loras, 'myXlora.safetensors'))
+    self.catalog.sync('loras', force=True)
+    self.assertEqual(self.search('anime'), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
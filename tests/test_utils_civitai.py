@@ -0,0 +1,128 @@
+"""Tests of the Civitai client, against a local stand-in of the api."""
+
+import asyncio
+import socket
+import unittest
+from typing import Optional
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from py import config
+from py.server.utils_civitai import _CivitaiClient
+
+KNOWN_HASH = 'A' * 64
+
+
+def make_version(file_hash: str) -> dict:
+  return {'id': int(file_hash[:6], 16), 'files': [{'hashes': {'SHA256': file_hash}}]}
+
+
+class CivitaiClientTest(unittest.IsolatedAsyncioTestCase):
+  """Tests of looking up model versions by hash."""
+
+  async def asyncSetUp(self):
+    self.requests: list[tuple[str, object]] = []
+    # The statuses to respond with, in order, before responding normally.
+    self.failures: list[int] = []
+    # Set to have the by-hash GET hang, once it's been requested.
+    self.hanging: Optional[asyncio.Event] = None
+    self.config = {'retries': 2, 'backoff_seconds': 0.01, 'requests_per_second': 0}
+    patcher = mock.patch.dict(config.RGTHREE_CONFIG, {'civitai': self.config})
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    app = web.Application()
+    app.router.add_get('/api/v1/model-versions/by-hash/{hash}', self.get_by_hash)
+    app.router.add_post('/api/v1/model-versions/by-hash', self.post_by_hash)
+    self.server = TestServer(app)
+    await self.server.start_server()
+    self.addAsyncCleanup(self.server.close)
+    self.client = _CivitaiClient(api_url=str(self.server.make_url('/api/v1')))
+    self.addAsyncCleanup(self.client.close)
+
+  async def get_by_hash(self, request: web.Request) -> web.Response:
+    file_hash = request.match_info['hash']
+    self.requests.append(('GET', file_hash))
+    if self.hanging is not None:
+      self.hanging.set()
+      await asyncio.sleep(60)
+    if self.failures:
+      status = self.failures.pop(0)
+      return web.json_response({'error': 'Busy'}, status=status, headers={'Retry-After': '0'})
+    if file_hash != KNOWN_HASH:
+      return web.json_response({'error': 'Model not found'}, status=404)
+    return web.json_response(make_version(file_hash))
+
+  async def post_by_hash(self, request: web.Request) -> web.Response:
+    hashes = await request.json()
+    self.requests.append(('POST', hashes))
+    if self.failures:
+      return web.json_response({'error': 'Busy'}, status=self.failures.pop(0))
+    return web.json_response([make_version(h) for h in hashes if h.startswith('A')])
+
+  async def lookup(self, *hashes: str) -> list:
+    """Looks up the hashes all at once, as they would be when refreshing a library."""
+    return await asyncio.gather(*(self.client.get_model_version_by_hash(h) for h in hashes))
+
+  async def test_single_hash_is_a_get(self):
+    self.assertEqual(await self.lookup(KNOWN_HASH.lower()), [make_version(KNOWN_HASH)])
+    self.assertEqual(self.requests, [('GET', KNOWN_HASH)])
+
+  async def test_hashes_together_are_posted_in_batches(self):
+    self.config['batch_size'] = 100
+    hashes = [f'{"A" if i % 2 else "B"}{i:063d}' for i in range(250)]
+    results = await self.lookup(*hashes, hashes[0])
+    self.assertEqual([method for method, _ in self.requests], ['POST'] * 3)
+    self.assertEqual([len(batch) for _, batch in self.requests], [100, 100, 50])
+    self.assertEqual(sorted(h for _, batch in self.requests for h in batch), sorted(hashes))
+    for file_hash, result in zip([*hashes, hashes[0]], results):
+      expected = make_version(file_hash) if file_hash.startswith('A') else None
+      self.assertEqual(result, expected or {'error': 'Model not found'})
+
+  async def test_retries_then_succeeds(self):
+    self.failures = [503, 429]
+    self.assertEqual(await self.lookup(KNOWN_HASH), [make_version(KNOWN_HASH)])
+    self.assertEqual(self.requests, [('GET', KNOWN_HASH)] * 3)
+
+  async def test_retries_exhausted_is_none(self):
+    self.failures = [503] * 3
+    self.assertEqual(await self.lookup(KNOWN_HASH), [None])
+    self.assertEqual(len(self.requests), 3)
+    self.failures = [502] * 3
+    self.assertEqual(await self.lookup(KNOWN_HASH, 'A' + '1' * 63), [None, None])
+    self.assertEqual(len(self.requests), 6)
+
+  async def test_unreachable_is_none(self):
+    with socket.socket() as sock:
+      sock.bind(('127.0.0.1', 0))
+      port = sock.getsockname()[1]
+    client = _CivitaiClient(api_url=f'http://127.0.0.1:{port}/api/v1')
+    self.addAsyncCleanup(client.close)
+    self.assertIsNone(await client.get_model_version_by_hash(KNOWN_HASH))
+
+  async def test_unknown_hash_is_not_found(self):
+    self.assertEqual(await self.lookup('B' * 64), [{'error': 'Model not found'}])
+    self.assertEqual(await self.lookup('B' * 64, 'C' * 64), [{'error': 'Model not found'}] * 2)
+
+  async def test_batches_in_flight_are_held_and_cancelled_on_close(self):
+    self.hanging = asyncio.Event()
+    lookup = asyncio.ensure_future(self.client.get_model_version_by_hash(KNOWN_HASH))
+    await asyncio.wait_for(self.hanging.wait(), 5)
+    self.assertEqual(len(self.client._tasks), 1)
+    await self.client.close()
+    with self.assertRaises(asyncio.CancelledError):
+      await lookup
+    self.assertEqual(len(self.client._tasks), 0)
+
+  def test_api_url_is_from_the_config(self):
+    self.config['api_url'] = 'https://mirror.example/api/v1/'
+    self.assertEqual(
+      _CivitaiClient().get_by_hash_url('abc'),
+      'https://mirror.example/api/v1/model-versions/by-hash/abc'
+    )
+
+
+if __name__ == '__main__':
+  unittest.main()
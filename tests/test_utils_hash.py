@@ -0,0 +1,132 @@
+"""Tests of hashing model files, and the persistent store of their hashes."""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from py.server import utils_hash
+
+
+class HashStoreTest(unittest.TestCase):
+  """Tests of storing, and saving, file hashes."""
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.dir.cleanup)
+    self.store_path = os.path.join(self.dir.name, 'hashes.json')
+    self.file_path = os.path.join(self.dir.name, 'model.bin')
+    with open(self.file_path, 'wb') as file:
+      file.write(b'model')
+
+  def make_store(self) -> utils_hash._HashStore:
+    store = utils_hash._HashStore('hashes.json')
+    store._file_path = self.store_path
+    self.addCleanup(store.flush)
+    return store
+
+  def test_put_saves_once_after_a_delay(self):
+    store = self.make_store()
+    stat = os.stat(self.file_path)
+    with mock.patch.object(utils_hash, '_SAVE_DELAY', 0.2), \
+        mock.patch.object(store, '_save', wraps=store._save) as save:
+      for i in range(100):
+        store.put(f'{self.file_path}{i}', stat, f'hash{i}')
+      self.assertFalse(os.path.exists(self.store_path))
+      self.assertEqual(store.get(f'{self.file_path}99', stat), 'hash99')
+      deadline = time.monotonic() + 5
+      while not os.path.exists(self.store_path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+      self.assertEqual(save.call_count, 1)
+    self.assertEqual(self.make_store().get(f'{self.file_path}99', stat), 'hash99')
+
+  def test_flush_saves_now_and_only_when_changed(self):
+    store = self.make_store()
+    stat = os.stat(self.file_path)
+    store.put(self.file_path, stat, 'hash')
+    with mock.patch.object(store, '_save', wraps=store._save) as save:
+      store.flush()
+      store.flush()
+      self.assertEqual(save.call_count, 1)
+    self.assertEqual(self.make_store().get(self.file_path, stat), 'hash')
+
+  def test_changed_file_is_not_found(self):
+    store = self.make_store()
+    store.put(self.file_path, os.stat(self.file_path), 'hash')
+    with open(self.file_path, 'ab') as file:
+      file.write(b' changed')
+    self.assertIsNone(store.get(self.file_path, os.stat(self.file_path)))
+
+
+class HashFileTest(unittest.TestCase):
+  """Tests that every hashing strategy hashes the same."""
+
+  def test_strategies_match(self):
+    with tempfile.TemporaryDirectory() as directory:
+      expected = {}
+      for size in (0, 1, utils_hash._BUFFER_SIZE + 7):
+        path = os.path.join(directory, f'{size}.bin')
+        data = os.urandom(size)
+        with open(path, 'wb') as file:
+          file.write(data)
+        expected[path] = hashlib.sha256(data).hexdigest()
+      for path, file_hash in expected.items():
+        self.assertEqual(utils_hash.hash_file(path), file_hash)
+        for strategy in utils_hash.HASH_STRATEGIES:
+          self.assertEqual(utils_hash.hash_file(path, strategy), file_hash)
+
+  def test_small_files_are_buffered_where_pages_can_be_dropped(self):
+    strategies = {name: mock.Mock(return_value=name) for name in utils_hash.HASH_STRATEGIES}
+    with tempfile.NamedTemporaryFile() as file, \
+        mock.patch.dict(utils_hash.HASH_STRATEGIES, strategies):
+      for can_fadvise, expected in ((True, 'buffered'), (False, 'file_digest')):
+        with mock.patch.object(utils_hash, '_CAN_FADVISE', can_fadvise):
+          self.assertEqual(utils_hash.hash_file(file.name), expected)
+
+  def test_max_bytes_per_second_limits_the_reading(self):
+    data = os.urandom(64 * 1024)
+    with tempfile.NamedTemporaryFile() as file, \
+        mock.patch.object(utils_hash, '_BUFFER_SIZE', 4 * 1024), \
+        mock.patch.object(utils_hash, '_MMAP_WINDOW', 4 * 1024):
+      file.write(data)
+      file.flush()
+      for strategy in utils_hash.HASH_STRATEGIES:
+        start = time.perf_counter()
+        file_hash = utils_hash.hash_file(file.name, strategy, max_bytes_per_second=256 * 1024)
+        self.assertEqual(file_hash, hashlib.sha256(data).hexdigest())
+        # 64KiB at 256KiB a second takes a quarter of a second.
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2, strategy)
+
+
+class GetHashAsyncTest(unittest.IsolatedAsyncioTestCase):
+  """Tests of getting a file's hash from the event loop."""
+
+  async def test_checks_the_store_off_the_event_loop(self):
+    with tempfile.TemporaryDirectory() as directory:
+      store = utils_hash._HashStore('hashes.json')
+      store._file_path = os.path.join(directory, 'hashes.json')
+      path = os.path.join(directory, 'model.bin')
+      with open(path, 'wb') as file:
+        file.write(b'model')
+      threads = []
+      get_hash_future = utils_hash._get_hash_future
+
+      def record_thread(file_path, *args):
+        threads.append(threading.current_thread())
+        return get_hash_future(file_path, *args)
+
+      with mock.patch.object(utils_hash, '_HASH_STORE', store), \
+          mock.patch.object(utils_hash, '_get_hash_future', record_thread):
+        for _ in range(2):
+          file_hash = await utils_hash.get_sha256_hash_async(path)
+          self.assertEqual(file_hash, hashlib.sha256(b'model').hexdigest())
+      store.flush()
+    self.assertEqual(len(threads), 2)
+    self.assertNotIn(threading.main_thread(), threads)
+
+
+if __name__ == '__main__':
+  unittest.main()
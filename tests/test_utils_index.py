@@ -0,0 +1,109 @@
+"""Tests of the background indexing of a model type's library."""
+
+import asyncio
+import contextlib
+import json
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import comfy_fakes
+from py import config
+from py import utils_userdata
+from py.server import utils_hash
+from py.server import utils_index
+
+FILES = [f'lora{i}.safetensors' for i in range(5)]
+
+
+def write_safetensors(path: str, title: str):
+  """Writes a minimal safetensors file; a header of just metadata, and no tensors."""
+  header = json.dumps({'__metadata__': {'modelspec.title': title}}).encode()
+  with open(path, 'wb') as file:
+    file.write(struct.pack('<Q', len(header)) + header)
+
+
+class IndexJobTest(unittest.IsolatedAsyncioTestCase):
+  """Tests of starting, cancelling and reporting the progress of an indexing job."""
+
+  async def asyncSetUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.loras = os.path.join(directory.name, 'models', 'loras')
+    os.makedirs(self.loras)
+    for file in FILES:
+      write_safetensors(os.path.join(self.loras, file), file)
+    store = utils_hash._HashStore('hashes.json')
+    store._file_path = os.path.join(directory.name, 'hashes.json')
+    self.server = comfy_fakes._PromptServer()
+    self.config = {'max_mb_per_second': 0, 'pause_ms': 0}
+    stack = contextlib.ExitStack()
+    self.addCleanup(stack.close)
+    stack.enter_context(comfy_fakes.patch_models_dir(os.path.join(directory.name, 'models')))
+    stack.enter_context(mock.patch.object(utils_hash, '_HASH_STORE', store))
+    # The metadata read from each model is saved to the userdata directory.
+    stack.enter_context(mock.patch.object(utils_userdata, 'USERDATA', directory.name))
+    stack.enter_context(mock.patch.object(utils_index.PromptServer, 'instance', self.server))
+    stack.enter_context(mock.patch.dict(config.RGTHREE_CONFIG, {'model_index': self.config}))
+    stack.enter_context(mock.patch.dict(utils_index._JOBS, clear=True))
+
+  async def run_index(self) -> dict:
+    state = utils_index.start_model_index('loras')
+    self.assertEqual(state['status'], 'running')
+    await utils_index._get_job('loras')._task
+    return utils_index.get_model_index_state('loras')
+
+  async def test_indexes_each_model_once(self):
+    state = await self.run_index()
+    self.assertEqual(state['status'], 'finished')
+    self.assertEqual((state['total'], state['done'], state['hashed']), (5, 5, 5))
+    self.assertEqual(state['errors'], 0)
+    self.assertIsNotNone(state['finished'])
+    for file in FILES:
+      path = os.path.join(self.loras, file)
+      self.assertIsNotNone(utils_hash.get_stored_sha256_hash(path))
+      with open(f'{path}.rgthree-info.json', encoding='UTF-8') as info_file:
+        self.assertEqual(json.load(info_file)['file'], file)
+    # Indexing again finds every hash stored.
+    state = await self.run_index()
+    self.assertEqual((state['done'], state['hashed']), (5, 0))
+
+  async def test_sends_progress_to_the_ui(self):
+    with mock.patch.object(utils_index, '_PROGRESS_INTERVAL', 0):
+      await self.run_index()
+    events = [event for event, _ in self.server.sent]
+    self.assertEqual(set(events), {'rgthree-index-loras'})
+    progress = [(data['status'], data['done']) for _, data in self.server.sent]
+    # Once it's listed the files, after each, and once it's done.
+    self.assertEqual(progress, [('running', i) for i in range(6)] + [('finished', 5)])
+    self.assertEqual(self.server.sent[0][1]['total'], 5)
+
+  async def test_cancel_stops_after_the_current_model(self):
+    self.config['pause_ms'] = 50
+    utils_index.start_model_index('loras')
+    job = utils_index._get_job('loras')
+    while job.done == 0:
+      await asyncio.sleep(0.01)
+    self.assertEqual(utils_index.cancel_model_index('loras')['status'], 'cancelling')
+    await job._task
+    state = utils_index.get_model_index_state('loras')
+    self.assertEqual(state['status'], 'cancelled')
+    self.assertLess(state['done'], state['total'])
+    self.assertEqual(self.server.sent[-1][1]['status'], 'cancelled')
+    # Cancelling a job that's not running does nothing.
+    self.assertEqual(utils_index.cancel_model_index('loras')['status'], 'cancelled')
+
+  async def test_hashing_is_limited_to_the_configured_rate(self):
+    self.config['max_mb_per_second'] = 2
+    get_sha256_hash_async = mock.AsyncMock(wraps=utils_hash.get_sha256_hash_async)
+    with mock.patch.object(utils_index, 'get_sha256_hash_async', get_sha256_hash_async):
+      await self.run_index()
+    self.assertEqual(get_sha256_hash_async.call_count, 5)
+    for call in get_sha256_hash_async.call_args_list:
+      self.assertEqual(call.args[1], 2 * 1024 * 1024)
+
+
+if __name__ == '__main__':
+  unittest.main()
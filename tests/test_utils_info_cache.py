@@ -0,0 +1,44 @@
+"""Tests of the cache of parsed model info files."""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from py.server import utils_info_cache
+
+
+class InfoCacheTest(unittest.TestCase):
+  """Tests of reading, and saving, info files through the cache."""
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.dir.cleanup)
+    self.path = os.path.join(self.dir.name, 'model.safetensors.rgthree-info.json')
+    self.changed = []
+    patcher = mock.patch.object(utils_info_cache, '_LISTENERS', [self.changed.append])
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_reads_are_cached_until_the_file_changes(self):
+    with open(self.path, 'w', encoding='UTF-8') as file:
+      json.dump({'name': 'cat'}, file)
+    first = utils_info_cache.read_info_file(self.path)
+    self.assertIs(utils_info_cache.read_info_file(self.path), first)
+    with open(self.path, 'w', encoding='UTF-8') as file:
+      json.dump({'name': 'a dog'}, file)
+    self.assertEqual(utils_info_cache.read_info_file(self.path), {'name': 'a dog'})
+    self.assertEqual(self.changed, [])
+
+  def test_saves_and_discards_notify_listeners(self):
+    utils_info_cache.save_info_file(self.path, {'name': 'cat'})
+    self.assertEqual(utils_info_cache.read_info_file(self.path), {'name': 'cat'})
+    os.remove(self.path)
+    utils_info_cache.discard_info_file(self.path)
+    self.assertIsNone(utils_info_cache.read_info_file(self.path))
+    self.assertEqual(self.changed, [self.path, self.path])
+
+
+if __name__ == '__main__':
+  unittest.main()
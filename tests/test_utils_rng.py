@@ -0,0 +1,83 @@
+"""Tests of the isolated, reproducible random number streams."""
+
+import unittest
+from unittest import mock
+
+from py import config
+from py import power_puter
+from py.seed import new_random_seed, new_random_seeds
+from py.utils_rng import RngService
+
+
+def get_sequences(service: RngService) -> list:
+  """Returns values from a few streams, interleaved, and from a spawned random."""
+  seeds = [service.new_seed(('seed', key), 1, 2**50) for key in ('1', '2', '1', None, '1')]
+  return [
+    *seeds,
+    service.spawn('puter').random(),
+    service.get_random('other').random(),
+    *service.new_seeds(('seed', '1'), 3, 1, 2**50),
+    service.get_numpy('other').random(),
+  ]
+
+
+class RngServiceTest(unittest.TestCase):
+  """Tests of the random number streams."""
+
+  def test_fixed_root_seed_is_reproducible(self):
+    with mock.patch.dict(config.RGTHREE_CONFIG, {'rng': {'root_seed': 123}}):
+      first = get_sequences(RngService(config.get_config_value('rng.root_seed')))
+      second = get_sequences(RngService(config.get_config_value('rng.root_seed')))
+    self.assertEqual(first, second)
+    self.assertNotEqual(first, get_sequences(RngService(456)))
+
+  def test_reseed_starts_the_streams_over(self):
+    service = RngService(123)
+    first = get_sequences(service)
+    self.assertNotEqual(get_sequences(service), first)
+    service.reseed(123)
+    self.assertEqual(get_sequences(service), first)
+
+  def test_streams_are_isolated(self):
+    service = RngService(123)
+    expected = [service.new_seed('a', 1, 100) for _ in range(5)]
+    service.reseed(123)
+    actual = []
+    for _ in range(5):
+      service.new_seed('b', 1, 100)
+      actual.append(service.new_seed('a', 1, 100))
+    self.assertEqual(actual, expected)
+
+  def test_new_seeds_are_from_the_keys_numpy_stream(self):
+    service = RngService(123)
+    seeds = service.new_seeds('a', 1000, 5, 7)
+    self.assertEqual(len(seeds), 1000)
+    self.assertEqual(set(seeds), {5, 6, 7})
+    self.assertTrue(all(isinstance(seed, int) for seed in seeds))
+    service.reseed(123)
+    service.new_seeds('b', 10, 5, 7)
+    service.new_seed('a', 5, 7)
+    self.assertEqual(service.new_seeds('a', 1000, 5, 7), seeds)
+    self.assertEqual(RngService(123).new_seeds('a', 0, 1, 2), [])
+
+  def test_seed_node_uses_its_own_stream(self):
+    with mock.patch('py.seed.rng', RngService(123)):
+      first = [new_random_seed('5') for _ in range(3)]
+    with mock.patch('py.seed.rng', RngService(123)):
+      self.assertEqual([new_random_seed('5') for _ in range(3)], first)
+
+  def test_puter_seeds_are_bulk_seeds_of_its_stream(self):
+    code = 'random.seeds(4)'
+    with mock.patch('py.seed.rng', RngService(123)):
+      seeds = power_puter._Puter(
+        code=code, ctx={}, workflow={}, prompt={}, dynprompt=None, unique_id='5'
+      ).execute()
+    with mock.patch('py.seed.rng', RngService(123)):
+      self.assertEqual(new_random_seeds(4, '5'), seeds)
+    self.assertEqual(len(set(seeds)), 4)
+    # They're always new, so the node can't be cached.
+    self.assertNotEqual(power_puter.RgthreePowerPuter.IS_CHANGED(code=code, unique_id='5'), 42)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -9,16 +9,13 @@ import { drawPlusIcon, drawRoundedRectangle, drawWidgetButton, isLowQuality, mea
 import { rgthree } from "./rgthree.js";
 const ALPHABET = "abcdefghijklmnopqrstuv".split("");
 const OUTPUT_TYPES = ["STRING", "INT", "FLOAT", "BOOLEAN", "*"];
-class RgthreePowerPuter extends RgthreeBaseServerNode {
-    constructor(title = NODE_CLASS.title) {
+class BasePowerPuter extends RgthreeBaseServerNode {
+    constructor(title) {
         super(title);
         this.stabilizeBound = this.stabilize.bind(this);
         this.addAnyInput(2);
         this.addInitialWidgets();
     }
-    static setUp(comfyClass, nodeData) {
-        RgthreeBaseServerNode.registerForOverride(comfyClass, nodeData, NODE_CLASS);
-    }
     onConnectionsChange(...args) {
         var _a;
         (_a = super.onConnectionsChange) === null || _a === void 0 ? void 0 : _a.apply(this, [...arguments]);
@@ -96,10 +93,29 @@ class RgthreePowerPuter extends RgthreeBaseServerNode {
       </ul>`;
     }
 }
+class RgthreePowerPuter extends BasePowerPuter {
+    constructor(title = RgthreePowerPuter.title) {
+        super(title);
+    }
+    static setUp(comfyClass, nodeData) {
+        RgthreeBaseServerNode.registerForOverride(comfyClass, nodeData, RgthreePowerPuter);
+    }
+}
 RgthreePowerPuter.title = NodeTypesString.POWER_PUTER;
 RgthreePowerPuter.type = NodeTypesString.POWER_PUTER;
 RgthreePowerPuter.comfyClass = NodeTypesString.POWER_PUTER;
-const NODE_CLASS = RgthreePowerPuter;
+class RgthreePowerPuterMap extends BasePowerPuter {
+    constructor(title = RgthreePowerPuterMap.title) {
+        super(title);
+    }
+    static setUp(comfyClass, nodeData) {
+        RgthreeBaseServerNode.registerForOverride(comfyClass, nodeData, RgthreePowerPuterMap);
+    }
+}
+RgthreePowerPuterMap.title = NodeTypesString.POWER_PUTER_MAP;
+RgthreePowerPuterMap.type = NodeTypesString.POWER_PUTER_MAP;
+RgthreePowerPuterMap.comfyClass = NodeTypesString.POWER_PUTER_MAP;
+const NODE_CLASSES = [RgthreePowerPuter, RgthreePowerPuterMap];
 const OUTPUTS_WIDGET_CHIP_HEIGHT = LiteGraph.NODE_WIDGET_HEIGHT - 4;
 const OUTPUTS_WIDGET_CHIP_SPACE = 4;
 const OUTPUTS_WIDGET_CHIP_ARROW_WIDTH = 5.5;
@@ -307,8 +323,11 @@ class OutputsWidget extends RgthreeBaseWidget {
 app.registerExtension({
     name: "rgthree.PowerPuter",
     async beforeRegisterNodeDef(nodeType, nodeData) {
-        if (nodeData.name === NODE_CLASS.type) {
-            NODE_CLASS.setUp(nodeType, nodeData);
+        for (const nodeClass of NODE_CLASSES) {
+            if (nodeData.name === nodeClass.type) {
+                nodeClass.setUp(nodeType, nodeData);
+                break;
+            }
         }
     },
 });